@@ -0,0 +1,123 @@
+import os
+import random
+from dataclasses import dataclass
+from os import path
+from typing import Final, List
+
+FILES_PER_DIR: Final = 100
+
+NAMES: Final = (
+    "connect",
+    "close",
+    "flush",
+    "load",
+    "store",
+    "parse",
+    "render",
+    "execute",
+    "fetch",
+    "update",
+)
+ARGS: Final = ("self", "host", "port", "timeout", "data", "key", "value", "loop")
+
+
+@dataclass
+class CorpusSpec:
+    """Shape of a synthetic tree: `files` modules of about `lines` lines,
+    with blocks nested up to `depth` levels."""
+
+    name: str
+    files: int
+    lines: int
+    depth: int = 3
+    seed: int = 0
+
+
+PRESETS: Final = {
+    x.name: x
+    for x in (
+        CorpusSpec("small", 200, 50),
+        CorpusSpec("medium", 1_000, 300),
+        CorpusSpec("huge-files", 10, 50_000),
+        CorpusSpec("deep", 200, 300, depth=40),
+        CorpusSpec("10k", 10_000, 100),
+        CorpusSpec("1m", 1_000_000, 20),
+    )
+}
+
+
+class ModuleWriter:
+    def __init__(self, rng: random.Random, depth: int) -> None:
+        self.rng = rng
+        self.depth = depth
+        self.lines: List[str] = []
+
+    def name(self) -> str:
+        return f"{self.rng.choice(NAMES)}_{self.rng.randrange(100)}"
+
+    def args(self, first: str = "") -> str:
+        args = self.rng.sample(ARGS[1:], self.rng.randrange(4))
+        return ", ".join([first, *args] if first else args)
+
+    def emit(self, indent: int, line: str) -> None:
+        self.lines.append("    " * indent + line)
+
+    def statement(self, indent: int) -> None:
+        kind = self.rng.random()
+        if kind < 0.4:
+            self.emit(indent, f"{self.rng.choice(ARGS)} = {self.name()}({self.args()})")
+        elif kind < 0.6:
+            self.emit(indent, f"print({self.rng.choice(ARGS)!r}, {self.args()})")
+        else:
+            self.emit(indent, f"return {self.rng.choice(ARGS)}.{self.name()}()")
+
+    def block(self, indent: int, budget: int) -> None:
+        """Nested if/for blocks down to `depth`, then plain statements."""
+        self.statement(indent)
+        if indent < self.depth and budget > 2:
+            header = self.rng.choice(("if data:", "for key in data:", "while loop:"))
+            self.emit(indent, header)
+            self.block(indent + 1, budget - 2)
+
+    def function(self, indent: int, method: bool) -> None:
+        self.emit(indent, f"def {self.name()}({self.args('self' if method else '')}):")
+        self.block(indent + 1, self.rng.randrange(3, 12) + 2 * self.depth)
+
+    def klass(self) -> None:
+        name = self.rng.choice(NAMES).title()
+        self.emit(0, f"class {name}{self.rng.randrange(100)}:")
+        for _ in range(self.rng.randrange(1, 5)):
+            self.function(1, method=True)
+
+    def module(self, lines: int) -> str:
+        self.emit(0, "import os")
+        while len(self.lines) < lines:
+            if self.rng.random() < 0.3:
+                self.klass()
+            else:
+                self.function(0, method=False)
+            self.lines.append("")
+        return "\n".join(self.lines) + "\n"
+
+
+def module_source(spec: CorpusSpec, index: int) -> str:
+    # seeded per file, so any one file can be regenerated on its own
+    rng = random.Random(f"{spec.seed}:{index}")
+    return ModuleWriter(rng, spec.depth).module(spec.lines)
+
+
+def generate(spec: CorpusSpec, root: str) -> List[str]:
+    """Write the corpus under `root`, FILES_PER_DIR modules per directory.
+    The same spec always produces byte-identical files."""
+    files = []
+    for i in range(spec.files):
+        dirpath = path.join(root, f"pkg{i // FILES_PER_DIR}")
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(dirpath, exist_ok=True)
+
+        filepath = path.join(dirpath, f"mod{i % FILES_PER_DIR}.py")
+        with open(filepath, "w") as f:
+            f.write(module_source(spec, i))
+        files.append(filepath)
+
+    return files
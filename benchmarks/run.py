@@ -0,0 +1,218 @@
+import ast
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Final, List, Optional, Tuple
+import click
+from benchmarks.corpus import PRESETS, generate
+from src.discover import walk_files
+from src.match import MatchPatterns
+from src.render import Rendering, render_file
+from src.search import (
+    EXECUTOR_PROCESS,
+    EXECUTOR_SERIAL,
+    EXECUTORS,
+    Result,
+    SearchConfig,
+    get_py_file,
+    gil_disabled,
+    parse_patterns,
+    search_files,
+)
+
+DEFAULT_PATTERNS: Final = ("def", "call $print", "class $*5", "$self")
+DEFAULT_THRESHOLD: Final = 0.1
+ROOT_DIR: Final = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+Timing = Dict[str, float]
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Timing:
+    """Best and median wall time of `repeat` runs; the best is what
+    regressions are judged on, being the least disturbed by noise."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs)}
+
+
+def read_sources(files: List[str]) -> List[bytes]:
+    sources = []
+    for filepath in files:
+        with open(filepath, "rb") as f:
+            sources.append(f.read())
+    return sources
+
+
+def end_to_end(root: str, patterns: List[str], executor: str, jobs: int) -> None:
+    config = SearchConfig(parse_patterns(patterns), jobs=jobs, executor=executor)
+    for _ in search_files(walk_files(root), config):
+        pass
+
+
+def run_cli(*args: str) -> None:
+    """One sgrep run in a fresh interpreter, the way an editor calls it,
+    so interpreter startup and imports count. No cache or daemon, each run
+    starts cold."""
+    subprocess.run(
+        [sys.executable, *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        env={**os.environ, "PYTHONPATH": ROOT_DIR},
+    )
+
+
+def run_stages(
+    root: str,
+    patterns: List[str],
+    jobs: List[int],
+    repeat: int,
+    executors: Tuple[str, ...] = (EXECUTOR_PROCESS,),
+) -> Dict[str, Timing]:
+    """Time each stage of a search over `root` in isolation, then whole
+    searches on each executor at each worker count."""
+    timings: Dict[str, Timing] = {}
+
+    timings["compile"] = measure(
+        lambda: MatchPatterns.create(parse_patterns(patterns)), repeat
+    )
+
+    files = get_py_file(root)
+    timings["discover"] = measure(lambda: get_py_file(root), repeat)
+
+    sources = read_sources(files)
+    timings["parse"] = measure(lambda: [ast.parse(x) for x in sources], repeat)
+
+    trees = [ast.parse(x) for x in sources]
+    matcher = MatchPatterns.create(parse_patterns(patterns))
+    timings["match"] = measure(
+        lambda: [matcher.search_tagged(x) for x in trees], repeat
+    )
+
+    found = [
+        (x, src, matcher.search_tagged(tree))
+        for x, src, tree in zip(files, sources, trees)
+    ]
+    timings["render"] = measure(
+        lambda: [
+            Result(x, *render_file(m, src, Rendering())).format()
+            for x, src, m in found
+        ],
+        repeat,
+    )
+
+    # startup: importing the CLI, and a whole run over the corpus's first
+    # file; compare `python -X importtime -m src.main` when they regress
+    timings["import"] = measure(lambda: run_cli("-c", "import src.main"), repeat)
+    timings["one_file"] = measure(
+        lambda: run_cli("-m", "src.main", "--no-cache", patterns[0], files[0]), repeat
+    )
+
+    for executor in executors:
+        # a serial search has one worker however many are asked for
+        counts = [1] if executor == EXECUTOR_SERIAL else jobs
+        for n in counts:
+            timings[f"end_to_end[{executor},jobs={n}]"] = measure(
+                lambda: end_to_end(root, patterns, executor, n), repeat
+            )
+
+    return timings
+
+
+def compare(
+    timings: Dict[str, Timing], baseline: Dict[str, Timing], threshold: float
+) -> List[Tuple[str, float, float]]:
+    """Stages whose best time grew by more than `threshold` over the
+    baseline, as (stage, baseline, current)."""
+    regressions = []
+    for stage, timing in timings.items():
+        before = baseline.get(stage)
+        if before and timing["min"] > before["min"] * (1 + threshold):
+            regressions.append((stage, before["min"], timing["min"]))
+    return regressions
+
+
+@click.command()
+@click.option("--corpus", "corpus", type=click.Choice(list(PRESETS)), default="small")
+@click.option("--root", "root", type=click.Path(file_okay=False))
+@click.option("-e", "--pattern", "patterns", multiple=True)
+@click.option("--jobs", "jobs", type=click.IntRange(min=1), multiple=True)
+@click.option("--executor", "executors", type=click.Choice(EXECUTORS), multiple=True)
+@click.option("--repeat", "repeat", type=click.IntRange(min=1), default=3)
+@click.option("-o", "--output", "output", type=click.Path(dir_okay=False))
+@click.option("--baseline", "baseline", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", "threshold", type=click.FLOAT, default=DEFAULT_THRESHOLD)
+def main(
+    corpus: str,
+    root: Optional[str],
+    patterns: Tuple[str, ...],
+    jobs: Tuple[int, ...],
+    executors: Tuple[str, ...],
+    repeat: int,
+    output: Optional[str],
+    baseline: Optional[str],
+    threshold: float,
+) -> None:
+    """Benchmark sgrep's stages on a generated corpus. With --root the
+    corpus is generated there once and reused by later runs."""
+    spec = PRESETS[corpus]
+    workers = list(jobs) or sorted({1, os.cpu_count() or 1})
+
+    with tempfile.TemporaryDirectory() as scratch:
+        tree = root or scratch
+        if not (root and os.path.isdir(root) and os.listdir(root)):
+            generate(spec, tree)
+
+        timings = run_stages(
+            tree,
+            list(patterns or DEFAULT_PATTERNS),
+            workers,
+            repeat,
+            executors or (EXECUTOR_PROCESS,),
+        )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "gil_disabled": gil_disabled(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "corpus": asdict(spec),
+        "patterns": list(patterns or DEFAULT_PATTERNS),
+        "repeat": repeat,
+        "timings": timings,
+    }
+
+    for stage, timing in timings.items():
+        best, median = timing["min"], timing["median"]
+        click.echo(f"{stage:32} {best:9.4f}s  (median {median:.4f}s)")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        with open(baseline, "r") as f:
+            regressions = compare(timings, json.load(f)["timings"], threshold)
+        for stage, before, after in regressions:
+            click.echo(
+                f"regression: {stage} {before:.4f}s -> {after:.4f}s "
+                f"(+{(after / before - 1) * 100:.0f}%)",
+                err=True,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import atexit
+import os
+import threading
+from functools import lru_cache
+from itertools import chain
+from os import path
+from typing import TYPE_CHECKING, Callable, Dict, Final, Iterable, Iterator, List
+from typing import NamedTuple, Optional, Sequence, Tuple, Union
+from src.archive import ArchiveTask, expand_archives
+from src.cache import ParseCache
+from src.discover import Discovery, walk_files
+from src.index import StructuralIndex, has_qualified, index_file
+from src.match import MatchPatterns, Matcher
+from src.notebook import cell_location
+from src.render import Match, Rendering
+from src.search import (
+    EXECUTOR_SERIAL,
+    MAX_TASKS_PER_WORKER,
+    STREAM_CHUNK_BYTES,
+    FileError,
+    Nodes,
+    Outcome,
+    Result,
+    SearchConfig,
+    batch_files,
+    default_executor,
+    get_py_file,
+    is_small,
+    match_archive,
+    match_file,
+    parse_patterns,
+    pattern_literals,
+    run_tasks,
+    start_pool,
+)
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+
+PATTERN_CACHE_SIZE: Final = 256
+
+
+class FileMatch(NamedTuple):
+    """One match, with the file it was found in."""
+
+    filename: str
+    lineno: int
+    col_offset: int
+    end_lineno: Optional[int]
+    kind: str
+    snippet: str
+    pattern: str
+    # code cell number in a notebook, whose line numbers count from its cell
+    cell: Optional[int] = None
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_patterns(sources: Tuple[str, ...]) -> Tuple[Nodes, List[bytes]]:
+    """Parsed pattern and its required literals, memoized so a repeated
+    query skips Tokenize and Parser. Each worker process keeps its own
+    cache."""
+    pattern = parse_patterns(list(sources))
+    return pattern, pattern_literals(pattern)
+
+
+def create_matcher(sources: Tuple[str, ...]) -> Matcher:
+    return MatchPatterns.create(compile_patterns(sources)[0])
+
+
+_local = threading.local()
+
+
+def thread_matcher(sources: Tuple[str, ...]) -> Matcher:
+    """The matcher for `sources`, memoized per thread: a matcher holds
+    state for the file it is searching, such as its resolved calls, so a
+    thread pool's workers can't share one."""
+    create = getattr(_local, "create_matcher", None)
+    if create is None:
+        create = lru_cache(maxsize=PATTERN_CACHE_SIZE)(create_matcher)
+        _local.create_matcher = create
+    return create(sources)
+
+
+# the tasks a shared pool runs carry their pattern, unlike search_files'
+# whose workers are initialized with one
+Task = Tuple[Tuple[str, ...], SearchConfig, List[Union[str, ArchiveTask]]]
+
+
+def search_batch(task: Task) -> List[Outcome]:
+    sources, config, batch = task
+    pattern, literals = compile_patterns(sources)
+    if config.pattern == pattern:
+        matcher = thread_matcher(sources)
+    else:
+        # qualified against the searched tree, so not what `sources` compile to
+        matcher = MatchPatterns.create(config.pattern)
+        literals = pattern_literals(config.pattern)
+
+    results: List[Outcome] = []
+    for x in batch:
+        if isinstance(x, str):
+            results.append(match_file(x, config, matcher, literals))
+        else:
+            results.extend(match_archive(x, config, matcher, literals))
+    return results
+
+
+# by executor and number of workers; a pool is never replaced while it
+# lives, since an earlier search's iterator may still be draining it
+_pools: Dict[Tuple[str, int], "Pool"] = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(executor: str, processes: int) -> "Pool":
+    """The pool shared by every search call with this executor and number
+    of workers, started by the first of them."""
+    with _pool_lock:
+        pool = _pools.get((executor, processes))
+        if pool is None:
+            pool = start_pool(executor, processes, max_tasks=MAX_TASKS_PER_WORKER)
+            _pools[executor, processes] = pool
+        return pool
+
+
+@atexit.register
+def shutdown() -> None:
+    """Stop the shared pools; the next search starts a new one."""
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.terminate()
+            pool.join()
+        _pools.clear()
+
+
+def qualify_patterns(
+    pattern: Nodes,
+    roots: List[str],
+    cache: Optional[ParseCache],
+    executor: Optional[str],
+) -> Nodes:
+    """`pattern` with each qualified call name also matching the names
+    modules under `roots` re-export it under. Like the CLI without an
+    index, they're read from one built for this search and dropped."""
+    scratch = StructuralIndex(path.commonpath([path.abspath(x) for x in roots]))
+    tasks = [(x, cache) for root in roots for x in get_py_file(root)]
+    for filename, stamp, entries, exports, _ in run_tasks(index_file, tasks, executor):
+        scratch.add_file(filename, stamp, entries, exports)
+    return scratch.qualify(pattern)
+
+
+def search(
+    patterns: Union[str, Sequence[str]],
+    paths: Union[str, Sequence[str]] = ".",
+    *,
+    limit: Optional[int] = None,
+    discovery: Optional[Discovery] = None,
+    rendering: Optional[Rendering] = None,
+    cache: Optional[ParseCache] = None,
+    jobs: Optional[int] = None,
+    executor: Optional[str] = None,
+    ordered: bool = False,
+    timeout: Optional[float] = None,
+    on_error: Optional[Callable[[FileError], None]] = None,
+) -> Iterator[FileMatch]:
+    """Search `paths` for one or more patterns, yielding matches lazily as
+    files complete. An invalid pattern raises SgrepParseError here, before
+    any file is read.
+
+    Files that can't be read or parsed, or take longer than `timeout`
+    seconds, are passed to `on_error` if given, and skipped otherwise.
+    Abandoning the iterator leaves batches already handed to the shared
+    pool to finish in the background."""
+    sources = (patterns,) if isinstance(patterns, str) else tuple(patterns)
+    roots = [paths] if isinstance(paths, str) else list(paths)
+    pattern, _ = compile_patterns(sources)
+    if roots and has_qualified(pattern):
+        pattern = qualify_patterns(pattern, roots, cache, executor)
+
+    config = SearchConfig(
+        pattern,
+        cache,
+        limit,
+        jobs=jobs,
+        rendering=rendering or Rendering(),
+        executor=executor,
+        timeout=timeout,
+    )
+    return iter_matches(sources, roots, config, discovery, ordered, on_error)
+
+
+def file_match(result: Result, match: Match) -> FileMatch:
+    if not result.cells:
+        return FileMatch(result.filename, *match)
+
+    cell, lineno = cell_location(result.cells, match.lineno)
+    end = match.end_lineno and match.end_lineno - match.lineno + lineno
+    shifted = match._replace(lineno=lineno, end_lineno=end)
+    return FileMatch(result.filename, *shifted, cell)
+
+
+def iter_matches(
+    sources: Tuple[str, ...],
+    roots: List[str],
+    config: SearchConfig,
+    discovery: Optional[Discovery],
+    ordered: bool,
+    on_error: Optional[Callable[[FileError], None]],
+) -> Iterator[FileMatch]:
+    entries: Iterable[Tuple[Union[str, ArchiveTask], int]] = chain.from_iterable(
+        walk_files(x, discovery) for x in roots
+    )
+    if discovery and discovery.search_zip:
+        entries = expand_archives(entries, discovery, STREAM_CHUNK_BYTES)
+    executor = config.executor
+    if executor is None:
+        entries, small = is_small(entries)
+        executor = EXECUTOR_SERIAL if small else default_executor()
+
+    tasks = (
+        (sources, config, batch)
+        for batch in batch_files(entries, STREAM_CHUNK_BYTES)
+    )
+
+    processes = config.jobs or os.cpu_count() or 1
+    if processes <= 1 or executor == EXECUTOR_SERIAL:
+        done: Iterable[List[Outcome]] = map(search_batch, tasks)
+    else:
+        pool = get_pool(executor, processes)
+        done = (pool.imap if ordered else pool.imap_unordered)(search_batch, tasks)
+
+    for batch in done:
+        for result in batch:
+            if isinstance(result, FileError):
+                if on_error:
+                    on_error(result)
+                continue
+
+            assert isinstance(result, Result)
+            for match in result.matches:
+                yield file_match(result, match)
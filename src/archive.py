@@ -0,0 +1,129 @@
+from typing import Final, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from typing import Union
+from src.discover import ZIP_SUFFIXES, Discovery, FileEntry, is_archive, path_filter
+
+# between an archive's path and a member's path inside it
+MEMBER_SEP: Final = "!"
+
+
+class ArchiveTask(NamedTuple):
+    """Members of one archive for a worker to read and match: the listed
+    ones of a zip, or for a tarball, which can only be read front to back,
+    every member `discovery` keeps."""
+
+    archive: str
+    members: Optional[List[str]]
+    discovery: Discovery
+
+
+# what a worker is handed: a file's path, or members of an archive
+Task = Union[str, ArchiveTask]
+
+
+def member_name(archive: str, member: str) -> str:
+    return f"{archive}{MEMBER_SEP}{member}"
+
+
+def is_member(filename: str) -> bool:
+    """Whether `filename` names a file inside an archive, which has no
+    stat of its own."""
+    i = filename.find(MEMBER_SEP)
+    while i != -1:
+        if is_archive(filename[:i]):
+            return True
+        i = filename.find(MEMBER_SEP, i + 1)
+    return False
+
+
+def archive_errors() -> Tuple[type, ...]:
+    """What reading a corrupt or truncated archive can raise."""
+    import tarfile
+    import zipfile
+    import zlib
+
+    return (
+        OSError,
+        EOFError,
+        ValueError,
+        zlib.error,
+        zipfile.BadZipFile,
+        tarfile.TarError,
+    )
+
+
+def zip_tasks(
+    archive: str, discovery: Discovery, target: int
+) -> Iterator[Tuple[ArchiveTask, int]]:
+    """A zip's members in tasks of about `target` uncompressed bytes, listed
+    from its central directory without decompressing anything, so one
+    large archive is still spread across workers."""
+    import zipfile
+
+    keep = path_filter(discovery)
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            infos = zf.infolist()
+    except archive_errors():
+        # the worker reopens it and reports why it can't be read
+        yield ArchiveTask(archive, None, discovery), 0
+        return
+
+    batch: List[str] = []
+    batch_bytes = 0
+    for info in infos:
+        if info.is_dir() or not keep(info.filename):
+            continue
+        if discovery.is_too_large(info.file_size):
+            continue
+        batch.append(info.filename)
+        batch_bytes += info.file_size
+        if batch_bytes >= target:
+            yield ArchiveTask(archive, batch, discovery), batch_bytes
+            batch, batch_bytes = [], 0
+
+    if batch:
+        yield ArchiveTask(archive, batch, discovery), batch_bytes
+
+
+def expand_archives(
+    entries: Iterable[FileEntry], discovery: Discovery, target: int
+) -> Iterator[Tuple[Task, int]]:
+    """`entries` with each archive replaced by tasks for its members."""
+    for filepath, size in entries:
+        if not is_archive(filepath):
+            yield filepath, size
+        elif filepath.lower().endswith(ZIP_SUFFIXES):
+            yield from zip_tasks(filepath, discovery, target)
+        else:
+            yield ArchiveTask(filepath, None, discovery), size
+
+
+def read_members(task: ArchiveTask) -> Iterator[Tuple[str, bytes]]:
+    """(virtual filename, source) of each member of `task`, decompressed
+    one at a time straight from the archive."""
+    archive = task.archive
+
+    if task.members is not None or archive.lower().endswith(ZIP_SUFFIXES):
+        import zipfile
+
+        with zipfile.ZipFile(archive) as zf:
+            keep = path_filter(task.discovery)
+            for member in task.members or zf.namelist():
+                if task.members is None and not keep(member):
+                    continue
+                yield member_name(archive, member), zf.read(member)
+        return
+
+    import tarfile
+
+    keep = path_filter(task.discovery)
+    # streamed, so a compressed tarball is never seeked back into
+    with tarfile.open(archive, "r|*") as tf:
+        for info in tf:
+            if not info.isfile() or not keep(info.name):
+                continue
+            if task.discovery.is_too_large(info.size):
+                continue
+            f = tf.extractfile(info)
+            if f is not None:
+                yield member_name(archive, info.name), f.read()
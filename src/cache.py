@@ -0,0 +1,192 @@
+import hashlib
+import os
+import pickle
+import zlib
+from ast import AST, parse
+from dataclasses import dataclass
+from os import path
+from typing import Final, List, Optional, Tuple
+
+CACHE_DIR: Final = ".sgrep-cache"
+CACHE_MAX_BYTES: Final = 256 * 1024 * 1024
+TREE_SUFFIX: Final = ".tree"
+# entries keyed by content alone, e.g. notebook cells, which have no file
+FRAGMENT_DIR: Final = "fragments"
+
+# what reading and parsing a single bad file can raise; UnicodeDecodeError
+# is a ValueError, as is the null bytes error from compile
+PARSE_ERRORS: Final = (OSError, SyntaxError, ValueError, RecursionError)
+
+
+@dataclass
+class CacheStamp:
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+def content_digest(src: bytes) -> str:
+    return hashlib.blake2b(src, digest_size=16).hexdigest()
+
+
+def read_source(filepath: str) -> bytes:
+    # bytes go straight to ast.parse, which honors coding cookies and BOMs
+    with open(filepath, "rb") as f:
+        return f.read()
+
+
+def parse_file(
+    filepath: str, cache: Optional["ParseCache"] = None, src: Optional[bytes] = None
+) -> AST:
+    if cache:
+        return cache.parse(filepath, src)
+
+    return parse(read_source(filepath) if src is None else src, filepath)
+
+
+class ParseCache:
+    """On-disk store of parsed trees, one zlib-compressed pickle per source
+    file. Entries are keyed by absolute path and validated against the file's
+    size, mtime and content hash; entry mtimes double as LRU access times."""
+
+    def __init__(self, root: str, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        # per process, for --stats
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, filepath: str) -> str:
+        key = hashlib.sha1(path.abspath(filepath).encode()).hexdigest()
+        return path.join(self.root, key[:2], key[2:] + TREE_SUFFIX)
+
+    def load(self, entry: str) -> Optional[Tuple[CacheStamp, bytes]]:
+        try:
+            with open(entry, "rb") as f:
+                size, mtime_ns, digest, blob = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        return CacheStamp(size, mtime_ns, digest), blob
+
+    def store(self, entry: str, stamp: CacheStamp, blob: bytes) -> None:
+        # imported on first write, a search that only hits never needs it
+        import tempfile
+
+        tmp = None
+        try:
+            os.makedirs(path.dirname(entry), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.dirname(entry))
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(
+                    (stamp.size, stamp.mtime_ns, stamp.digest, blob),
+                    f,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp, entry)
+            tmp = None
+        except OSError:
+            # a read-only or full cache dir must never fail the search
+            pass
+        finally:
+            # also when interrupted midway, e.g. by a --timeout alarm
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def touch(self, entry: str) -> None:
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def parse(self, filepath: str, src: Optional[bytes] = None) -> AST:
+        """Tree for `filepath`, from the cache when it's unchanged. `src` is
+        the file's content when the caller has already read it."""
+        entry = self.entry_path(filepath)
+        st = os.stat(filepath)
+        cached = self.load(entry)
+
+        if cached:
+            stamp, blob = cached
+            if stamp.size == st.st_size and stamp.mtime_ns == st.st_mtime_ns:
+                self.touch(entry)
+                self.hits += 1
+                return pickle.loads(zlib.decompress(blob))
+
+        if src is None:
+            src = read_source(filepath)
+
+        digest = content_digest(src)
+
+        if cached and cached[0].digest == digest:
+            # touched but unchanged, refresh the stamp and keep the tree
+            tree = pickle.loads(zlib.decompress(cached[1]))
+            stamp = CacheStamp(st.st_size, st.st_mtime_ns, digest)
+            self.store(entry, stamp, cached[1])
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        tree = parse(src, filepath)
+        blob = zlib.compress(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL), 1)
+        self.store(entry, CacheStamp(st.st_size, st.st_mtime_ns, digest), blob)
+        return tree
+
+    def parse_fragment(self, src: bytes, filename: str) -> AST:
+        """Tree for a piece of source that isn't a file of its own, such as
+        a notebook cell, keyed by its content so an unchanged cell hits even
+        when the rest of its notebook was edited."""
+        digest = content_digest(src)
+        entry = path.join(self.root, FRAGMENT_DIR, digest[:2], digest[2:] + TREE_SUFFIX)
+        cached = self.load(entry)
+
+        if cached and cached[0].digest == digest:
+            self.touch(entry)
+            self.hits += 1
+            return pickle.loads(zlib.decompress(cached[1]))
+
+        self.misses += 1
+        tree = parse(src, filename)
+        blob = zlib.compress(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL), 1)
+        self.store(entry, CacheStamp(len(src), 0, digest), blob)
+        return tree
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        found = []
+        for root, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(TREE_SUFFIX):
+                    continue
+                entry = path.join(root, f)
+                try:
+                    st = os.stat(entry)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, entry))
+        return found
+
+    def evict(self) -> int:
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(entry)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        return evicted
+
+    def clear(self) -> None:
+        for _, _, entry in self.entries():
+            try:
+                os.unlink(entry)
+            except OSError:
+                continue
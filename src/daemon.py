@@ -0,0 +1,252 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from ast import AST
+from os import path
+from typing import Any, Dict, Final, Iterator, List, Optional, Tuple
+from src.cache import PARSE_ERRORS, ParseCache, read_source
+from src.index import file_stamp, is_under
+from src.match import MatchPatterns
+from src.notebook import Cells, parse_source
+from src.parse import SgrepParseError
+from src.render import Rendering, render_file
+from src.search import Result, get_py_file, parse_patterns
+
+WATCH_INTERVAL: Final = 1.0
+# how long a root only queried, not served, is watched after its last query
+ROOT_TTL: Final = 10 * 60.0
+
+
+class SgrepDaemonError(Exception):
+    pass
+
+
+class TreeStore:
+    """Parsed trees kept resident between queries. Every query and every
+    watcher tick re-stats its root and reparses only files whose size or
+    mtime moved, so queries never pay for parsing unchanged files.
+
+    The roots it was started with are watched for good; a root outside
+    them is watched while it keeps being queried and dropped, trees and
+    all, once `ttl` seconds pass without a query."""
+
+    def __init__(self, cache: Optional[ParseCache], ttl: float = ROOT_TTL) -> None:
+        self.cache = cache
+        self.ttl = ttl
+        # stamp, source, tree and notebook cells; the source is kept to
+        # render matches from
+        self.trees: Dict[str, Tuple[Tuple[int, int], bytes, Optional[AST], Cells]] = {}
+        # when each root was last queried, None for the ones served
+        self.roots: Dict[str, Optional[float]] = {}
+        self.lock = threading.Lock()
+
+    def track(self, scope: str, served: bool = False) -> None:
+        """Watch `scope`, or renew the root it's under."""
+        with self.lock:
+            root = next((x for x in self.roots if is_under(scope, x)), scope)
+            if served:
+                self.roots[root] = None
+            elif root not in self.roots or self.roots[root] is not None:
+                self.roots[root] = time.monotonic()
+
+    def expire(self) -> None:
+        """Stop watching roots that went unqueried for `ttl` seconds and
+        drop the trees no other root covers."""
+        now = time.monotonic()
+
+        with self.lock:
+            stale = [
+                root
+                for root, queried in self.roots.items()
+                if queried is not None and now - queried > self.ttl
+            ]
+            if not stale:
+                return
+
+            for root in stale:
+                del self.roots[root]
+            for filename in list(self.trees):
+                if not any(is_under(filename, x) for x in self.roots):
+                    del self.trees[filename]
+
+    def load(self, filepath: str) -> Tuple[bytes, Optional[AST], Cells]:
+        try:
+            src = read_source(filepath)
+        except OSError:
+            return b"", None, []
+
+        try:
+            return parse_source(filepath, self.cache, src)
+        except PARSE_ERRORS:
+            # unparsable files are kept, treeless, until they change
+            return src, None, []
+
+    def refresh(self, scope: str) -> List[str]:
+        files = get_py_file(scope)
+        present = set(files)
+
+        with self.lock:
+            for filename in files:
+                try:
+                    stamp = file_stamp(filename)
+                except OSError:
+                    continue
+
+                known = self.trees.get(filename)
+                if known is None or known[0] != stamp:
+                    self.trees[filename] = (stamp, *self.load(filename))
+
+            for filename in [x for x in self.trees if is_under(x, scope)]:
+                if filename not in present:
+                    del self.trees[filename]
+
+        return files
+
+    def watch(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.expire()
+            with self.lock:
+                roots = list(self.roots)
+            for root in roots:
+                try:
+                    self.refresh(root)
+                except OSError:
+                    # surfaced to the client by the next query instead
+                    continue
+
+    def search(self, request: Dict[str, Any]) -> Iterator[str]:
+        cwd = request["cwd"]
+        filepath = request["filepath"]
+        scope = path.normpath(path.join(cwd, filepath))
+
+        visitor = MatchPatterns.create(parse_patterns(request["patterns"]))
+        rendering = Rendering(request["before"], request["after"], request["full"])
+        self.track(scope)
+        files = self.refresh(scope)
+        total = 0
+
+        if request["sort"]:
+            files.sort()
+
+        for filename in files:
+            known = self.trees.get(filename)
+            if known is None or known[2] is None:
+                continue
+
+            _, src, tree, cells = known
+            matches = visitor.search_tagged(tree, request["limit"], filename)
+            if not matches:
+                continue
+
+            if not path.isabs(filepath):
+                filename = path.relpath(filename, cwd)
+
+            if request["count"]:
+                total += len(matches)
+            elif request["files_with_matches"]:
+                yield Result(filename, []).format_name()
+            else:
+                rendered, context = render_file(matches, src, rendering)
+                yield Result(filename, rendered, context, cells).format()
+
+        if request["count"]:
+            yield str(total)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, reply: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    def handle(self) -> None:
+        store: TreeStore = self.server.store  # type: ignore
+
+        try:
+            request = json.loads(self.rfile.readline())
+            for out in store.search(request):
+                self.send({"out": out})
+        except (OSError, SyntaxError, ValueError, SgrepParseError) as e:
+            self.send({"error": str(e)})
+
+        self.send({"end": True})
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, sockpath: str, store: TreeStore) -> None:
+        super().__init__(sockpath, RequestHandler)
+        self.store = store
+
+
+def connect(sockpath: str) -> Optional[socket.socket]:
+    if not path.exists(sockpath):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sockpath)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def serve(
+    sockpath: str,
+    roots: List[str],
+    cache: Optional[ParseCache],
+    interval: float = WATCH_INTERVAL,
+) -> None:
+    running = connect(sockpath)
+    if running:
+        running.close()
+        raise SgrepDaemonError(f"A daemon is already listening on {sockpath}")
+    if path.exists(sockpath):
+        # left behind by a daemon that didn't shut down cleanly
+        os.unlink(sockpath)
+
+    store = TreeStore(cache)
+    for root in roots:
+        store.track(path.abspath(root), served=True)
+        store.refresh(path.abspath(root))
+
+    threading.Thread(target=store.watch, args=(interval,), daemon=True).start()
+
+    # exit through serve_forever's finally so the socket is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    os.makedirs(path.dirname(sockpath), exist_ok=True)
+    with DaemonServer(sockpath, store) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(sockpath)
+
+
+def query(sockpath: str, request: Dict[str, Any]) -> Optional[Iterator[str]]:
+    """Forward a search to a running daemon and yield its output, or None
+    when no daemon is listening."""
+    sock = connect(sockpath)
+    if sock is None:
+        return None
+
+    def replies() -> Iterator[str]:
+        with sock, sock.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+
+            for line in stream:
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise SgrepDaemonError(reply["error"])
+                if "end" in reply:
+                    return
+                yield reply["out"]
+
+    return replies()
@@ -0,0 +1,285 @@
+import os
+import re
+from dataclasses import dataclass, field
+from os import path
+from typing import Callable, Final, Iterator, List, Optional, Pattern, Tuple
+
+PYTHON_SUFFIX: Final = ".py"
+ALLOWED_SUFFIXES: Final = (PYTHON_SUFFIX, ".pyi", ".out", ".diff", ".ipynb")
+ZIP_SUFFIXES: Final = (".whl", ".zip")
+ARCHIVE_SUFFIXES: Final = (
+    *ZIP_SUFFIXES,
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tar.xz",
+)
+
+IGNORE_FILES: Final = (".gitignore", ".ignore")
+
+# never worth descending into, ignore files or not
+PRUNED_DIRS: Final = frozenset(
+    (
+        ".git",
+        ".hg",
+        ".svn",
+        "__pycache__",
+        "node_modules",
+        ".venv",
+        ".tox",
+        ".nox",
+        ".mypy_cache",
+        ".pytest_cache",
+        ".ruff_cache",
+        ".sgrep-cache",
+    )
+)
+
+FileEntry = Tuple[str, int]
+
+
+def is_archive(filepath: str) -> bool:
+    return filepath.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def is_source(filepath: str) -> bool:
+    # case-insensitive, as walk_files matches suffixes
+    return filepath.lower().endswith(ALLOWED_SUFFIXES)
+
+
+def translate(pattern: str) -> str:
+    """Regex source for a gitignore glob: `*` and `?` stop at `/`, `**`
+    crosses directories."""
+    out = []
+    i = 0
+
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[" and "]" in pattern[i + 1 :]:
+            end = pattern.index("]", i + 1)
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = end + 1
+        elif c == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+
+    return "".join(out)
+
+
+@dataclass
+class IgnoreRule:
+    regex: Pattern[str]
+    negated: bool
+    dir_only: bool
+    # the rule sees paths relative to its own directory: `strip` is that
+    # directory relative to the walk root, `lead` the walk root relative
+    # to it when the rule comes from an ancestor of the root
+    strip: str = ""
+    lead: str = ""
+
+    def matches(self, relpath: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return bool(self.regex.fullmatch(self.lead + relpath[len(self.strip) :]))
+
+
+def parse_rule(line: str, strip: str = "", lead: str = "") -> Optional[IgnoreRule]:
+    line = line.rstrip("\n")
+    if not line.endswith("\\ "):
+        line = line.rstrip()
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith("\\"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # a slash anywhere but the end anchors the rule to its directory
+    anchored = "/" in line
+    source = translate(line.lstrip("/"))
+    if not anchored:
+        source = "(?:.*/)?" + source
+
+    return IgnoreRule(re.compile(source), negated, dir_only, strip, lead)
+
+
+def load_rules(dirpath: str, strip: str = "", lead: str = "") -> List[IgnoreRule]:
+    rules = []
+    for name in IGNORE_FILES:
+        try:
+            with open(path.join(dirpath, name), "r", errors="replace") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            rule = parse_rule(line, strip, lead)
+            if rule:
+                rules.append(rule)
+    return rules
+
+
+def is_ignored(rules: List[IgnoreRule], relpath: str, is_dir: bool) -> bool:
+    # later rules, and rules from deeper directories, take precedence
+    for rule in reversed(rules):
+        if rule.matches(relpath, is_dir):
+            return not rule.negated
+    return False
+
+
+def ancestor_rules(root: str) -> List[IgnoreRule]:
+    """Ignore rules from directories above `root`, up to the enclosing
+    repository's top level."""
+    rules: List[IgnoreRule] = []
+    current = path.abspath(root)
+    lead = ""
+
+    while True:
+        if path.isdir(path.join(current, ".git")):
+            break
+        parent = path.dirname(current)
+        if parent == current:
+            # not inside a repository, so ancestors don't apply
+            return []
+        lead = path.basename(current) + "/" + lead
+        current = parent
+        rules = load_rules(current, "", lead) + rules
+
+    return rules
+
+
+@dataclass
+class Discovery:
+    globs: List[str] = field(default_factory=list)
+    excludes: List[str] = field(default_factory=list)
+    use_ignore_files: bool = True
+    # files larger than this many bytes, e.g. generated code, are skipped
+    max_filesize: Optional[int] = None
+    # also search the members of archives; globs and the size limit then
+    # apply to members rather than to the archives themselves
+    search_zip: bool = False
+
+    def is_too_large(self, size: int) -> bool:
+        return self.max_filesize is not None and size > self.max_filesize
+
+
+def path_filter(discovery: Optional[Discovery] = None) -> Callable[[str], bool]:
+    """Whether a file, by its path relative to the search root, passes the
+    suffix, glob and exclude filters walk_files applies; for files that
+    aren't walked, such as those of a git revision."""
+    discovery = discovery or Discovery()
+    globs = [x for x in map(parse_rule, discovery.globs) if x]
+    excludes = [x for x in map(parse_rule, discovery.excludes) if x]
+
+    def keep(relpath: str) -> bool:
+        if not is_source(relpath):
+            return False
+        if globs and not any(x.matches(relpath, False) for x in globs):
+            return False
+        if not excludes:
+            return True
+        # an excluded directory excludes everything below it
+        dirs = [relpath[:i] for i, c in enumerate(relpath) if c == "/"]
+        if any(is_ignored(excludes, x, True) for x in dirs):
+            return False
+        return not is_ignored(excludes, relpath, False)
+
+    return keep
+
+
+def walk_files(
+    root: str, discovery: Optional[Discovery] = None
+) -> Iterator[FileEntry]:
+    """Lazily yield (path, size) for searchable files under `root`, pruning
+    ignored directories before descending into them."""
+    discovery = discovery or Discovery()
+    search_zip = discovery.search_zip
+    suffixes = ALLOWED_SUFFIXES + ARCHIVE_SUFFIXES if search_zip else ALLOWED_SUFFIXES
+
+    if path.isfile(root):
+        size = path.getsize(root)
+        if (search_zip and is_archive(root)) or not discovery.is_too_large(size):
+            yield root, size
+        return
+
+    globs = [x for x in map(parse_rule, discovery.globs) if x]
+    excludes = [x for x in map(parse_rule, discovery.excludes) if x]
+    base_rules = ancestor_rules(root) if discovery.use_ignore_files else []
+
+    stack: List[Tuple[str, str, List[IgnoreRule]]] = [(root, "", base_rules)]
+
+    while stack:
+        dirpath, reldir, rules = stack.pop()
+        if discovery.use_ignore_files:
+            rules = rules + load_rules(dirpath, reldir)
+
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            relpath = reldir + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if is_dir:
+                if entry.name in PRUNED_DIRS:
+                    continue
+                if is_ignored(rules, relpath, True):
+                    continue
+                if is_ignored(excludes, relpath, True):
+                    continue
+                subdirs.append((entry.path, relpath + "/", rules))
+                continue
+
+            if not entry.name.lower().endswith(suffixes):
+                continue
+            if is_ignored(rules, relpath, False):
+                continue
+            if is_ignored(excludes, relpath, False):
+                continue
+            archive = search_zip and is_archive(entry.name)
+            if globs and not archive:
+                if not any(x.matches(relpath, False) for x in globs):
+                    continue
+
+            try:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            if archive or not discovery.is_too_large(size):
+                yield entry.path, size
+
+        stack.extend(reversed(subdirs))
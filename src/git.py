@@ -0,0 +1,178 @@
+import subprocess
+from os import path
+from typing import Dict, Final, Iterator, List, Optional, Tuple
+
+
+def run_git(cwd: str, *args: str) -> Optional[str]:
+    try:
+        proc = subprocess.run(
+            ["git", *args], cwd=cwd, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return proc.stdout
+
+
+def git_dir(filepath: str) -> str:
+    return filepath if path.isdir(filepath) else path.dirname(filepath) or "."
+
+
+def toplevel(filepath: str) -> Optional[str]:
+    out = run_git(git_dir(filepath), "rev-parse", "--show-toplevel")
+    return out.strip() if out else None
+
+
+def head(filepath: str) -> Optional[str]:
+    out = run_git(git_dir(filepath), "rev-parse", "--verify", "-q", "HEAD")
+    return out.strip() if out else None
+
+
+def changed_files(filepath: str, since: Optional[str]) -> Optional[List[str]]:
+    """Absolute paths of files that may differ from commit `since`: tracked
+    files changed in the working tree or index, including deletions, plus
+    untracked files. None when git can't answer."""
+    top = toplevel(filepath)
+    if not top or not since:
+        return None
+
+    diff = run_git(top, "diff", "--name-only", "-z", since, "--")
+    untracked = run_git(top, "ls-files", "--others", "--exclude-standard", "-z")
+    if diff is None or untracked is None:
+        return None
+
+    names = [x for x in (diff + untracked).split("\0") if x]
+    return [path.join(top, x) for x in names]
+
+
+# tree entry modes; symlinks and submodules aren't searched
+TREE_MODE: Final = b"40000"
+BLOB_MODES: Final = (b"100644", b"100755")
+
+
+class SgrepGitError(Exception):
+    pass
+
+
+def resolve_revs(filepath: str, specs: List[str]) -> List[Tuple[str, str]]:
+    """(label, commit) for each revision in `specs`, in order. A range such
+    as `v1.0..v2.0` expands to its commits, newest first, labelled by
+    abbreviated hash; anything else is one commit labelled as given."""
+    cwd = git_dir(filepath)
+    revs = []
+
+    for spec in specs:
+        if ".." in spec:
+            out = run_git(cwd, "rev-list", "--abbrev-commit", spec, "--")
+            if out is None:
+                raise SgrepGitError(f"Unknown revision range '{spec}'")
+            revs.extend((x, x) for x in out.split())
+            continue
+
+        out = run_git(cwd, "rev-parse", "--verify", "-q", spec + "^{commit}")
+        if out is None:
+            raise SgrepGitError(f"Unknown revision '{spec}'")
+        revs.append((spec, out.strip()))
+
+    return revs
+
+
+class CatFile:
+    """One `git cat-file --batch` process that every tree and blob of a
+    search is read through, instead of a git process per object."""
+
+    def __init__(self, cwd: str) -> None:
+        try:
+            self.proc = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except OSError as e:
+            raise SgrepGitError(str(e)) from e
+        assert self.proc.stdin and self.proc.stdout
+        self.stdin = self.proc.stdin
+        self.stdout = self.proc.stdout
+
+    def read(self, name: str) -> Optional[Tuple[str, str, bytes]]:
+        """Hash, type and content of the object `name`, None if there's no
+        such object."""
+        self.stdin.write(name.encode() + b"\n")
+        self.stdin.flush()
+
+        header = self.stdout.readline().split()
+        if len(header) != 3:
+            # `<name> missing` or `<name> ambiguous`
+            if not header:
+                raise SgrepGitError("git cat-file exited")
+            return None
+
+        sha, kind, size = header
+        data = self.stdout.read(int(size))
+        self.stdout.read(1)  # the newline after the content
+        return sha.decode(), kind.decode(), data
+
+    def close(self) -> None:
+        self.stdin.close()
+        self.proc.wait()
+
+    def __enter__(self) -> "CatFile":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+def tree_entries(data: bytes, sha_bytes: int) -> Iterator[Tuple[bytes, str, str]]:
+    """(mode, name, object hash) of each entry of a raw tree object, whose
+    hashes are `sha_bytes` long: 20 for SHA-1, 32 for SHA-256."""
+    i = 0
+    while i < len(data):
+        space = data.index(b" ", i)
+        nul = data.index(b"\0", space)
+        end = nul + 1 + sha_bytes
+        name = data[space + 1 : nul].decode(errors="surrogateescape")
+        yield data[i:space], name, data[nul + 1 : end].hex()
+        i = end
+
+
+class TreeWalker:
+    """Lists the blobs of commits through a CatFile. Trees are remembered
+    by hash, so a directory unchanged between revisions is read once."""
+
+    def __init__(self, catfile: CatFile) -> None:
+        self.catfile = catfile
+        self.trees: Dict[str, List[Tuple[bytes, str, str]]] = {}
+
+    def entries(self, sha: str) -> List[Tuple[bytes, str, str]]:
+        found = self.trees.get(sha)
+        if found is None:
+            obj = self.catfile.read(sha)
+            found = [] if obj is None else list(tree_entries(obj[2], len(sha) // 2))
+            self.trees[sha] = found
+        return found
+
+    def blobs(self, commit: str, prefix: str = "") -> Iterator[Tuple[str, str]]:
+        """(path from the top level, blob hash) of each file under
+        `prefix` in `commit`, in tree order."""
+        root = self.catfile.read(f"{commit}:{prefix}" if prefix else commit + "^{tree}")
+        if root is None:
+            return
+
+        sha, kind, data = root
+        if kind == "blob":
+            yield prefix, sha
+            return
+        if sha not in self.trees:
+            self.trees[sha] = list(tree_entries(data, len(sha) // 2))
+
+        stack = [(sha, prefix + "/" if prefix else "")]
+        while stack:
+            sha, reldir = stack.pop()
+            subtrees = []
+            for mode, name, child in self.entries(sha):
+                if mode == TREE_MODE:
+                    subtrees.append((child, reldir + name + "/"))
+                elif mode in BLOB_MODES:
+                    yield reldir + name, child
+            stack.extend(reversed(subtrees))
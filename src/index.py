@@ -0,0 +1,446 @@
+import ast
+import os
+import pickle
+from dataclasses import replace
+from os import path
+from itertools import chain
+from typing import Dict, Final, Iterable, Iterator, List, NamedTuple, Optional
+from typing import Set, Tuple, Union
+from src.parse import SIdent, Func, Class, KW, Nested, Node, Patterns
+from src.match import (
+    name_predicate,
+    func_predicate,
+    callee_name,
+    call_arg_names,
+    def_arg_names,
+)
+from src.cache import PARSE_ERRORS, ParseCache
+from src.notebook import parse_source
+from src.symbols import Exports, ModuleSymbols, Resolver, module_name
+
+Nodes = Union[Node, SIdent, Func, Class, KW, Patterns, Nested]
+
+INDEX_FILE: Final = "index.pickle"
+INDEX_VERSION: Final = 3
+JOURNAL_SUFFIX: Final = ".log"
+# rewrite the base snapshot once the journal grows past this share of it
+JOURNAL_RATIO: Final = 0.25
+
+OP_ADD: Final = "add"
+OP_REMOVE: Final = "remove"
+OP_HEAD: Final = "head"
+
+KIND_DEF: Final = "def"
+KIND_CALL: Final = "call"
+KIND_CLASS: Final = "class"
+KIND_IDENT: Final = "ident"
+# calls by the qualified name their callee resolves to
+KIND_QUALIFIED: Final = "qualified"
+KINDS: Final = (KIND_DEF, KIND_CALL, KIND_CLASS, KIND_IDENT, KIND_QUALIFIED)
+
+
+class Symbol(NamedTuple):
+    filename: str
+    lineno: int
+    col_offset: int
+    arg_count: int
+    args: Tuple[str, ...]
+
+
+# (kind, name, symbol) as produced for a single file
+Entry = Tuple[str, str, Symbol]
+
+
+def trigrams(name: str) -> Set[str]:
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+class NameTable:
+    """Postings from a name to every symbol carrying it, plus a trigram
+    index over the distinct names so prefix, suffix and substring lookups
+    only verify names that share all of the query's trigrams."""
+
+    def __init__(self) -> None:
+        self.names: Dict[str, List[Symbol]] = {}
+        self.grams: Dict[str, Set[str]] = {}
+
+    def add(self, name: str, symbol: Symbol) -> None:
+        postings = self.names.get(name)
+        if postings is None:
+            postings = self.names[name] = []
+            for gram in trigrams(name):
+                self.grams.setdefault(gram, set()).add(name)
+        postings.append(symbol)
+
+    def discard(self, name: str, filename: str) -> None:
+        postings = self.names.get(name)
+        if postings is None:
+            return
+
+        postings[:] = [x for x in postings if x.filename != filename]
+        if postings:
+            return
+
+        del self.names[name]
+        for gram in trigrams(name):
+            names = self.grams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.grams[gram]
+
+    def candidates(self, ident: SIdent) -> Iterable[str]:
+        if ident.is_wildcard:
+            return self.names.keys()
+
+        if not (ident.has_prefix or ident.has_suffix):
+            return [ident.name] if ident.name in self.names else []
+
+        grams = trigrams(ident.name)
+        if not grams:
+            # too short for a trigram, fall back to the distinct names
+            return self.names.keys()
+
+        sets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        return set.intersection(*sets)
+
+    def lookup(self, ident: SIdent) -> Iterator[Tuple[str, Symbol]]:
+        matches = name_predicate(ident)
+        for name in self.candidates(ident):
+            if matches(name):
+                for symbol in self.names[name]:
+                    yield name, symbol
+
+    def symbols(self) -> Iterator[Tuple[str, Symbol]]:
+        for name, postings in self.names.items():
+            for symbol in postings:
+                yield name, symbol
+
+
+class SymbolCollector(ast.NodeVisitor):
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries: List[Entry] = []
+
+    def add(self, kind: str, name: str, node: ast.AST, args: List[str]) -> None:
+        symbol = Symbol(
+            self.filename, node.lineno, node.col_offset, len(args), tuple(args)
+        )
+        self.entries.append((kind, name, symbol))
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        self.add(KIND_DEF, node.name, node, def_arg_names(node))
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call) -> None:
+        self.add(KIND_CALL, callee_name(node), node, call_arg_names(node))
+        self.generic_visit(node)
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self.add(KIND_CLASS, node.name, node, [])
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name) -> None:
+        self.add(KIND_IDENT, node.id, node, [])
+
+
+def file_stamp(filepath: str) -> Tuple[int, int]:
+    st = os.stat(filepath)
+    return st.st_size, st.st_mtime_ns
+
+
+def index_file(
+    args: Tuple[str, Optional[ParseCache]],
+) -> Tuple[str, Tuple[int, int], List[Entry], Optional[Exports], Optional[str]]:
+    """Symbols and module-level re-exports of one file. A file that can't
+    be read or parsed is indexed as empty, with the reason, so it is only
+    retried once it changes."""
+    filepath, cache = args
+    filename = path.abspath(filepath)
+
+    stamp = (-1, -1)
+    try:
+        stamp = file_stamp(filepath)
+        _, tree, _ = parse_source(filepath, cache)
+    except PARSE_ERRORS as e:
+        return filename, stamp, [], None, str(e)
+    except MemoryError:
+        # one file too large to parse mustn't take the whole refresh down
+        return filename, stamp, [], None, "Out of memory"
+
+    collector = SymbolCollector(filename)
+    collector.visit(tree)
+
+    module, package = module_name(filename)
+    symbols = ModuleSymbols(tree, module, package)
+    for name, node in symbols.calls:
+        collector.add(KIND_QUALIFIED, name, node, call_arg_names(node))
+
+    return filename, stamp, collector.entries, (module, symbols.exports), None
+
+
+def has_qualified(pattern: Nodes) -> bool:
+    """Whether `pattern` names a call by a qualified name, which only the
+    exports of every module around it resolve fully."""
+    if isinstance(pattern, Patterns):
+        return any(has_qualified(x) for x in pattern.patterns)
+    if isinstance(pattern, Nested):
+        return any(has_qualified(x) for x in pattern.steps)
+    fname = pattern.fname if isinstance(pattern, Func) and pattern.call else None
+    return bool(fname and fname.qualified)
+
+
+def is_under(filename: str, scope: str) -> bool:
+    return filename == scope or filename.startswith(path.join(scope, ""))
+
+
+class StructuralIndex:
+    """Name tables for definitions, calls, classes and identifiers across a
+    tree, stamped with each file's size and mtime so staleness is detectable
+    without reparsing.
+
+    On disk the index is a snapshot plus an append-only journal of per-file
+    updates, so refreshing after an edit writes only the changed files."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.head: Optional[str] = None
+        self.stamps: Dict[str, Tuple[int, int]] = {}
+        self.keys: Dict[str, Set[Tuple[str, str]]] = {}
+        self.tables: Dict[str, NameTable] = {kind: NameTable() for kind in KINDS}
+        self.exports: Dict[str, Exports] = {}
+        self.journal: List[tuple] = []
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["journal"] = []
+        return state
+
+    def add_file(
+        self,
+        filename: str,
+        stamp: Tuple[int, int],
+        entries: List[Entry],
+        exports: Optional[Exports] = None,
+    ) -> None:
+        if filename in self.stamps:
+            self.remove_file(filename)
+
+        self.stamps[filename] = stamp
+        self.keys[filename] = keys = set()
+        for kind, name, symbol in entries:
+            self.tables[kind].add(name, symbol)
+            keys.add((kind, name))
+        if exports:
+            self.exports[filename] = exports
+
+        self.journal.append((OP_ADD, filename, stamp, entries, exports))
+
+    def remove_file(self, filename: str) -> None:
+        if self.stamps.pop(filename, None) is None:
+            return
+
+        self.exports.pop(filename, None)
+
+        for kind, name in self.keys.pop(filename, ()):
+            self.tables[kind].discard(name, filename)
+
+        self.journal.append((OP_REMOVE, filename))
+
+    def set_head(self, head: Optional[str]) -> None:
+        if head != self.head:
+            self.head = head
+            self.journal.append((OP_HEAD, head))
+
+    def replay(self, record: tuple) -> None:
+        op, *args = record
+        if op == OP_ADD:
+            self.add_file(*args)
+        elif op == OP_REMOVE:
+            self.remove_file(*args)
+        elif op == OP_HEAD:
+            self.set_head(*args)
+
+    def covers(self, filepath: str) -> bool:
+        """Whether `filepath` is inside the tree the index was built from,
+        and so already has all its files in it."""
+        return is_under(path.abspath(filepath), self.root)
+
+    def files_under(self, scope: str) -> List[str]:
+        scope = path.abspath(scope)
+        return [x for x in self.stamps if is_under(x, scope)]
+
+    def is_fresh(self, files: List[str]) -> bool:
+        return self.changes(files) == ([], [])
+
+    def changes(
+        self, files: List[str], scope: Optional[str] = None
+    ) -> Tuple[List[str], List[str]]:
+        """Split a walk of `scope` into files to (re)index and indexed files
+        under `scope` that no longer exist."""
+        stale = []
+        present = set()
+
+        for filepath in files:
+            filename = path.abspath(filepath)
+            present.add(filename)
+            try:
+                if self.stamps.get(filename) != file_stamp(filepath):
+                    stale.append(filepath)
+            except OSError:
+                continue
+
+        deleted = [] if scope is None else self.files_under(scope)
+        return stale, [x for x in deleted if x not in present]
+
+    def changes_from(self, changed: List[str]) -> Tuple[List[str], List[str]]:
+        """Like `changes`, but only inspecting the given candidate paths."""
+        stale = []
+        deleted = []
+
+        for filepath in changed:
+            filename = path.abspath(filepath)
+            try:
+                if self.stamps.get(filename) != file_stamp(filepath):
+                    stale.append(filepath)
+            except OSError:
+                if filename in self.stamps:
+                    deleted.append(filename)
+
+        return stale, deleted
+
+    def lookup(self, kind: str, ident: Optional[SIdent]) -> Iterator[Symbol]:
+        table = self.tables[kind]
+        found = table.lookup(ident) if ident else table.symbols()
+        return (symbol for _, symbol in found)
+
+    def lookup_func(self, pattern: Func) -> Iterator[Symbol]:
+        fname = pattern.fname
+        if pattern.call and fname and fname.qualified:
+            table = self.tables[KIND_QUALIFIED]
+        else:
+            table = self.tables[KIND_CALL if pattern.call else KIND_DEF]
+
+        if fname and not pattern.args:
+            names = (fname.name, *fname.aliases)
+            found = chain.from_iterable(
+                table.lookup(replace(fname, name=x, aliases=())) for x in names
+            )
+        else:
+            # argument constraints are only checkable per symbol
+            found = table.symbols()
+
+        matches = func_predicate(pattern)
+        for name, symbol in found:
+            if matches(name, list(symbol.args)):
+                yield symbol
+
+    def qualify(self, pattern: Nodes) -> Nodes:
+        """`pattern` with each qualified call name also matching the names
+        other modules in the index re-export it under."""
+        resolver: Optional[Resolver] = None
+
+        def expand(node: Nodes) -> Nodes:
+            nonlocal resolver
+            if isinstance(node, Patterns):
+                return replace(node, patterns=[expand(x) for x in node.patterns])
+            if isinstance(node, Nested):
+                return replace(node, steps=[expand(x) for x in node.steps])
+
+            if not (isinstance(node, Func) and node.call and node.fname):
+                return node
+            fname = node.fname
+            if not fname.qualified or fname.has_suffix:
+                return node
+
+            if resolver is None:
+                resolver = Resolver(self.exports.values())
+            aliases = tuple(resolver.aliases(fname.name))
+            return replace(node, fname=replace(fname, aliases=aliases))
+
+        return expand(pattern)
+
+    def query(self, pattern: Nodes) -> Optional[Dict[str, List[Symbol]]]:
+        """Group the symbols matching `pattern` by file, or None when the
+        pattern is not one the index can answer."""
+        if isinstance(pattern, Patterns):
+            return self.query_all(pattern.patterns)
+
+        if isinstance(pattern, SIdent):
+            found = self.lookup(KIND_IDENT, pattern)
+        elif isinstance(pattern, Class):
+            found = self.lookup(KIND_CLASS, pattern.cname)
+        elif isinstance(pattern, Func):
+            found = self.lookup_func(pattern)
+        else:
+            return None
+
+        hits: Dict[str, List[Symbol]] = {}
+        for symbol in found:
+            hits.setdefault(symbol.filename, []).append(symbol)
+        return hits
+
+    def query_all(self, patterns: List[Node]) -> Optional[Dict[str, List[Symbol]]]:
+        """Hits of every pattern merged, if the index can answer them all."""
+        hits: Dict[str, List[Symbol]] = {}
+        for pattern in patterns:
+            found = self.query(pattern)
+            if found is None:
+                return None
+            for filename, symbols in found.items():
+                hits.setdefault(filename, []).extend(symbols)
+        return hits
+
+    def save(self, filepath: str) -> None:
+        journal = filepath + JOURNAL_SUFFIX
+
+        try:
+            base_size = os.path.getsize(filepath)
+            journal_size = os.path.getsize(journal) if path.exists(journal) else 0
+        except OSError:
+            base_size = journal_size = 0
+
+        if base_size and journal_size < base_size * JOURNAL_RATIO:
+            if self.journal:
+                with open(journal, "ab") as f:
+                    for record in self.journal:
+                        pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+            self.journal = []
+            return
+
+        # only a full rewrite needs it, most saves append to the journal
+        import tempfile
+
+        os.makedirs(path.dirname(filepath), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(filepath))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((INDEX_VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filepath)
+
+        if path.exists(journal):
+            os.unlink(journal)
+        self.journal = []
+
+    @classmethod
+    def load(cls, filepath: str) -> Optional["StructuralIndex"]:
+        try:
+            with open(filepath, "rb") as f:
+                version, index = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        if version != INDEX_VERSION:
+            return None
+
+        try:
+            with open(filepath + JOURNAL_SUFFIX, "rb") as f:
+                while True:
+                    index.replay(pickle.load(f))
+        except FileNotFoundError:
+            pass
+        except (EOFError, pickle.UnpicklingError):
+            # a torn final record from an interrupted append is dropped
+            pass
+
+        index.journal = []
+        return index
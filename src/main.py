@@ -1,18 +1,37 @@
-from dataclasses import dataclass
-import os
 import click
-from os import getcwd, path, walk
-from typing import Final, Union, List, Tuple
-from multiprocessing import Pool
-from src.parse import SIdent, Func, Class, KW, Tokenize, Parser, Node
-from src.match import MatchPatterns
-from ast import AST, parse, unparse
-from itertools import chain
-
-Nodes = Union[Node, SIdent, Func, Class, KW]
-
-PYTHON_SUFFIX: Final = ".py"
-ALLOWED_SUFFIXES: Final = (PYTHON_SUFFIX, ".pyi", ".out", ".diff", ".ipynb")
+import json
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, replace
+from os import getcwd, path
+from typing import Final, Iterable, Iterator, Optional, List, TextIO, Tuple
+from src.cache import CACHE_DIR, ParseCache
+from src.index import INDEX_FILE, StructuralIndex, has_qualified, index_file
+from src.index import is_under
+from src.archive import Task, expand_archives
+from src.discover import Discovery, is_archive, is_source, walk_files
+from src.search import (
+    COUNT_KEYS,
+    COUNT_PATTERN,
+    EXECUTOR_PROCESS,
+    EXECUTORS,
+    STREAM_CHUNK_BYTES,
+    FileError,
+    Result,
+    SearchConfig,
+    choose_executor,
+    file_sizes,
+    get_py_file,
+    parse_patterns,
+    read_patterns,
+    run_tasks,
+    search_files,
+    search_revs,
+)
+from src.stats import SearchStats, format_report, no_timer
+from src.render import Rendering
 
 CURR_DIR = getcwd()
 
@@ -21,96 +40,481 @@ class SgrepCommandError(Exception):
     pass
 
 
-@dataclass
-class Result:
-    def __init__(self, filename: str, matches: list[AST]) -> None:
-        self.count: int = 0
-        self.pattern: str = ""
-        self.matches: List[AST] = matches
-        self.first_lines: List[str] = []
-        self.filename: str = filename
+class SgrepGroup(click.Group):
+    """Runs the search command unless the first argument names a subcommand,
+    so `sgrep PATTERN` and `sgrep index` can coexist."""
+
+    def parse_args(self, ctx: click.Context, args: List[str]) -> List[str]:
+        if not args or args[0] not in self.commands:
+            args = [SEARCH_COMMAND, *args]
+        return super().parse_args(ctx, args)
+
+
+class FileSize(click.ParamType):
+    """A byte count with an optional K, M or G suffix."""
+
+    name = "size"
+    units: Final = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+    def convert(
+        self, value: str, param: Optional[click.Parameter], ctx: Optional[click.Context]
+    ) -> int:
+        if isinstance(value, int):
+            return value
+
+        text = value.strip().upper()
+        unit = text[-1:] if text[-1:] in self.units else ""
+        digits = text[: len(text) - len(unit)]
+        if not digits.isdigit():
+            self.fail(f"{value!r} is not a size like 512K or 10M", param, ctx)
+        return int(digits) * self.units[unit]
+
 
-    # TODO
-    def uparse(self, node: AST) -> str:
-        return unparse(node)
+SEARCH_COMMAND: Final = "search"
+SOCKET_FILE: Final = "daemon.sock"
+STATS_TEXT: Final = "text"
+STATS_JSON: Final = "json"
+OUTPUT_BUFFER_BYTES: Final = 64 * 1024
 
-    def incr_count(self) -> int:
-        self.count += 1
-        return self.count
 
-    def print_match(self, tree: AST) -> None:
-        src = self.uparse(tree)
+def warn(filename: str, message: str) -> None:
+    click.echo(f"sgrep: {filename}: {message}", err=True)
 
-        # TODO move this to a util file
-        # TODO conditionally apply colors based on term's capabilities
-        magenta = "\033[95m"  # ]
-        reset = "\033[0m"  # ]
-        bold = "\033[1m"  # ]
 
-        print(f"{bold}{magenta}{tree.lineno}:{reset} {src}")
+def format_counts(
+    counts: "Counter[str]", count_by: str, top: Optional[int], as_json: bool
+) -> str:
+    """--count-by's counts, most first, as a table like `uniq -c` or as
+    JSON."""
+    rows = counts.most_common(top)
+    if as_json:
+        report = {
+            "count_by": count_by,
+            "total": sum(counts.values()),
+            "counts": [{"key": key, "count": n} for key, n in rows],
+        }
+        return json.dumps(report, indent=2)
 
-    def flush_res(self) -> None:
-        # TODO move this to a util file
-        magenta = "\033[95m"  # ]
-        reset = "\033[0m"  # ]
-        print(f"{magenta}{self.filename}{reset}")
-        list(map(self.print_match, self.matches))
+    width = len(str(rows[0][1])) if rows else 1
+    return "\n".join(f"{n:>{width}} {key}" for key, n in rows)
 
 
-def get_py_file(filepath: str) -> list[str]:
-    if path.isfile(filepath):
-        return [filepath]
+def report_stats(
+    stats: Optional[SearchStats],
+    start: float,
+    stats_format: Optional[str],
+) -> None:
+    if not stats:
+        return
+
+    report = stats.report(time.perf_counter() - start)
+    if stats_format == STATS_JSON:
+        click.echo(json.dumps(report, indent=2), err=True)
     else:
+        click.echo(format_report(report), err=True)
+
+
+@contextmanager
+def output_stream() -> Iterator[TextIO]:
+    """stdout behind a large buffer, so output is written in blocks rather
+    than per match. A terminal keeps its line buffering."""
+    try:
+        interactive = sys.stdout.isatty()
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        # replaced by something that isn't a real file, e.g. under test
+        interactive, fd = True, -1
+
+    if interactive:
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+
+    sys.stdout.flush()
+    with open(
+        fd,
+        "w",
+        buffering=OUTPUT_BUFFER_BYTES,
+        encoding=sys.stdout.encoding,
+        errors="replace",
+        closefd=False,
+    ) as out:
+        yield out
+
+
+def get_cache(use_cache: bool) -> Optional[ParseCache]:
+    # opt-in: unpickling a tree costs about as much as parsing it again
+    return ParseCache(path.join(CURR_DIR, CACHE_DIR)) if use_cache else None
+
+
+def index_path() -> str:
+    return path.join(CURR_DIR, CACHE_DIR, INDEX_FILE)
 
-        def get_fs(root: str, fs: list[str]) -> list[str]:
-            return [path.join(root, f) for f in fs if f.endswith(ALLOWED_SUFFIXES)]
 
-        return list(chain(*[get_fs(root, files) for root, _, files in walk(filepath)]))
+def socket_path() -> str:
+    return path.join(CURR_DIR, CACHE_DIR, SOCKET_FILE)
 
 
-def parse_command(src: str) -> Nodes:
-    tokens = Tokenize(src)
-    parser = Parser(tokens)
-    return parser.parse_commands()
+def find_socket() -> Optional[str]:
+    """The socket of a daemon started here or in a directory above, so a
+    search from inside the served tree reaches it; None without one."""
+    current = CURR_DIR
 
+    while True:
+        sockpath = path.join(current, CACHE_DIR, SOCKET_FILE)
+        if path.exists(sockpath):
+            return sockpath
+        parent = path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
 
-def proc_file(args: Tuple[object, str]) -> Result:
-    visitor, filepath = args
 
-    with open(filepath, "r") as f:
-        src = f.read()
+def refresh_index(
+    index: StructuralIndex,
+    filepath: str,
+    cache: Optional[ParseCache],
+    use_git: bool,
+) -> List[str]:
+    """Reindex files added or modified under `filepath`, drop deleted ones
+    and return the files now under it. With `use_git` the candidates come
+    from git instead of a full walk, falling back to the walk when git
+    can't tell what changed since the index was last refreshed."""
+    from src import git
 
-    tree = parse(src)
+    changed = git.changed_files(filepath, index.head) if use_git else None
 
-    visitor.visit(tree)
+    if changed is None:
+        files = list(get_py_file(filepath))
+        stale, deleted = index.changes(files, filepath)
+    else:
+        scope = path.abspath(filepath)
+        changed = [x for x in changed if is_source(x) and is_under(x, scope)]
+        stale, deleted = index.changes_from(changed)
+
+    for filename in deleted:
+        index.remove_file(filename)
+
+    for filename, stamp, entries, exports, error in run_tasks(
+        index_file, [(x, cache) for x in stale]
+    ):
+        index.add_file(filename, stamp, entries, exports)
+        if error:
+            warn(filename, error)
+
+    if use_git:
+        index.set_head(git.head(filepath))
+
+    if changed is not None:
+        files = index.files_under(filepath)
+        if not path.isabs(filepath):
+            files = [path.relpath(x) for x in files]
 
-    return Result(filepath, visitor.matches)
+    return files
 
 
-@click.command()
+@click.group(cls=SgrepGroup)
+def cli() -> None:
+    pass
+
+
+@cli.command(SEARCH_COMMAND)
 @click.option("-c", "count", is_flag=True)
-@click.argument("pattern", type=click.STRING, default="$*")
+@click.option("--count-by", "count_by", type=click.Choice(COUNT_KEYS))
+@click.option("--count-json", "count_json", is_flag=True)
+@click.option("--top", "top", type=click.IntRange(min=1))
+@click.option("-m", "--max-count", "max_count", type=click.IntRange(min=1))
+@click.option("-l", "--files-with-matches", "files_with_matches", is_flag=True)
+@click.option("--sort", "sort", is_flag=True)
+@click.option("--cache/--no-cache", "use_cache", default=False)
+@click.option("--rebuild-cache", "rebuild_cache", is_flag=True)
+@click.option("--no-index", "no_index", is_flag=True)
+@click.option("--git", "use_git", is_flag=True)
+@click.option("--no-daemon", "no_daemon", is_flag=True)
+@click.option("-g", "--glob", "globs", multiple=True)
+@click.option("--exclude", "excludes", multiple=True)
+@click.option("--no-ignore", "no_ignore", is_flag=True)
+@click.option("--max-filesize", "max_filesize", type=FileSize())
+@click.option("-z", "--search-zip", "search_zip", is_flag=True)
+@click.option("-e", "--regexp", "exprs", multiple=True)
+@click.option("-f", "--file", "pattern_file", type=click.Path(exists=True))
+@click.option("-A", "--after-context", "after", type=click.IntRange(min=0))
+@click.option("-B", "--before-context", "before", type=click.IntRange(min=0))
+@click.option("-C", "--context", "context", type=click.IntRange(min=0), default=0)
+@click.option("--full", "full", is_flag=True)
+@click.option("--rev", "revs", multiple=True)
+@click.option("--executor", "executor", type=click.Choice(EXECUTORS))
+@click.option("-j", "--jobs", "jobs", type=click.IntRange(min=1))
+@click.option("--timeout", "timeout", type=click.FloatRange(min=0, min_open=True))
+@click.option("--max-memory", "max_memory", type=FileSize())
+@click.option("--stats", "stats_format", flag_value=STATS_TEXT)
+@click.option("--stats-json", "stats_format", flag_value=STATS_JSON)
+@click.argument("pattern", type=click.STRING, required=False)
 @click.argument("filepath", type=click.Path(exists=True), default=CURR_DIR)
-def sgrep(pattern: str, filepath: str, count: bool) -> None:
-    if not pattern:
+def sgrep(
+    pattern: Optional[str],
+    filepath: str,
+    count: bool,
+    count_by: Optional[str],
+    count_json: bool,
+    top: Optional[int],
+    max_count: Optional[int],
+    files_with_matches: bool,
+    sort: bool,
+    use_cache: bool,
+    rebuild_cache: bool,
+    no_index: bool,
+    use_git: bool,
+    no_daemon: bool,
+    globs: Tuple[str, ...],
+    excludes: Tuple[str, ...],
+    no_ignore: bool,
+    max_filesize: Optional[int],
+    search_zip: bool,
+    exprs: Tuple[str, ...],
+    pattern_file: Optional[str],
+    after: Optional[int],
+    before: Optional[int],
+    context: int,
+    full: bool,
+    revs: Tuple[str, ...],
+    executor: Optional[str],
+    jobs: Optional[int],
+    timeout: Optional[float],
+    max_memory: Optional[int],
+    stats_format: Optional[str],
+) -> None:
+    patterns = list(exprs)
+    if pattern_file:
+        patterns.extend(read_patterns(pattern_file))
+
+    if exprs or pattern_file:
+        # like grep, with -e or -f the only positional argument is the path
+        if pattern is not None:
+            if not path.exists(pattern):
+                raise click.BadParameter(f"Path '{pattern}' does not exist.")
+            filepath = pattern
+    else:
+        patterns.append("$*" if pattern is None else pattern)
+
+    if not all(patterns):
         raise SgrepCommandError("Expected a pattern.")
 
-    visitor = MatchPatterns.create(parse_command(pattern))
-    files = list(get_py_file(filepath))
-    processes = min(os.cpu_count() or 1, len(files))
+    if (count_json or top) and not count_by:
+        raise click.UsageError("--count-json and --top need --count-by.")
+
+    rendering = Rendering(
+        context if before is None else before, context if after is None else after, full
+    )
+
+    # matching stops per file at the first hit when only names are listed
+    limit = 1 if files_with_matches and not count else max_count
+
+    # an archive named on its own is searched inside without -z
+    search_zip = search_zip or (path.isfile(filepath) and is_archive(filepath))
+    discovery = Discovery(
+        list(globs), list(excludes), not no_ignore, max_filesize, search_zip
+    )
+    # the index and daemon cover the default file set, narrower or wider
+    # walks bypass them
+    filtered = discovery != Discovery()
+
+    # options that change how files are loaded always run in-process
+    in_process = no_daemon or use_cache or rebuild_cache or no_index or use_git
+    in_process = in_process or bool(revs)
+    # the daemon doesn't report where its time goes, nor run on workers
+    in_process = in_process or bool(stats_format or executor or jobs)
+    in_process = in_process or bool(timeout or max_memory or count_by)
+
+    command = parse_patterns(patterns)
+    # the daemon resolves calls against each file's own imports only
+    qualified = has_qualified(command)
+    in_process = in_process or qualified
+    # the daemon module, and socketserver with it, only load when one is up
+    sockpath = None if in_process or filtered else find_socket()
+    if sockpath:
+        from src.daemon import query
+
+        request = {
+            "patterns": patterns,
+            "filepath": filepath,
+            "count": count,
+            "limit": limit,
+            "files_with_matches": files_with_matches,
+            "sort": sort,
+            **asdict(rendering),
+        }
+        replies = query(sockpath, {**request, "cwd": getcwd()})
+        if replies is not None:
+            with output_stream() as out:
+                for reply in replies:
+                    out.write(reply + "\n")
+            return
+
+    commits: List[Tuple[str, str]] = []
+    if revs:
+        from src import git
+
+        try:
+            commits = git.resolve_revs(filepath, list(revs))
+        except git.SgrepGitError as e:
+            raise click.BadParameter(str(e), param_hint="--rev")
+
+    cache = get_cache(use_cache or rebuild_cache)
+    if cache and rebuild_cache:
+        cache.clear()
+
+    with output_stream() as out:
+        stats = SearchStats() if stats_format else None
+        timed = stats.timed if stats else no_timer
+        start = time.perf_counter()
+
+        # revisions are read from git, never from the working tree's index
+        index = None
+        if not (no_index or filtered or commits):
+            index = StructuralIndex.load(index_path())
+        if index and not index.covers(filepath):
+            # the index speaks only for the tree it was built from; anything
+            # else is walked, and kept out of it
+            if use_git:
+                warn(filepath, f"Not under the index of {index.root}, walking it")
+            index = None
+        if qualified and not index and not commits:
+            # re-exports are only known from every module in the tree, so
+            # without an index one is built for this search and dropped
+            with timed("index"):
+                scratch = StructuralIndex(path.abspath(filepath))
+                refresh_index(scratch, filepath, cache, use_git=False)
+                command = scratch.qualify(command)
+        entries: Iterable[Tuple[Task, int]] = []
+
+        if index:
+            with timed("index"):
+                files = refresh_index(index, filepath, cache, use_git)
+                index.save(index_path())
+                command = index.qualify(command)
+                hits = index.query(command)
+
+            if sort:
+                files.sort()
+
+            if hits is not None:
+                files = [x for x in files if path.abspath(x) in hits]
+
+                if count and not count_by:
+                    found = (len(hits[path.abspath(x)]) for x in files)
+                    out.write(f"{sum(min(x, limit or x) for x in found)}\n")
+                    report_stats(stats, start, stats_format)
+                    return
+
+                if files_with_matches and not count_by:
+                    for x in files:
+                        out.write(Result(x, []).format_name() + "\n")
+                    report_stats(stats, start, stats_format)
+                    return
+
+            entries = file_sizes(files)
+        elif not commits:
+            # streamed, so workers start while the walk continues
+            entries = walk_files(filepath, discovery)
+            if stats:
+                entries = stats.timed_iter("discover", entries)
+            if sort:
+                entries = sorted(entries)
+            if search_zip:
+                # members go out as they're listed, in tasks of their own
+                entries = expand_archives(entries, discovery, STREAM_CHUNK_BYTES)
+
+        total = 0
+        counts: "Counter[str]" = Counter()
+        config = SearchConfig(
+            command,
+            cache,
+            limit,
+            count,
+            jobs,
+            rendering,
+            executor,
+            timeout,
+            max_memory,
+            count_by,
+        )
+
+        if commits:
+            results = search_revs(filepath, commits, config, discovery, stats)
+        else:
+            entries, chosen, workers = choose_executor(entries, config)
+            config = replace(config, executor=chosen)
+            if max_memory and (chosen != EXECUTOR_PROCESS or workers <= 1):
+                click.echo(
+                    "sgrep: --max-memory only caps worker processes, "
+                    "and this search runs without them",
+                    err=True,
+                )
+            results = search_files(entries, config, ordered=sort, stats=stats)
+
+        for res in results:
+            with timed("output"):
+                if isinstance(res, FileError):
+                    warn(res.filename, res.message)
+                elif count_by:
+                    # already summed per batch by the workers
+                    counts.update(res)
+                elif count:
+                    total += res
+                elif not res.matches:
+                    continue
+                elif files_with_matches:
+                    out.write(res.format_name() + "\n")
+                else:
+                    out.write(res.format() + "\n")
+
+        if cache:
+            cache.evict()
+
+        if count_by:
+            if count_by == COUNT_PATTERN and len(patterns) == 1:
+                # a lone pattern's matches aren't labelled with it
+                counts = Counter({patterns[0]: counts[""]} if counts else {})
+            text = format_counts(counts, count_by, top, count_json)
+            if text:
+                out.write(text + "\n")
+        elif count:
+            out.write(f"{total}\n")
+
+        report_stats(stats, start, stats_format)
+
+
+@cli.command()
+@click.option("--cache/--no-cache", "use_cache", default=False)
+@click.option("--rebuild", "rebuild", is_flag=True)
+@click.argument("filepath", type=click.Path(exists=True), default=CURR_DIR)
+def index(filepath: str, use_cache: bool, rebuild: bool) -> None:
+    from src import git
 
-    if processes == 1:
-        match_results = [proc_file((visitor, files[0]))]
-    else:
-        with Pool(processes=processes) as pool:
-            match_results = pool.map(proc_file, ((visitor, x) for x in files))
+    structural_index = None if rebuild else StructuralIndex.load(index_path())
+    if not structural_index or not structural_index.covers(filepath):
+        structural_index = StructuralIndex(path.abspath(filepath))
 
-    if count:
-        print(sum([len(x.matches) for x in match_results]))
-        return
+    cache = get_cache(use_cache)
+    refresh_index(structural_index, filepath, cache, use_git=False)
+    structural_index.set_head(git.head(filepath))
+    structural_index.save(index_path())
+
+    if cache:
+        cache.evict()
+
+
+@cli.command("serve")
+@click.option("--cache/--no-cache", "use_cache", default=False)
+@click.option("--interval", "interval", type=click.FLOAT)
+@click.argument("filepath", type=click.Path(exists=True), default=CURR_DIR)
+def start_daemon(filepath: str, use_cache: bool, interval: Optional[float]) -> None:
+    from src.daemon import WATCH_INTERVAL, serve
 
-    [res.flush_res() for res in match_results]
+    interval = WATCH_INTERVAL if interval is None else interval
+    serve(socket_path(), [filepath], get_cache(use_cache), interval)
 
 
 if __name__ == "__main__":
-    sgrep()
+    cli()
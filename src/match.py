@@ -1,8 +1,10 @@
-from src.parse import Func, SIdent, Class, Args, Node, KW
-from typing import Any, List, Dict, TypeVar, Generic, Union, overload
+from src.parse import Func, SIdent, Class, Args, Node, KW, Nested, Patterns
+from src.symbols import resolve_calls
+from typing import Any, Callable, List, Dict, Final, Optional, Tuple, TypeVar
+from typing import Generic, Iterable, Union
 import ast
 
-Nodes = Union[Node, SIdent, Func, Class, KW]
+Nodes = Union[Node, SIdent, Func, Class, KW, Patterns, Nested]
 
 
 class SgrepMatchError(Exception):
@@ -28,100 +30,400 @@ class MatchPatterns(Generic[T]):
         return visitor_cls(pattern)  # type: ignore
 
 
-class MatchPatternIdent(ast.NodeVisitor):
-    def __init__(self, pattern: SIdent):
-        self.pattern = pattern
-        self.matches: List[ast.AST] = []
+NamePredicate = Callable[[str], bool]
+ArgsPredicate = Callable[[List[str]], bool]
+FuncPredicate = Callable[[str, List[str]], bool]
+
+
+def name_predicate(ident: Optional[SIdent]) -> NamePredicate:
+    """`$name` is exact, `$name*` a prefix, `$*name` a suffix and `$*name*`
+    a substring; decided once rather than per node."""
+    if ident is None or ident.is_wildcard:
+        return lambda name: True
+
+    value = ident.name
+    if ident.aliases:
+        # any of a qualified name's aliases, exactly or as a prefix
+        values = (value, *ident.aliases)
+        if ident.has_prefix and not ident.has_suffix:
+            return lambda name: name.startswith(values)
+        if not ident.has_suffix:
+            return frozenset(values).__contains__
+    if ident.has_prefix and ident.has_suffix:
+        return lambda name: value in name
+    if ident.has_prefix:
+        return lambda name: name.startswith(value)
+    if ident.has_suffix:
+        return lambda name: name.endswith(value)
+    return lambda name: name == value
+
+
+def args_predicate(args: Args) -> ArgsPredicate:
+    count = args.count
+    first = name_predicate(args.first_arg) if args.first_arg else None
+    contains = [name_predicate(x) for x in args.contains]
+
+    def matches(names: List[str]) -> bool:
+        if count and len(names) != count:
+            return False
+        if first and not (names and first(names[0])):
+            return False
+        return all(any(x(name) for name in names) for x in contains)
 
-    def is_ident_match(self, ident: SIdent, node: ast.Name) -> bool:
-        return ident.is_wildcard or ident.name in node.id
+    return matches
 
-    def visit_Name(self, node: ast.Name) -> None:
-        if self.is_ident_match(self.pattern, node):
-            self.matches.append(node)
 
+def func_predicate(pattern: Func) -> FuncPredicate:
+    """A name or an argument match is enough."""
+    if not pattern.fname and not pattern.args:
+        return lambda name, arg_names: True
 
-class MatchPatternFunc(ast.NodeVisitor):
-    def __init__(self, pattern: Func):
-        self.pattern = pattern
-        self.matches: List[ast.AST] = []
+    fname = name_predicate(pattern.fname) if pattern.fname else None
+    args = args_predicate(pattern.args) if pattern.args else None
 
-    @overload
-    def is_ident_match(self, ident: SIdent, node: ast.FunctionDef) -> bool: ...
-    @overload
-    def is_ident_match(self, ident: SIdent, node: ast.arg) -> bool: ...
-    def is_ident_match(self, ident: SIdent, node: Any) -> bool:
-        if isinstance(node, ast.FunctionDef):
-            return ident.is_wildcard or ident.name in node.name
-        elif isinstance(node, ast.arg):
-            return ident.is_wildcard or ident.name in node.arg
-        else:
-            raise SgrepMatchError("Match case not accounted for.")
+    def matches(name: str, arg_names: List[str]) -> bool:
+        if fname and fname(name):
+            return True
+        return bool(args) and args(arg_names)
 
-    def is_arg_match(self, args: Args, node: ast.FunctionDef) -> bool:
-        if args.count and not args.first_arg and len(args.contains) == 0:
-            return len(node.args.args) == args.count
+    return matches
 
-        if args.count and len(node.args.args) != args.count:
-            return False
 
-        if args.first_arg and 1 <= len(node.args.args):
-            if not self.is_ident_match(args.first_arg, node.args.args[0]):
-                return False
+def is_name_match(ident: SIdent, name: str) -> bool:
+    return name_predicate(ident)(name)
 
-        for arg in args.contains:
-            exists = False
-            for exp in node.args.args:
-                if self.is_ident_match(arg, exp):
-                    exists = True
 
-            if not exists:
-                return False
+def is_args_match(args: Args, names: List[str]) -> bool:
+    return args_predicate(args)(names)
 
-        return True
 
-    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
-        fname = self.pattern.fname
-        args = self.pattern.args
-        local_matches = set()
+def is_func_match(pattern: Func, name: str, arg_names: List[str]) -> bool:
+    return func_predicate(pattern)(name, arg_names)
 
-        if not fname and not args:
-            self.matches.append(node)
-            return
 
-        # some* or *some or some
-        if fname and self.is_ident_match(fname, node):
-            local_matches.add(node)
+def callee_name(node: ast.Call) -> str:
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return ""
 
-        if args and self.is_arg_match(args, node):
-            local_matches.add(node)
 
-        if bool(local_matches):
-            self.matches.extend(local_matches)
+def node_name(node: ast.AST) -> str:
+    """The name a pattern sees `node` by: a def's or class's own, a call's
+    callee, an identifier; for anything else, its kind."""
+    if isinstance(node, ast.Call):
+        return callee_name(node) or type(node).__name__
+    name = getattr(node, "name", None) or getattr(node, "id", None)
+    return name if isinstance(name, str) else type(node).__name__
 
 
-class MatchPatternClass(ast.NodeVisitor):
-    def __init__(self, pattern: Class):
+def call_arg_names(node: ast.Call) -> List[str]:
+    return [arg.id if isinstance(arg, ast.Name) else "" for arg in node.args]
+
+
+def def_arg_names(node: ast.FunctionDef) -> List[str]:
+    return [arg.arg for arg in node.args.args]
+
+
+# statements only nest inside these fields, so a pattern matching statements
+# never needs to descend into expressions
+BLOCK_FIELDS: Final = ("finalbody", "cases", "handlers", "orelse", "body")
+
+_child_fields: Dict[type, Tuple[str, ...]] = {}
+
+# what `>` and `>>` see as containers, everything a pattern can match that
+# can hold other matches, and the fields of each that are inside it; a
+# def's decorators, defaults and annotations, a class's bases and a call's
+# callee are beside it
+INNER_FIELDS: Final = {
+    ast.FunctionDef: ("body",),
+    ast.AsyncFunctionDef: ("body",),
+    ast.ClassDef: ("body",),
+    ast.Call: ("args", "keywords"),
+}
+
+
+def child_fields(cls: type) -> Tuple[str, ...]:
+    fields = _child_fields.get(cls)
+    if fields is None:
+        # expression contexts are leaves no pattern looks at
+        fields = tuple(reversed([x for x in cls._fields if x != "ctx"]))
+        _child_fields[cls] = fields
+    return fields
+
+
+Predicate = Callable[[Any], bool]
+# node type to the (tag, predicate) pairs interested in it
+Dispatch = Dict[type, List[Tuple[str, Predicate]]]
+Tagged = Tuple[str, ast.AST]
+
+
+class Matcher:
+    """A pattern compiled to the node types it can match and a predicate
+    over them. `search` walks the tree with an explicit stack in source
+    order, skipping expressions entirely when only statements can match."""
+
+    targets: Tuple[type, ...] = ()
+    statements_only: bool = False
+
+    def __init__(self, pattern: Nodes) -> None:
         self.pattern = pattern
+        self.tag = ""
         self.matches: List[ast.AST] = []
+        self.predicate: Predicate = lambda node: True
+
+    def dispatch(self) -> Dispatch:
+        return {cls: [(self.tag, self.predicate)] for cls in self.targets}
+
+    def prepare(self, tree: ast.AST, filename: str) -> None:
+        """Per-file state the predicate needs before a search."""
+
+    def search_tagged(
+        self, tree: ast.AST, limit: Optional[int] = None, filename: str = ""
+    ) -> List[Tagged]:
+        """Every (tag, node) match in `tree`, stopping early once `limit`
+        have been found. `filename` places qualified names in a module."""
+        self.prepare(tree, filename)
+        matches: List[Tagged] = []
+        dispatch = self.dispatch()
+        block_fields = BLOCK_FIELDS if self.statements_only else None
+        stack = [tree]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node = pop()
+            cls = type(node)
+            interested = dispatch.get(cls)
+            if interested:
+                for tag, predicate in interested:
+                    if predicate(node):
+                        matches.append((tag, node))
+                if limit and len(matches) >= limit:
+                    del matches[limit:]
+                    break
+
+            # children are pushed last to first so they pop in order
+            for field in block_fields or _child_fields.get(cls) or child_fields(cls):
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    for child in reversed(value):
+                        if isinstance(child, ast.AST):
+                            push(child)
+                elif isinstance(value, ast.AST):
+                    push(value)
+
+        return matches
+
+    def search(self, tree: ast.AST, limit: Optional[int] = None) -> List[ast.AST]:
+        """Match `tree` from scratch, stopping early once `limit` nodes
+        have matched."""
+        self.matches = [node for _, node in self.search_tagged(tree, limit)]
+        return self.matches
+
+    def visit(self, tree: ast.AST) -> None:
+        self.search(tree)
+
+
+class MatchPatternIdent(Matcher):
+    targets = (ast.Name,)
+
+    def __init__(self, pattern: SIdent):
+        super().__init__(pattern)
+        name = name_predicate(pattern)
+        self.predicate = lambda node: name(node.id)
+
 
-    def is_ident_match(self, ident: SIdent, node: ast.ClassDef) -> bool:
-        return ident.is_wildcard or ident.name in node.name
+class MatchPatternFunc(Matcher):
+    def __init__(self, pattern: Func):
+        super().__init__(pattern)
+        func = func_predicate(pattern)
+
+        # callee of each call node in the tree searched, by qualified name
+        self.resolved: Dict[int, str] = {}
+        fname = pattern.fname
+        self.qualified = pattern.call and bool(fname and fname.qualified)
+
+        if self.qualified:
+            self.targets = (ast.Call,)
+            self.predicate = lambda node: func(
+                self.resolved.get(id(node), ""), call_arg_names(node)
+            )
+        elif pattern.call:
+            self.targets = (ast.Call,)
+            self.predicate = lambda node: func(callee_name(node), call_arg_names(node))
+        else:
+            self.targets = (ast.FunctionDef,)
+            self.statements_only = True
+            self.predicate = lambda node: func(node.name, def_arg_names(node))
 
-    def visit_ClassDef(self, node: ast.ClassDef) -> None:
-        cname = self.pattern.cname
-        local_matches = set()
+    def prepare(self, tree: ast.AST, filename: str) -> None:
+        if self.qualified:
+            self.resolved = resolve_calls(tree, filename)
 
-        if cname and self.is_ident_match(cname, node):
-            local_matches.add(node)
-        elif not cname:
-            local_matches.add(node)
 
-        if bool(local_matches):
-            self.matches.extend(local_matches)
+class MatchPatternClass(Matcher):
+    targets = (ast.ClassDef,)
+    statements_only = True
+
+    def __init__(self, pattern: Class):
+        super().__init__(pattern)
+        name = name_predicate(pattern.cname)
+        self.predicate = lambda node: name(node.name)
+
+
+class MatchPatternSet(Matcher):
+    """Several patterns merged into one dispatch table, so a single pass
+    over the tree evaluates all of them, each match tagged with the source
+    of the pattern that hit."""
+
+    def __init__(self, pattern: Patterns):
+        super().__init__(pattern)
+        self.matchers: List[Matcher] = []
+        for node, source in zip(pattern.patterns, pattern.sources):
+            matcher = MatchPatterns.create(node)
+            matcher.tag = source
+            self.matchers.append(matcher)
+
+        # containment needs its own ancestor stack, so nested patterns
+        # take a pass each rather than joining the table
+        self.nested = [m for m in self.matchers if isinstance(m, MatchPatternNested)]
+        flat = [m for m in self.matchers if m not in self.nested]
+
+        self.targets = tuple({x for m in flat for x in m.targets})
+        self.statements_only = all(m.statements_only for m in flat)
+        self.table: Dispatch = {}
+        for matcher in flat:
+            for cls, interested in matcher.dispatch().items():
+                self.table.setdefault(cls, []).extend(interested)
+
+    def dispatch(self) -> Dispatch:
+        return self.table
+
+    def prepare(self, tree: ast.AST, filename: str) -> None:
+        for matcher in self.matchers:
+            if matcher not in self.nested:
+                matcher.prepare(tree, filename)
+
+    def search_tagged(
+        self, tree: ast.AST, limit: Optional[int] = None, filename: str = ""
+    ) -> List[Tagged]:
+        if not self.nested:
+            return super().search_tagged(tree, limit, filename)
+
+        found = super().search_tagged(tree, None, filename) if self.table else []
+        for matcher in self.nested:
+            found.extend(matcher.search_tagged(tree, None, filename))
+        found.sort(key=lambda x: (x[1].lineno, x[1].col_offset))  # type: ignore
+        return found[:limit] if limit else found
+
+
+class MatchPatternNested(Matcher):
+    """Matches of the last step whose enclosing containers satisfy the
+    steps before it, found in the same single pass as any other pattern:
+    each container entered is checked against the outer steps once, and
+    its result kept on an ancestor stack for the nodes below it."""
+
+    def __init__(self, pattern: Nested):
+        super().__init__(pattern)
+        self.steps: List[Matcher] = [MatchPatterns.create(x) for x in pattern.steps]
+        self.direct = pattern.direct
+
+        last = self.steps[-1]
+        self.targets = last.targets
+        self.predicate = last.predicate
+        # defs and classes only nest in statements, calls in anything
+        self.statements_only = all(x.statements_only for x in self.steps)
+
+    def enclosed(self, masks: List[int], end: int, step: int) -> bool:
+        """Whether steps[:step + 1] match containers among masks[:end],
+        each container's mask holding a bit per outer step it matches, and
+        step `step` the innermost of them when its combinator is `>`."""
+        if step < 0:
+            return True
+
+        bit = 1 << step
+        if self.direct[step]:
+            i = end - 1
+            return i >= 0 and bool(masks[i] & bit) and self.enclosed(masks, i, step - 1)
+
+        for i in range(end - 1, -1, -1):
+            if masks[i] & bit and self.enclosed(masks, i, step - 1):
+                return True
+        return False
+
+    def prepare(self, tree: ast.AST, filename: str) -> None:
+        for step in self.steps:
+            step.prepare(tree, filename)
+
+    def search_tagged(
+        self, tree: ast.AST, limit: Optional[int] = None, filename: str = ""
+    ) -> List[Tagged]:
+        self.prepare(tree, filename)
+        matches: List[Tagged] = []
+        outer = [(x.targets, x.predicate) for x in self.steps[:-1]]
+        targets, predicate = self.targets, self.predicate
+        innermost = len(outer) - 1
+        block_fields = BLOCK_FIELDS if self.statements_only else None
+
+        # per container enclosing the current node, outermost first
+        masks: List[int] = []
+        # around a container's inner fields, its mask marks entering it and
+        # a None leaving it
+        stack: List[Union[ast.AST, int, None]] = [tree]
+        pop = stack.pop
+        push = stack.append
+
+        def push_fields(node: ast.AST, fields: Iterable[str]) -> None:
+            for field in fields:
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    for child in reversed(value):
+                        if isinstance(child, ast.AST):
+                            push(child)
+                elif isinstance(value, ast.AST):
+                    push(value)
+
+        while stack:
+            node = pop()
+            if node is None:
+                masks.pop()
+                continue
+            if type(node) is int:
+                masks.append(node)
+                continue
+            assert isinstance(node, ast.AST)
+
+            cls = type(node)
+            if cls in targets and predicate(node):
+                if masks and self.enclosed(masks, len(masks), innermost):
+                    matches.append((self.tag, node))
+                    if limit and len(matches) >= limit:
+                        break
+
+            fields = block_fields or _child_fields.get(cls) or child_fields(cls)
+            inner = INNER_FIELDS.get(cls)
+            if inner is None:
+                push_fields(node, fields)
+                continue
+
+            mask = 0
+            for i, (types, matches_step) in enumerate(outer):
+                if cls in types and matches_step(node):
+                    mask |= 1 << i
+            # popped in reverse: the fields beside it, then those inside
+            push(None)
+            push_fields(node, [x for x in fields if x in inner])
+            push(mask)
+            push_fields(node, [x for x in fields if x not in inner])
+
+        return matches
 
 
 MatchPatterns.register("SIdent", MatchPatternIdent)
 MatchPatterns.register("Func", MatchPatternFunc)
 MatchPatterns.register("Class", MatchPatternClass)
+MatchPatterns.register("Patterns", MatchPatternSet)
+MatchPatterns.register("Nested", MatchPatternNested)
 # MatchPatterns.register(Keyword, MatchKeyword)
@@ -0,0 +1,269 @@
+import ast
+import json
+import re
+from bisect import bisect_right
+from typing import Final, Iterator, List, NamedTuple, Optional, Tuple
+from src.archive import is_member
+from src.cache import ParseCache, parse_file, read_source
+
+NOTEBOOK_SUFFIX: Final = ".ipynb"
+
+_WHITESPACE: Final = re.compile(rb"[ \t\n\r]*")
+_STRUCTURE: Final = re.compile(rb'["{}\[\]]')
+_SCALAR: Final = re.compile(rb"[^,}\]\s]*")
+
+# `x = !ls` and `t = %timeit f()`: keep the target, drop the magic
+_ASSIGNED_MAGIC: Final = re.compile(r"^(\s*[\w.,\s]+=\s*)[!%].*$")
+
+# (cell number, first line in the joined source) of each code cell
+Cells = List[Tuple[int, int]]
+
+
+class Notebook(NamedTuple):
+    """A notebook's code cells joined into one source, with the number and
+    first line of each cell in it."""
+
+    source: bytes
+    cells: Cells
+    code: List[str]
+
+
+def skip_ws(raw: bytes, i: int) -> int:
+    return _WHITESPACE.match(raw, i).end()  # type: ignore[union-attr]
+
+
+def string_end(raw: bytes, i: int) -> int:
+    """End of the JSON string starting at `i`. Long strings, e.g. base64
+    outputs, are crossed with one find per quote rather than per byte."""
+    j = i + 1
+    while True:
+        k = raw.find(b'"', j)
+        if k == -1:
+            raise ValueError(f"Unterminated string at byte {i}")
+        escapes = 0
+        while raw[k - 1 - escapes] == ord("\\"):
+            escapes += 1
+        if escapes % 2 == 0:
+            return k + 1
+        j = k + 1
+
+
+def value_end(raw: bytes, i: int) -> int:
+    """End of the JSON value starting at `i`, found without decoding it."""
+    c = raw[i : i + 1]
+    if c == b'"':
+        return string_end(raw, i)
+    if c not in (b"{", b"["):
+        return _SCALAR.match(raw, i).end()  # type: ignore[union-attr]
+
+    depth = 0
+    while True:
+        found = _STRUCTURE.search(raw, i)
+        if found is None:
+            raise ValueError("Unterminated JSON container")
+        i = found.start()
+        c = raw[i : i + 1]
+        if c == b'"':
+            i = string_end(raw, i)
+            continue
+        depth += 1 if c in (b"{", b"[") else -1
+        i += 1
+        if depth == 0:
+            return i
+
+
+def expect(raw: bytes, i: int, char: bytes) -> int:
+    i = skip_ws(raw, i)
+    if raw[i : i + 1] != char:
+        raise ValueError(f"Expected {char!r} at byte {i}")
+    return i + 1
+
+
+def iter_items(raw: bytes, i: int) -> Iterator[int]:
+    """Start of each element of the JSON array at `i`."""
+    i = expect(raw, i, b"[")
+    while True:
+        i = skip_ws(raw, i)
+        if raw[i : i + 1] == b"]":
+            return
+        yield i
+        i = skip_ws(raw, value_end(raw, i))
+        if raw[i : i + 1] == b",":
+            i += 1
+
+
+def iter_members(raw: bytes, i: int) -> Iterator[Tuple[str, int]]:
+    """Key and value start of each member of the JSON object at `i`."""
+    i = expect(raw, i, b"{")
+    while True:
+        i = skip_ws(raw, i)
+        if raw[i : i + 1] == b"}":
+            return
+        end = string_end(raw, i)
+        key = json.loads(raw[i:end])
+        start = skip_ws(raw, expect(raw, end, b":"))
+        yield key, start
+        i = skip_ws(raw, value_end(raw, start))
+        if raw[i : i + 1] == b",":
+            i += 1
+
+
+def decode_value(raw: bytes, i: int) -> object:
+    return json.loads(raw[i : value_end(raw, i)])
+
+
+def extract_cells(raw: bytes) -> List[Tuple[int, str]]:
+    """(cell number, source) of each code cell. Outputs, which are most of
+    a notebook's bytes, are skipped over without being decoded."""
+    cells = []
+    for key, start in iter_members(raw, skip_ws(raw, 0)):
+        if key != "cells":
+            continue
+
+        for number, item in enumerate(iter_items(raw, start), 1):
+            cell_type = source = None
+            for field, value in iter_members(raw, item):
+                if field == "cell_type":
+                    cell_type = decode_value(raw, value)
+                elif field == "source":
+                    source = decode_value(raw, value)
+
+            if cell_type == "code" and source:
+                text = "".join(source) if isinstance(source, list) else str(source)
+                cells.append((number, text))
+
+    return cells
+
+
+def scan_line(line: str, depth: int, quote: str) -> Tuple[int, str, bool]:
+    """Open brackets and the open string after `line`, given those before
+    it, and whether a backslash continues it onto the next line."""
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quote:
+            if c == "\\":
+                i += 2
+            elif line.startswith(quote, i):
+                i += len(quote)
+                quote = ""
+            else:
+                i += 1
+            continue
+
+        if c == "#":
+            return depth, "", False
+        if c in "\"'":
+            quote = line[i : i + 3] if line[i : i + 3] in ('"""', "'''") else c
+            i += len(quote)
+            continue
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth = max(depth - 1, 0)
+        i += 1
+
+    continued = line.endswith("\\")
+    if len(quote) == 1 and not continued:
+        # a one-quote string ends with its line
+        quote = ""
+    return depth, quote, continued
+
+
+def strip_magics(code: str) -> str:
+    """IPython syntax at the start of a logical line replaced line for line
+    with plain Python, so line and column numbers still point into the
+    original cell. Lines inside brackets and strings are left alone."""
+    lines = code.split("\n")
+    depth, quote, continued = 0, "", False
+
+    for i, line in enumerate(lines):
+        if not (depth or quote or continued):
+            stripped = line.lstrip()
+            indent = line[: len(line) - len(stripped)]
+
+            if stripped.startswith(("%", "!", "?")):
+                # a cell magic's body may still be Python, e.g. %%time
+                line = indent + "pass"
+            elif stripped.endswith("?") and "#" not in stripped:
+                line = indent + "pass"
+            else:
+                line = _ASSIGNED_MAGIC.sub(r"\1None", line)
+            lines[i] = line
+
+        depth, quote, continued = scan_line(line, depth, quote)
+    return "\n".join(lines)
+
+
+def load_notebook(raw: bytes) -> Notebook:
+    source = []
+    cells = []
+    lineno = 1
+
+    for number, code in extract_cells(raw):
+        code = code if code.endswith("\n") else code + "\n"
+        cells.append((number, lineno))
+        source.append(code)
+        lineno += code.count("\n")
+
+    return Notebook("".join(source).encode(), cells, source)
+
+
+def parse_cell(code: bytes, filename: str, cache: Optional[ParseCache]) -> ast.AST:
+    if cache:
+        return cache.parse_fragment(code, filename)
+    return ast.parse(code, filename)
+
+
+def parse_notebook(
+    notebook: Notebook, filename: str, cache: Optional[ParseCache] = None
+) -> ast.Module:
+    """One module holding every code cell's statements, each cell parsed
+    (and cached) on its own and shifted to its line in `notebook.source`.
+    A cell magic's cell that isn't Python, e.g. %%bash, contributes
+    nothing; any other cell that doesn't parse fails the whole notebook,
+    like a syntax error in a .py file, naming the cell."""
+    body: List[ast.stmt] = []
+
+    for (number, start), code in zip(notebook.cells, notebook.code):
+        try:
+            tree = parse_cell(strip_magics(code).encode(), filename, cache)
+        except (SyntaxError, ValueError) as e:
+            if code.lstrip().startswith("%%"):
+                continue
+            raise SyntaxError(f"cell {number}: {e}") from e
+        body.extend(ast.increment_lineno(tree, start - 1).body)  # type: ignore
+
+    return ast.Module(body=body, type_ignores=[])
+
+
+def is_notebook(filepath: str) -> bool:
+    return filepath.endswith(NOTEBOOK_SUFFIX)
+
+
+def parse_source(
+    filepath: str, cache: Optional[ParseCache] = None, src: Optional[bytes] = None
+) -> Tuple[bytes, ast.AST, Cells]:
+    """A file's tree with the source its line numbers refer to: the file
+    itself, or for a notebook its joined code cells and where each cell
+    starts. A member of an archive is cached by its content, having no
+    stat to key on."""
+    if src is None:
+        src = read_source(filepath)
+
+    if is_member(filepath):
+        if not is_notebook(filepath):
+            return src, parse_cell(src, filepath, cache), []
+    elif not is_notebook(filepath):
+        return src, parse_file(filepath, cache, src), []
+
+    notebook = load_notebook(src)
+    return notebook.source, parse_notebook(notebook, filepath, cache), notebook.cells
+
+
+def cell_location(cells: Cells, lineno: int) -> Tuple[int, int]:
+    """(cell number, line within the cell) of a line in a notebook's joined
+    source."""
+    i = bisect_right([x for _, x in cells], lineno) - 1
+    number, start = cells[i]
+    return number, lineno - start + 1
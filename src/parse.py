@@ -1,7 +1,7 @@
 import keyword
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Final, Optional, Any, List
+from typing import Final, Optional, Any, List, Tuple
 
 
 class Type(Enum):
@@ -15,6 +15,8 @@ class Type(Enum):
     DOTS = auto()
     SIGIL = auto()
     NUM = auto()
+    CHILD = auto()
+    DESCENDANT = auto()
 
 
 TOKENMAPPING: Final = {
@@ -26,6 +28,8 @@ TOKENMAPPING: Final = {
     "@": Type.DECORATOR,
     "...": Type.DOTS,
     "$": Type.SIGIL,
+    ">": Type.CHILD,
+    ">>": Type.DESCENDANT,
 }
 
 KEYWORDS: Final = keyword.kwlist + ["call", "args"]
@@ -40,7 +44,9 @@ class Token:
 
 @dataclass
 class Node:
-    pass
+    def literals(self) -> List[str]:
+        """Strings that must occur in a file's source for it to match."""
+        return []
 
 
 @dataclass
@@ -49,6 +55,17 @@ class SIdent(Node):
     is_wildcard: bool
     has_prefix: bool
     has_suffix: bool
+    # other qualified names for the same object, e.g. where a package
+    # re-exports it; filled in from the index
+    aliases: Tuple[str, ...] = ()
+
+    @property
+    def qualified(self) -> bool:
+        """A dotted name, matched against what a callee resolves to."""
+        return "." in self.name
+
+    def literals(self) -> List[str]:
+        return [] if self.is_wildcard or not self.name else [self.name]
 
 
 @dataclass
@@ -64,18 +81,61 @@ class Func(Node):
     args: Optional[Args]
     call: bool
 
+    def literals(self) -> List[str]:
+        required = ["(" if self.call else "def"]
+        # a name or an argument match is enough, so the name is only
+        # required when there are no argument constraints; a qualified
+        # name may be reached under any alias
+        if self.fname and not self.args and not self.fname.qualified:
+            required.extend(self.fname.literals())
+        return required
+
 
 @dataclass
 class Class(Node):
     cname: Optional[SIdent]
     inherits: List[SIdent]
 
+    def literals(self) -> List[str]:
+        return ["class", *(self.cname.literals() if self.cname else [])]
+
 
 @dataclass
 class KW(Node):
     kw: str
     ctx: Optional[Any]  # TODO: Figure ctx out to track for KW
 
+    def literals(self) -> List[str]:
+        return [self.kw]
+
+
+@dataclass
+class Patterns(Node):
+    """Several patterns searched for together, `sources` holding the text
+    each was parsed from."""
+
+    patterns: List[Node]
+    sources: List[str]
+
+    def literals(self) -> List[str]:
+        # only what every pattern requires is required of the file
+        required = [set(x.literals()) for x in self.patterns]
+        common = set.intersection(*required) if required else set()
+        return sorted(common)
+
+
+@dataclass
+class Nested(Node):
+    """`A > B` and `A >> B`: B directly inside an A, with no def, class or
+    call in between, or anywhere inside one. `steps` runs outermost first
+    and `direct` says, for each combinator, whether it is `>`."""
+
+    steps: List[Node]
+    direct: List[bool]
+
+    def literals(self) -> List[str]:
+        return sorted({x for step in self.steps for x in step.literals()})
+
 
 class SgrepParseError(Exception):
     pass
@@ -137,6 +197,14 @@ class Tokenize:
         if keyword.iskeyword(id):
             raise SgrepParseError(f"Expected identifier, got keyword '{id}'")
 
+        # a qualified name, e.g. $requests.get or $pkg.mod.*
+        while id and self.current_char == ".":
+            self.advance()
+            part = self.get_ident()
+            if not part and self.current_char != "*":
+                raise SgrepParseError("Expected identifier after '.'")
+            id += "." + part
+
         has_suffix = self.current_char == "*" if self.current_char else False
         if has_suffix:
             self.advance()
@@ -178,6 +246,13 @@ class Tokenize:
                     return Token(TOKENMAPPING[result], result, start)
                 else:
                     raise SgrepParseError("Invalid command.")
+            if self.current_char == ">":
+                start = self.column
+                self.advance()
+                if self.current_char == ">":
+                    self.advance()
+                    return Token(Type.DESCENDANT, ">>", start)
+                return Token(Type.CHILD, ">", start)
             if self.current_char in TOKENMAPPING:
                 start = self.column
                 char = self.current_char
@@ -226,11 +301,11 @@ class Parser:
             elif self.current_token.type == Type.CARET:
                 self.consume(Type.CARET)
                 if self.current_token.type == Type.SIGIL:
-                    first = self.parse_sigil_ident()
+                    first = self.parse_name()
                 else:
                     raise SgrepParseError("Invalid command.")
             elif self.current_token.type == Type.SIGIL:
-                contains.extend(self.parse_sigil_ident())
+                contains.append(self.parse_name())
             elif self.current_token.type == Type.DOTS:
                 self.consume(Type.DOTS)
 
@@ -255,7 +330,31 @@ class Parser:
 
         return SIdent(value, is_wildcard, has_prefix, has_suffix)
 
+    def parse_name(self) -> SIdent:
+        """An identifier where qualified names aren't supported."""
+        ident = self.parse_sigil_ident()
+        if ident.qualified:
+            raise SgrepParseError("Qualified names are only supported after call.")
+        return ident
+
     def parse_commands(self) -> Node:
+        """A command, or commands joined by `>` and `>>`."""
+        steps = [self.parse_command()]
+        direct: List[bool] = []
+
+        while self.current_token and self.current_token.type in (
+            Type.CHILD,
+            Type.DESCENDANT,
+        ):
+            if not isinstance(steps[-1], (Func, Class)):
+                raise SgrepParseError("Only def, class and call can contain others.")
+            direct.append(self.current_token.type == Type.CHILD)
+            self.consume(self.current_token.type)
+            steps.append(self.parse_command())
+
+        return steps[0] if len(steps) == 1 else Nested(steps, direct)
+
+    def parse_command(self) -> Node:
         token = self.current_token
 
         while token:
@@ -268,7 +367,7 @@ class Parser:
                         self.consume(Type.KEYWORD)
 
                         if self.current_token and self.current_token.type == Type.SIGIL:
-                            name = self.parse_sigil_ident()
+                            name = self.parse_name()
 
                         if (
                             self.current_token
@@ -282,8 +381,10 @@ class Parser:
                         name: Optional[SIdent] = None
                         inherits: List[SIdent] = []
 
+                        self.consume(Type.KEYWORD)
+
                         if self.current_token and self.current_token.type == Type.SIGIL:
-                            name = self.parse_sigil_ident()
+                            name = self.parse_name()
 
                         return Class(name, inherits)
 
@@ -291,6 +392,8 @@ class Parser:
                         name: Optional[SIdent] = None
                         args: Optional[Args] = None
 
+                        self.consume(Type.KEYWORD)
+
                         if self.current_token and self.current_token.type == Type.SIGIL:
                             name = self.parse_sigil_ident()
 
@@ -304,7 +407,7 @@ class Parser:
                     else:
                         return KW(token.value, None)
                 case Type.SIGIL:
-                    return self.parse_sigil_ident()
+                    return self.parse_name()
                 case Type.DECORATOR:
                     pass
 
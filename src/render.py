@@ -0,0 +1,124 @@
+import ast
+import io
+from dataclasses import dataclass
+from itertools import accumulate
+from tokenize import detect_encoding
+from typing import Dict, Final, List, NamedTuple, Optional, Tuple
+from src.match import Tagged
+
+# matches of these show only their header unless the whole body is asked for
+HEADER_KINDS: Final = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+class Match(NamedTuple):
+    """A match rendered where it was found, so only this record and not the
+    matched subtree crosses the process boundary."""
+
+    lineno: int
+    col_offset: int
+    end_lineno: Optional[int]
+    kind: str
+    snippet: str
+    # source of the pattern that hit, set when several are searched at once
+    pattern: str = ""
+
+
+@dataclass
+class Rendering:
+    """Lines of context around each match, grep's -B/-A, and whether a
+    def or class shows its whole body rather than its header."""
+
+    before: int = 0
+    after: int = 0
+    full: bool = False
+
+
+class SourceLines:
+    """A file's lines sliced out of its bytes through a table of line start
+    offsets, decoding only the lines that are printed."""
+
+    def __init__(self, src: bytes) -> None:
+        self.src = src
+        try:
+            self.encoding, _ = detect_encoding(io.BytesIO(src).readline)
+        except SyntaxError:
+            self.encoding = "utf-8"
+        # same line breaks as the tokenizer: \n, \r\n and \r
+        self.offsets = [0, *accumulate(map(len, src.splitlines(keepends=True)))]
+        self.decoded: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def line(self, lineno: int) -> str:
+        text = self.decoded.get(lineno)
+        if text is None:
+            raw = self.src[self.offsets[lineno - 1] : self.offsets[lineno]]
+            text = raw.decode(self.encoding, errors="replace").rstrip("\r\n")
+            self.decoded[lineno] = text
+        return text
+
+    def lines(self, start: int, end: int) -> List[str]:
+        return [self.line(x) for x in range(start, end + 1)]
+
+
+def header_end(node: ast.AST, lines: SourceLines) -> int:
+    """Last line of a def or class header: the line before its body, or
+    before the first statement's decorators, less any blank or comment
+    lines in between."""
+    first = node.body[0]  # type: ignore[attr-defined]
+    decorators = getattr(first, "decorator_list", [])
+    body = min([first.lineno, *(x.lineno for x in decorators)])
+    end = max(node.lineno, body - 1)  # type: ignore[attr-defined]
+    while end > node.lineno:
+        text = lines.line(end).strip()
+        if text and not text.startswith("#"):
+            break
+        end -= 1
+    return end
+
+
+def match_span(node: ast.AST, lines: SourceLines, full: bool) -> Tuple[int, int]:
+    start = node.lineno  # type: ignore[attr-defined]
+    end = getattr(node, "end_lineno", None) or start
+    if end == start:
+        return start, end
+    if isinstance(node, HEADER_KINDS) and not full:
+        end = min(end, header_end(node, lines))
+    return start, min(end, len(lines))
+
+
+def render_file(
+    tagged: List[Tagged], src: bytes, rendering: Rendering
+) -> Tuple[List[Match], Dict[int, str]]:
+    """Matches as slices of the original source, plus the context lines
+    around them by line number."""
+    if not tagged:
+        return [], {}
+
+    lines = SourceLines(src)
+    matches = []
+    context: Dict[int, str] = {}
+
+    for tag, node in tagged:
+        start, end = match_span(node, lines, rendering.full)
+        snippet = "\n".join(lines.lines(start, end))
+        matches.append(
+            Match(
+                start,
+                node.col_offset,  # type: ignore[attr-defined]
+                getattr(node, "end_lineno", None),
+                node.__class__.__name__,
+                snippet,
+                tag,
+            )
+        )
+
+        if rendering.before or rendering.after:
+            first = max(1, start - rendering.before)
+            last = min(len(lines), end + rendering.after)
+            for lineno in (*range(first, start), *range(end + 1, last + 1)):
+                if lineno not in context:
+                    context[lineno] = lines.line(lineno)
+
+    return matches, context
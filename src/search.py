@@ -0,0 +1,836 @@
+from collections import Counter
+from contextlib import contextmanager
+from copy import copy
+from dataclasses import dataclass, field, replace
+from itertools import chain, islice
+import mmap
+import os
+import signal
+import sys
+import threading
+import time
+from os import path
+from typing import Any, Callable, Dict, Final, Iterable, Iterator, NamedTuple, Optional
+from typing import TYPE_CHECKING, List, Set, Sized, Tuple, TypeVar, Union
+from src.parse import SIdent, Func, Class, KW, Nested, Patterns, Tokenize, Parser, Node
+from src.match import MatchPatterns, Matcher, Tagged, node_name
+from src.cache import PARSE_ERRORS, ParseCache
+from src.archive import ArchiveTask, Task, archive_errors, read_members
+from src.discover import Discovery, FileEntry, path_filter, walk_files
+from src.stats import SearchStats, no_timer
+from src.notebook import Cells, cell_location, is_notebook, parse_source
+from src.render import Match, Rendering, render_file
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+
+Nodes = Union[Node, SIdent, Func, Class, KW, Patterns, Nested]
+T = TypeVar("T")
+
+CHUNKS_PER_WORKER: Final = 4
+MIN_CHUNK_BYTES: Final = 64 * 1024
+MAX_CHUNK_BYTES: Final = 4 * 1024 * 1024
+# batch target while discovery is still streaming and the total is unknown
+STREAM_CHUNK_BYTES: Final = 256 * 1024
+# how far a stream is read ahead to put its largest files first
+LOOKAHEAD_FILES: Final = 256
+MMAP_THRESHOLD: Final = 1024 * 1024
+# below this many bytes in total, starting a pool costs more than the
+# workers save, so the search runs in this process
+IN_PROCESS_BYTES: Final = 256 * 1024
+
+EXECUTOR_PROCESS: Final = "process"
+EXECUTOR_THREAD: Final = "thread"
+EXECUTOR_SERIAL: Final = "serial"
+EXECUTORS: Final = (EXECUTOR_PROCESS, EXECUTOR_THREAD, EXECUTOR_SERIAL)
+
+# what --count-by counts matches by
+COUNT_FILE: Final = "file"
+COUNT_DIR: Final = "dir"
+COUNT_NAME: Final = "name"
+COUNT_PATTERN: Final = "pattern"
+COUNT_KEYS: Final = (COUNT_FILE, COUNT_DIR, COUNT_NAME, COUNT_PATTERN)
+
+# a process worker is replaced after this many batches, handing back
+# whatever memory parsing large files left it holding
+MAX_TASKS_PER_WORKER: Final = 64
+
+
+class SgrepBudgetError(Exception):
+    pass
+
+
+@dataclass
+class Result:
+    def __init__(
+        self,
+        filename: str,
+        matches: List[Match],
+        context: Optional[Dict[int, str]] = None,
+        cells: Optional[Cells] = None,
+    ) -> None:
+        self.matches: List[Match] = matches
+        self.context: Dict[int, str] = context or {}
+        self.filename: str = filename
+        # where each code cell starts when the file is a notebook
+        self.cells: Cells = cells or []
+
+    def format_lineno(self, lineno: int) -> str:
+        if not self.cells:
+            return str(lineno)
+        cell, line = cell_location(self.cells, lineno)
+        return f"cell {cell}:line {line}"
+
+    def format_line(self, lineno: int, text: str, tag: Optional[str]) -> str:
+        # TODO conditionally apply colors based on term's capabilities
+        magenta = "\033[95m"  # ]
+        reset = "\033[0m"  # ]
+        bold = "\033[1m"  # ]
+
+        location = self.format_lineno(lineno)
+        if tag is None:
+            return f"{magenta}{location}-{reset} {text}"
+
+        label = f"[{tag}] " if tag else ""
+        return f"{bold}{magenta}{location}:{reset} {label}{text}"
+
+    def format_name(self) -> str:
+        # TODO move this to a util file
+        magenta = "\033[95m"  # ]
+        reset = "\033[0m"  # ]
+        return f"{magenta}{self.filename}{reset}"
+
+    def format(self) -> str:
+        """grep-style: each line once, `N:` inside a match and `N-` for
+        context, with `--` between non-adjacent groups when there is
+        context."""
+        # line number to its text and, for matched lines, the label to show
+        shown: Dict[int, Tuple[str, Optional[str]]] = {}
+        for match in self.matches:
+            for i, text in enumerate(match.snippet.split("\n")):
+                shown.setdefault(match.lineno + i, (text, "" if i else match.pattern))
+        for lineno, text in self.context.items():
+            shown.setdefault(lineno, (text, None))
+
+        lines = [self.format_name()]
+        previous = None
+        for lineno in sorted(shown):
+            if self.context and previous is not None and lineno > previous + 1:
+                lines.append("--")
+            lines.append(self.format_line(lineno, *shown[lineno]))
+            previous = lineno
+        return "\n".join(lines)
+
+    def flush_res(self) -> None:
+        print(self.format())
+
+
+def get_py_file(filepath: str, discovery: Optional[Discovery] = None) -> list[str]:
+    return [x for x, _ in walk_files(filepath, discovery)]
+
+
+def file_sizes(files: List[str]) -> List[FileEntry]:
+    entries = []
+    for x in files:
+        try:
+            entries.append((x, path.getsize(x)))
+        except OSError:
+            entries.append((x, 0))
+    return entries
+
+
+def parse_command(src: str) -> Nodes:
+    tokens = Tokenize(src)
+    parser = Parser(tokens)
+    return parser.parse_commands()
+
+
+def parse_patterns(sources: List[str]) -> Nodes:
+    """One pattern as itself, several combined so that they are matched in
+    a single pass over each file."""
+    if len(sources) == 1:
+        return parse_command(sources[0])
+    return Patterns([parse_command(x) for x in sources], list(sources))
+
+
+def read_patterns(filepath: str) -> List[str]:
+    """Patterns from a file, one per line, skipping blanks and `#` comments."""
+    with open(filepath, "r") as f:
+        lines = [x.strip() for x in f]
+    return [x for x in lines if x and not x.startswith("#")]
+
+
+@dataclass
+class SearchConfig:
+    pattern: Nodes
+    cache: Optional[ParseCache] = None
+    limit: Optional[int] = None
+    count_only: bool = False
+    # workers, defaulting to one per CPU
+    jobs: Optional[int] = None
+    rendering: Rendering = field(default_factory=Rendering)
+    # one of EXECUTORS; when unset, small searches run serially and the
+    # rest on default_executor()
+    executor: Optional[str] = None
+    # seconds one file may take, and bytes a process worker may allocate
+    # for it, before it is skipped and reported
+    timeout: Optional[float] = None
+    max_memory: Optional[int] = None
+    # one of COUNT_KEYS: matches are counted by it instead of returned
+    count_by: Optional[str] = None
+
+
+def has_literals(src: Union[bytes, mmap.mmap], literals: List[bytes]) -> bool:
+    """Byte-level pre-scan: False when a required literal is missing, so
+    the file cannot match and needn't be parsed."""
+    return all(src.find(x) != -1 for x in literals)
+
+
+def read_candidate(filepath: str, literals: List[bytes]) -> Optional[bytes]:
+    """The file's bytes, or None when the pre-scan rules it out. Large files
+    are scanned through a memory map and only copied out if they pass."""
+    with open(filepath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if not literals or size < MMAP_THRESHOLD:
+            src = f.read()
+            return src if has_literals(src, literals) else None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:] if has_literals(mm, literals) else None
+
+
+class FileError(NamedTuple):
+    filename: str
+    message: str
+
+
+# what matching a file gives: its matches, their number with -c, or with
+# --count-by their number per key
+Outcome = Union[Result, int, FileError, "Counter[str]"]
+
+
+def count_key(count_by: str, filename: str) -> str:
+    """What a file's matches are counted under by file or by dir."""
+    return filename if count_by == COUNT_FILE else path.dirname(filename) or "."
+
+
+def count_matches(count_by: str, filename: str, tagged: List[Tagged]) -> "Counter[str]":
+    if count_by == COUNT_NAME:
+        return Counter(node_name(node) for _, node in tagged)
+    if count_by == COUNT_PATTERN:
+        return Counter(tag for tag, _ in tagged)
+    return Counter({count_key(count_by, filename): len(tagged)} if tagged else {})
+
+
+def reduce_counts(results: List[Outcome]) -> List[Outcome]:
+    """`results` with their counters summed into one, so a batch sends back
+    a count per key however many files and matches it had."""
+    counts: "Counter[str]" = Counter()
+    rest: List[Outcome] = []
+    for x in results:
+        if isinstance(x, Counter):
+            counts.update(x)
+        else:
+            rest.append(x)
+    return [counts, *rest] if counts else rest
+
+
+def pattern_literals(pattern: Nodes) -> List[bytes]:
+    return [x.encode() for x in pattern.literals()]
+
+
+def gil_disabled() -> bool:
+    # sys._is_gil_enabled is new in 3.13; a free-threaded build can still
+    # have the GIL turned back on, e.g. by PYTHON_GIL=1
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_enabled is not None and not is_enabled()
+
+
+def default_executor() -> str:
+    """Threads where they run in parallel, since they share trees and
+    results without pickling; processes otherwise."""
+    return EXECUTOR_THREAD if gil_disabled() else EXECUTOR_PROCESS
+
+
+# per-worker state, set once by init_worker instead of pickled per task;
+# thread-local so each thread of a thread pool keeps its own
+_worker = threading.local()
+
+
+def init_worker(config: SearchConfig) -> None:
+    # a worker's own cache handle, so its hit counts for --stats aren't
+    # mixed with other threads'
+    _worker.config = replace(config, cache=copy(config.cache))
+    _worker.visitor = MatchPatterns.create(config.pattern)
+    _worker.literals = pattern_literals(config.pattern)
+
+    # only a worker process is capped, never the parent running a search
+    # in-process or on threads
+    _worker.cap_memory = False
+    if config.max_memory:
+        # only loaded when a cap is asked for, to tell workers from the parent
+        import multiprocessing
+
+        _worker.cap_memory = multiprocessing.parent_process() is not None
+
+
+def limit_memory(max_bytes: int) -> None:
+    """Cap this process's address space at `max_bytes` above what it uses
+    now, so a file needing more raises MemoryError in the worker instead
+    of getting it killed. Set again before each file, it is a budget per
+    file rather than a cap on the worker's growth."""
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return
+
+    try:
+        with open("/proc/self/statm") as f:
+            in_use = int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        in_use = 0
+
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    soft = in_use + max_bytes
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+@contextmanager
+def time_budget(seconds: Optional[float]) -> Iterator[None]:
+    """Raise SgrepBudgetError once the block has run for `seconds`. With
+    SIGALRM, in a main thread, it is raised at the first bytecode after the
+    deadline, so a parse, which runs in C, is only stopped once it returns;
+    elsewhere the block runs to the end and raises if it overran."""
+    if not seconds:
+        yield
+        return
+
+    def expire(signum: int, frame: Any) -> None:
+        raise SgrepBudgetError(f"Skipped, took over {seconds:g}s")
+
+    alarm = hasattr(signal, "setitimer")
+    alarm = alarm and threading.current_thread() is threading.main_thread()
+    if alarm:
+        previous = signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            # None for a handler installed outside Python, left alone
+            if previous is not None:
+                signal.signal(signal.SIGALRM, previous)
+
+    if time.perf_counter() - start > seconds:
+        expire(signal.SIGALRM, None)
+
+
+def match_file(
+    filepath: str,
+    config: SearchConfig,
+    matcher: Matcher,
+    literals: List[bytes],
+    stats: Optional[SearchStats] = None,
+) -> Outcome:
+    """Match one file, returning only its match count when counting. A file
+    that can't be read or parsed becomes a FileError instead of failing
+    the whole run."""
+    timed = stats.timed if stats else no_timer
+
+    try:
+        with timed("read"):
+            src = read_candidate(filepath, literals)
+    except PARSE_ERRORS as e:
+        if stats:
+            stats.errors += 1
+        return FileError(filepath, str(e))
+
+    size = len(src) if src is not None else os.path.getsize(filepath) if stats else 0
+    return match_source(filepath, src, size, config, matcher, config.cache, stats)
+
+
+def match_source(
+    filename: str,
+    src: Optional[bytes],
+    size: int,
+    config: SearchConfig,
+    matcher: Matcher,
+    cache: Optional[ParseCache],
+    stats: Optional[SearchStats] = None,
+) -> Outcome:
+    """match_file for source already read, None when the pre-scan ruled
+    it out. `size` is its length in bytes, for --stats. A file over the
+    config's time or memory budget becomes a FileError."""
+    if config.max_memory and getattr(_worker, "cap_memory", False):
+        limit_memory(config.max_memory)
+
+    try:
+        with time_budget(config.timeout):
+            return scan_source(filename, src, size, config, matcher, cache, stats)
+    except (SgrepBudgetError, MemoryError) as e:
+        if stats:
+            stats.over_budget += 1
+        return FileError(filename, str(e) or "Skipped, out of memory")
+
+
+def scan_source(
+    filename: str,
+    src: Optional[bytes],
+    size: int,
+    config: SearchConfig,
+    matcher: Matcher,
+    cache: Optional[ParseCache],
+    stats: Optional[SearchStats] = None,
+) -> Outcome:
+    timed = stats.timed if stats else no_timer
+
+    tree = None
+    source: bytes = src or b""
+    cells: Cells = []
+    if src is not None:
+        hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+        start = time.perf_counter()
+        try:
+            with timed("parse"):
+                source, tree, cells = parse_source(filename, cache, src)
+        except PARSE_ERRORS as e:
+            if stats:
+                stats.errors += 1
+            return FileError(filename, str(e))
+        if stats:
+            stats.add_parse(filename, time.perf_counter() - start)
+        if stats and cache:
+            stats.cache_hits += cache.hits - hits
+            stats.cache_misses += cache.misses - misses
+
+    with timed("match"):
+        matches = (
+            [] if tree is None else matcher.search_tagged(tree, config.limit, filename)
+        )
+
+    if stats:
+        stats.files += 1
+        stats.bytes += size
+        stats.skipped += tree is None
+        stats.matches += len(matches)
+
+    if config.count_by:
+        return count_matches(config.count_by, filename, matches)
+
+    if config.count_only:
+        return len(matches)
+
+    with timed("render"):
+        rendered, context = render_file(matches, source, config.rendering)
+        return Result(filename, rendered, context, cells)
+
+
+def match_archive(
+    task: ArchiveTask,
+    config: SearchConfig,
+    matcher: Matcher,
+    literals: List[bytes],
+    stats: Optional[SearchStats] = None,
+) -> List[Outcome]:
+    """match_file for each member of an archive, read and matched one at a
+    time. Members are parse-cached by content, so an unchanged archive is
+    matched again without reparsing."""
+    results: List[Outcome] = []
+    members: Iterable[Tuple[str, bytes]] = read_members(task)
+    if stats:
+        members = stats.timed_iter("read", members)
+
+    try:
+        for name, src in members:
+            scanned = src if has_literals(src, literals) else None
+            results.append(
+                match_source(
+                    name, scanned, len(src), config, matcher, config.cache, stats
+                )
+            )
+    except archive_errors() as e:
+        if stats:
+            stats.errors += 1
+        results.append(FileError(task.archive, str(e)))
+    return results
+
+
+def proc_file(filepath: str, stats: Optional[SearchStats] = None) -> Outcome:
+    """match_file with the worker's visitor."""
+    worker = _worker
+    assert hasattr(worker, "visitor"), "init_worker must run first"
+    return match_file(filepath, worker.config, worker.visitor, worker.literals, stats)
+
+
+def proc_task(task: Task, stats: Optional[SearchStats] = None) -> List[Outcome]:
+    if isinstance(task, str):
+        return [proc_file(task, stats)]
+
+    worker = _worker
+    return match_archive(task, worker.config, worker.visitor, worker.literals, stats)
+
+
+def proc_batch(batch: List[Task]) -> List[Outcome]:
+    results = [x for task in batch for x in proc_task(task)]
+    return reduce_counts(results) if _worker.config.count_by else results
+
+
+def proc_batch_stats(
+    batch: List[Task],
+) -> Tuple[List[Outcome], SearchStats]:
+    """Like proc_batch, also timing each phase for --stats."""
+    stats = SearchStats()
+    start = time.perf_counter()
+    results = [x for task in batch for x in proc_task(task, stats)]
+    if _worker.config.count_by:
+        results = reduce_counts(results)
+    stats.busy = time.perf_counter() - start
+    return results, stats
+
+
+Source = Union[Tuple[str, Optional[bytes]], FileError]
+
+
+def proc_sources(
+    batch: List[Source], stats: Optional[SearchStats] = None
+) -> List[Outcome]:
+    """Like proc_batch, for sources read elsewhere, e.g. git blobs. A None
+    source was skipped, being too large; a FileError, for one that couldn't
+    be read, is passed through."""
+    worker = _worker
+    results: List[Outcome] = []
+    for source in batch:
+        if isinstance(source, FileError):
+            results.append(source)
+            continue
+        name, src = source
+        size = len(src) if src is not None else 0
+        if src is not None and not has_literals(src, worker.literals):
+            src = None
+        results.append(
+            match_source(name, src, size, worker.config, worker.visitor, None, stats)
+        )
+    return results
+
+
+def proc_sources_stats(
+    batch: List[Source],
+) -> Tuple[List[Outcome], SearchStats]:
+    stats = SearchStats()
+    start = time.perf_counter()
+    results = proc_sources(batch, stats)
+    stats.busy = time.perf_counter() - start
+    return results, stats
+
+
+def batch_files(entries: Iterable[Tuple[T, int]], target: int) -> Iterator[List[T]]:
+    """Group consecutive files into batches of about `target` bytes, so
+    many small files share one task while large files go out alone."""
+    batch: List[T] = []
+    batch_bytes = 0
+
+    for x, size in entries:
+        batch.append(x)
+        batch_bytes += size
+        if batch_bytes >= target:
+            yield batch
+            batch, batch_bytes = [], 0
+
+    if batch:
+        yield batch
+
+
+def batch_target(entries: List[Tuple[Task, int]], workers: int) -> int:
+    """Aim for CHUNKS_PER_WORKER batches per worker."""
+    target = sum(size for _, size in entries) // max(workers * CHUNKS_PER_WORKER, 1)
+    return max(MIN_CHUNK_BYTES, min(target, MAX_CHUNK_BYTES))
+
+
+def is_small(
+    entries: Iterable[Tuple[T, int]],
+) -> Tuple[Iterable[Tuple[T, int]], bool]:
+    """`entries`, and whether they add up to less than IN_PROCESS_BYTES.
+    A stream is read ahead only until it reaches that, and what was read
+    is put back in front of the rest."""
+    if isinstance(entries, list):
+        return entries, sum(size for _, size in entries) < IN_PROCESS_BYTES
+
+    it = iter(entries)
+    head: List[Tuple[T, int]] = []
+    total = 0
+    for entry in it:
+        head.append(entry)
+        total += entry[1]
+        if total >= IN_PROCESS_BYTES:
+            return chain(head, it), False
+    return head, True
+
+
+def entry_size(entry: Tuple[Task, int]) -> int:
+    return entry[1]
+
+
+def largest_first(entries: Iterable[Tuple[Task, int]]) -> Iterator[List[Task]]:
+    """Batches of a stream of `entries`, largest first within each
+    LOOKAHEAD_FILES of them, so the workers still start on the first files
+    while the rest are being found."""
+    it = iter(entries)
+    while True:
+        window = sorted(islice(it, LOOKAHEAD_FILES), key=entry_size, reverse=True)
+        if not window:
+            return
+        yield from batch_files(window, STREAM_CHUNK_BYTES)
+
+
+def choose_executor(
+    entries: Iterable[Tuple[T, int]], config: SearchConfig
+) -> Tuple[Iterable[Tuple[T, int]], str, int]:
+    """`entries`, read ahead by is_small() when the config leaves the
+    executor open, with the executor and number of workers to search them
+    on."""
+    executor = config.executor
+    if executor is None:
+        entries, small = is_small(entries)
+        executor = EXECUTOR_SERIAL if small else default_executor()
+    jobs = 1 if executor == EXECUTOR_SERIAL else config.jobs or os.cpu_count() or 1
+    return entries, executor, jobs
+
+
+def search_files(
+    entries: Iterable[Tuple[Task, int]],
+    config: SearchConfig,
+    ordered: bool = False,
+    stats: Optional[SearchStats] = None,
+) -> Iterator[Outcome]:
+    """Match files as they arrive. A list is batched by its total size; any
+    other iterable, e.g. a running walk, is batched at STREAM_CHUNK_BYTES
+    and fed to the workers while it is still being produced. Given `stats`,
+    the workers' timings and counters are merged into it."""
+    # fail here rather than in every worker's initializer
+    MatchPatterns.create(config.pattern)
+
+    entries, executor, jobs = choose_executor(entries, config)
+
+    # a pool is handed the largest files first and the small ones fill in
+    # behind them, so no worker is still parsing a big file once the others
+    # are done; results in order need them in order, so --sort keeps it
+    spread = executor != EXECUTOR_SERIAL and not ordered
+
+    if isinstance(entries, list):
+        if spread:
+            entries = sorted(entries, key=entry_size, reverse=True)
+        workers = min(jobs, len(entries))
+        batches: Iterable[List[Task]] = list(
+            batch_files(entries, batch_target(entries, workers))
+        )
+    elif spread:
+        batches = largest_first(entries)
+    else:
+        batches = batch_files(entries, STREAM_CHUNK_BYTES)
+
+    init = (init_worker, (config,), jobs, executor, MAX_TASKS_PER_WORKER)
+
+    if stats is None:
+        for batch in iter_tasks(proc_batch, batches, ordered, *init):
+            yield from batch
+        return
+
+    stats.workers = jobs
+    done = iter_tasks(proc_batch_stats, batches, ordered, *init)
+    for batch in merge_stats(done, stats):
+        yield from batch
+
+
+def merge_stats(
+    done: Iterable[Tuple[List[Outcome], SearchStats]],
+    stats: SearchStats,
+) -> Iterator[List[Outcome]]:
+    """Batches of results from workers that also send back their stats,
+    which are merged into `stats`."""
+    for batch, batch_stats in stats.timed_iter("wait", done):
+        stats.merge(batch_stats)
+        yield batch
+
+
+def start_pool(
+    executor: str,
+    processes: int,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Tuple[Any, ...] = (),
+    max_tasks: Optional[int] = None,
+) -> "Pool":
+    """A process pool, or a thread pool with the same interface whose
+    workers hand results back by reference rather than pickling them.
+    Processes are replaced after `max_tasks` tasks; threads share memory,
+    so replacing them frees nothing."""
+    # imported only once a pool is needed, it's a large part of startup
+    if executor == EXECUTOR_THREAD:
+        from multiprocessing.pool import ThreadPool
+
+        return ThreadPool(processes, initializer, initargs)
+
+    from multiprocessing import Pool
+
+    return Pool(processes, initializer, initargs, max_tasks)
+
+
+def relabel(
+    result: Outcome, label: str, relpath: str, count_by: Optional[str]
+) -> Outcome:
+    """A blob's `result` named `label:relpath`; counted by file or dir, its
+    key is labelled too, so each revision's top level keeps its own row."""
+    filename = f"{label}:{relpath}"
+    if isinstance(result, Result):
+        return Result(filename, result.matches, result.context, result.cells)
+    if isinstance(result, FileError):
+        return FileError(filename, result.message)
+    if result and isinstance(result, Counter) and count_by in (COUNT_FILE, COUNT_DIR):
+        key = f"{label}:{count_key(count_by, relpath)}"
+        return Counter({key: sum(result.values())})
+    return result
+
+
+def search_revs(
+    filepath: str,
+    revs: List[Tuple[str, str]],
+    config: SearchConfig,
+    discovery: Optional[Discovery] = None,
+    stats: Optional[SearchStats] = None,
+) -> Iterator[Outcome]:
+    """Match the files under `filepath` as of each of `revs`, (label,
+    commit) pairs, read from git's object store instead of the working
+    tree. Results are named `label:path` and come revision by revision.
+
+    A blob is matched once however many revisions contain it, and its
+    result repeated for the others, so each revision after the first
+    costs only the files it changed. Blobs aren't parse-cached on disk;
+    the cache is keyed by working-tree paths."""
+    # imported here, like every use of git, to keep subprocess off startup
+    from src import git
+
+    top = git.toplevel(filepath)
+    if not top:
+        raise git.SgrepGitError(f"Not in a git repository: '{filepath}'")
+    prefix = path.relpath(path.realpath(filepath), top).replace(os.sep, "/")
+    prefix = "" if prefix == "." else prefix
+
+    discovery = discovery or Discovery()
+    keep = path_filter(discovery)
+    skip = len(prefix) + 1 if prefix else 0
+
+    # a blob's key; the same content is parsed differently as a notebook
+    Key = Tuple[str, bool]
+
+    with git.CatFile(top) as catfile:
+        walker = git.TreeWalker(catfile)
+
+        # per revision, its label, its files and how many blobs must be
+        # matched first
+        listings: List[Tuple[str, List[Tuple[str, Key]], int]] = []
+        pending: List[Tuple[Key, str]] = []
+        seen: Set[Key] = set()
+
+        for label, commit in revs:
+            listing = []
+            for relpath, sha in walker.blobs(commit, prefix):
+                if not keep(relpath[skip:] or path.basename(relpath)):
+                    continue
+                key = (sha, is_notebook(relpath))
+                if key not in seen:
+                    seen.add(key)
+                    pending.append((key, relpath))
+                listing.append((relpath, key))
+            listings.append((label, listing, len(pending)))
+
+        def read_blobs() -> Iterator[Tuple[Source, int]]:
+            for (sha, _), relpath in pending:
+                obj = catfile.read(sha)
+                if obj is None:
+                    yield FileError(relpath, f"Missing git object {sha}"), 0
+                    continue
+                src = obj[2]
+                too_large = discovery.is_too_large(len(src))
+                yield (relpath, None if too_large else src), len(src)
+
+        # a few small blobs run in-process, as in search_files
+        blobs, executor, jobs = choose_executor(read_blobs(), config)
+        batches = batch_files(blobs, STREAM_CHUNK_BYTES)
+        init = (init_worker, (config,), jobs, executor, MAX_TASKS_PER_WORKER)
+        # in order, so results line up with `pending`
+        if stats is None:
+            done = iter_tasks(proc_sources, batches, True, *init)
+        else:
+            stats.workers = jobs
+            tasks = iter_tasks(proc_sources_stats, batches, True, *init)
+            done = merge_stats(tasks, stats)
+
+        results: Dict[Key, Outcome] = {}
+        keys = iter(pending)
+        matched = 0
+
+        try:
+            for label, listing, needed in listings:
+                while matched < needed:
+                    for result in next(done):
+                        key, _ = next(keys)
+                        results[key] = result
+                        matched += 1
+                # counted, a revision comes back as one table, not one per blob
+                counts: "Counter[str]" = Counter()
+                for relpath, key in listing:
+                    result = relabel(results[key], label, relpath, config.count_by)
+                    if isinstance(result, Counter):
+                        counts.update(result)
+                    else:
+                        yield result
+                if counts:
+                    yield counts
+        finally:
+            # stop the workers before the blob stream they read from
+            done.close()
+
+
+def run_tasks(
+    func: Callable[[Any], Any], tasks: List[Any], executor: Optional[str] = None
+) -> List[Any]:
+    executor = executor or default_executor()
+    processes = min(os.cpu_count() or 1, len(tasks))
+
+    if processes <= 1 or executor == EXECUTOR_SERIAL:
+        return [func(x) for x in tasks]
+
+    with start_pool(executor, processes, max_tasks=MAX_TASKS_PER_WORKER) as pool:
+        return pool.map(func, tasks)
+
+
+def iter_tasks(
+    func: Callable[[Any], Any],
+    tasks: Iterable[Any],
+    ordered: bool = False,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Tuple[Any, ...] = (),
+    processes: Optional[int] = None,
+    executor: str = EXECUTOR_PROCESS,
+    max_tasks: Optional[int] = None,
+) -> Iterator[Any]:
+    """Yield results as workers finish them, in task order if `ordered`.
+    Closing the iterator early tears the pool down with pending work."""
+    processes = processes or os.cpu_count() or 1
+    if isinstance(tasks, Sized):
+        processes = min(processes, len(tasks))
+
+    if processes <= 1 or executor == EXECUTOR_SERIAL:
+        if initializer:
+            initializer(*initargs)
+        yield from map(func, tasks)
+        return
+
+    with start_pool(executor, processes, initializer, initargs, max_tasks) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(func, tasks)
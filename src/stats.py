@@ -0,0 +1,163 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, ContextManager, Dict, Final, Iterable, Iterator, List
+from typing import Tuple, TypeVar
+
+SLOWEST_FILES: Final = 10
+
+# in the order they happen to a file
+WORKER_PHASES: Final = ("read", "parse", "match", "render")
+PARENT_PHASES: Final = ("discover", "index", "wait", "output")
+
+T = TypeVar("T")
+
+# a streamed walk is timed on the pool's feeder thread while the main thread
+# times its own phases into the same stats; one lock for all, since a lock
+# can't be pickled with the stats a worker sends back
+_phases_lock = threading.Lock()
+
+
+@dataclass
+class PhaseTime:
+    wall: float = 0.0
+    cpu: float = 0.0
+
+
+@dataclass
+class SearchStats:
+    """Counters and per-phase wall/CPU times for one search. Workers fill
+    their own and send them back with each batch, where they're merged into
+    the parent's."""
+
+    phases: Dict[str, PhaseTime] = field(default_factory=dict)
+    files: int = 0
+    bytes: int = 0
+    skipped: int = 0
+    errors: int = 0
+    # files skipped for going over their time or memory budget
+    over_budget: int = 0
+    matches: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # summed wall time workers spent on batches, for utilization
+    busy: float = 0.0
+    # processes or threads the search actually ran on
+    workers: int = 1
+    # min-heap of (seconds, filename), so the fastest is dropped first
+    slowest: List[Tuple[float, str]] = field(default_factory=list)
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        wall = time.perf_counter()
+        # per thread, so a thread pool's workers aren't charged each other's
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall_spent = time.perf_counter() - wall
+            cpu_spent = time.thread_time() - cpu
+            with _phases_lock:
+                spent = self.phases.setdefault(phase, PhaseTime())
+                spent.wall += wall_spent
+                spent.cpu += cpu_spent
+
+    def timed_iter(self, phase: str, items: Iterable[T]) -> Iterator[T]:
+        """Yield from `items`, charging the time spent producing each item
+        to `phase`."""
+        it = iter(items)
+        while True:
+            with self.timed(phase):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_parse(self, filename: str, seconds: float) -> None:
+        entry = (seconds, filename)
+        if len(self.slowest) < SLOWEST_FILES:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other: "SearchStats") -> None:
+        with _phases_lock:
+            for phase, spent in other.phases.items():
+                mine = self.phases.setdefault(phase, PhaseTime())
+                mine.wall += spent.wall
+                mine.cpu += spent.cpu
+
+        self.files += other.files
+        self.bytes += other.bytes
+        self.skipped += other.skipped
+        self.errors += other.errors
+        self.over_budget += other.over_budget
+        self.matches += other.matches
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.busy += other.busy
+
+        for seconds, filename in other.slowest:
+            self.add_parse(filename, seconds)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        phases = [x for x in (*PARENT_PHASES, *WORKER_PHASES) if x in self.phases]
+        workers = self.workers
+
+        return {
+            "elapsed": elapsed,
+            "workers": workers,
+            "files": self.files,
+            "bytes": self.bytes,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "over_budget": self.over_budget,
+            "matches": self.matches,
+            "files_per_sec": self.files / elapsed if elapsed else 0.0,
+            "bytes_per_sec": self.bytes / elapsed if elapsed else 0.0,
+            "utilization": self.busy / (elapsed * workers) if elapsed else 0.0,
+            "cache_hit_rate": self.cache_hits / lookups if lookups else None,
+            "phases": {
+                x: {"wall": self.phases[x].wall, "cpu": self.phases[x].cpu}
+                for x in phases
+            },
+            "slowest": [
+                {"filename": filename, "parse": seconds}
+                for seconds, filename in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+def no_timer(phase: str) -> ContextManager[None]:
+    return nullcontext()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"{report['files']} files, {report['bytes']} bytes, "
+        f"{report['matches']} matches in {report['elapsed']:.3f}s",
+        f"{report['files_per_sec']:.0f} files/s, "
+        f"{report['bytes_per_sec'] / 1024 / 1024:.2f} MiB/s",
+        f"{report['skipped']} files skipped by the pre-scan, "
+        f"{report['errors']} unreadable, {report['over_budget']} over budget",
+        f"{report['workers']} workers, {report['utilization']:.0%} busy",
+    ]
+
+    if report["cache_hit_rate"] is not None:
+        lines.append(f"cache hit rate {report['cache_hit_rate']:.0%}")
+
+    # worker phases add up across workers, so they can exceed the elapsed time
+    lines.append(f"{'phase':10} {'wall':>10} {'cpu':>10}")
+    for phase, spent in report["phases"].items():
+        lines.append(f"{phase:10} {spent['wall']:9.3f}s {spent['cpu']:9.3f}s")
+
+    if report["slowest"]:
+        lines.append("slowest to parse:")
+        for x in report["slowest"]:
+            lines.append(f"{x['parse']:9.3f}s {x['filename']}")
+
+    return "\n".join(lines)
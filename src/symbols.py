@@ -0,0 +1,368 @@
+import ast
+import builtins
+from functools import lru_cache
+from os import path
+from typing import Dict, Final, Iterable, Iterator, List, Optional, Set, Tuple
+
+INIT_FILE: Final = "__init__.py"
+# a bound on how many names one qualified name expands to
+MAX_ALIASES: Final = 256
+BUILTINS: Final = frozenset(dir(builtins))
+
+FUNCTIONS: Final = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)
+DEFINITIONS: Final = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+# where statements nest at module level without opening a new scope
+BLOCK_FIELDS: Final = ("body", "orelse", "handlers", "finalbody", "cases")
+
+# a function's local names to the qualified name each is bound to, None
+# where the value isn't known
+Scope = Dict[str, Optional[str]]
+# a module's name and the names it binds to imported objects
+Exports = Tuple[str, Dict[str, str]]
+
+
+@lru_cache(maxsize=None)
+def package_of(dirname: str) -> str:
+    """Dotted package a directory is imported as, '' outside a package."""
+    if not path.isfile(path.join(dirname, INIT_FILE)):
+        return ""
+
+    parent = path.dirname(dirname)
+    outer = package_of(parent) if parent != dirname else ""
+    name = path.basename(dirname)
+    return f"{outer}.{name}" if outer else name
+
+
+def module_name(filepath: str) -> Tuple[str, str]:
+    """(module, package) a file is imported as, from the __init__.py files
+    above it."""
+    filename = path.abspath(filepath)
+    package = package_of(path.dirname(filename))
+    stem = path.splitext(path.basename(filename))[0]
+
+    if stem == "__init__" and package:
+        return package, package
+    return (f"{package}.{stem}" if package else stem), package
+
+
+def imported(node: ast.AST, package: str) -> List[Tuple[str, str]]:
+    """(local name, qualified name) of each binding an import makes."""
+    if isinstance(node, ast.Import):
+        return [
+            (x.asname, x.name) if x.asname else (x.name.split(".")[0],) * 2
+            for x in node.names
+        ]
+
+    assert isinstance(node, ast.ImportFrom)
+    base = node.module or ""
+    if node.level:
+        parts = package.split(".") if package else []
+        parts = parts[: max(len(parts) - node.level + 1, 0)]
+        base = ".".join([*parts, node.module] if node.module else parts)
+
+    return [
+        (x.asname or x.name, f"{base}.{x.name}" if base else x.name)
+        for x in node.names
+        if x.name != "*"
+    ]
+
+
+def stored_names(target: ast.AST) -> List[str]:
+    return [
+        x.id
+        for x in ast.walk(target)
+        if isinstance(x, ast.Name) and isinstance(x.ctx, ast.Store)
+    ]
+
+
+_fields: Dict[type, Tuple[str, ...]] = {}
+
+
+def children(node: ast.AST) -> List[ast.AST]:
+    """A node's children in source order, expression contexts left out."""
+    cls = type(node)
+    fields = _fields.get(cls)
+    if fields is None:
+        fields = _fields[cls] = tuple(x for x in cls._fields if x != "ctx")
+
+    found = []
+    for field in fields:
+        value = getattr(node, field, None)
+        if type(value) is list:
+            found.extend(x for x in value if isinstance(x, ast.AST))
+        elif isinstance(value, ast.AST):
+            found.append(value)
+    return found
+
+
+def statements(body: List[ast.stmt]) -> Iterator[ast.AST]:
+    """The statements of a block and of the blocks nested in it, without
+    entering defs and classes."""
+    stack: List[ast.AST] = list(reversed(body))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, DEFINITIONS):
+            continue
+        for field in BLOCK_FIELDS:
+            value = getattr(node, field, None)
+            if type(value) is list:
+                stack.extend(reversed(value))
+
+
+def assigned(node: ast.AST) -> List[ast.AST]:
+    """Targets of an Assign or AnnAssign."""
+    if isinstance(node, ast.AnnAssign):
+        return [node.target]
+    return list(getattr(node, "targets", []))
+
+
+class ModuleSymbols:
+    """What the names in one module refer to, as qualified names: imports
+    and their aliases, top-level defs and classes, attributes bound through
+    `self`, and function locals assigned from any of those. `calls` holds
+    every call whose callee resolves.
+
+    Resolution is by name and flow-insensitive within a function. A call's
+    result is taken to be an instance of the callee, so
+    `requests.Session().get` resolves to `requests.Session.get`."""
+
+    def __init__(self, tree: ast.AST, module: str, package: str = "") -> None:
+        self.module = module
+        self.package = package
+        self.globals: Scope = {}
+        self.exports: Dict[str, str] = {}
+        # class to the bases it resolves to, and qualified attribute of a
+        # class or instance to what it is bound to
+        self.classes: Dict[str, List[str]] = {}
+        self.members: Scope = {}
+        self.calls: List[Tuple[str, ast.Call]] = []
+
+        classes: List[Tuple[ast.ClassDef, str]] = []
+        self.bind_module(getattr(tree, "body", []), classes)
+        for node, qualname in classes:
+            self.bind_class(node, qualname)
+        self.collect_calls(tree)
+
+    def bind_module(
+        self, body: List[ast.AST], classes: List[Tuple[ast.ClassDef, str]]
+    ) -> None:
+        for node in body:
+            if isinstance(node, ast.Import):
+                self.globals.update(imported(node, self.package))
+            elif isinstance(node, ast.ImportFrom):
+                # `from .mod import func` re-exports func, while a plain
+                # `import json` is rarely reached through the importer
+                for name, target in imported(node, self.package):
+                    self.globals[name] = self.exports[name] = target
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.globals[node.name] = f"{self.module}.{node.name}"
+            elif isinstance(node, ast.ClassDef):
+                self.globals[node.name] = qualname = f"{self.module}.{node.name}"
+                classes.append((node, qualname))
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value:
+                self.bind_global(node)
+            else:
+                for field in BLOCK_FIELDS:
+                    value = getattr(node, field, None)
+                    if isinstance(value, list):
+                        self.bind_module(value, classes)
+
+    def bind_global(self, node: ast.AST) -> None:
+        value = self.resolve(node.value, {})  # type: ignore[attr-defined]
+        for target in assigned(node):
+            for name in stored_names(target):
+                bound = value if isinstance(target, ast.Name) else None
+                self.globals[name] = bound or f"{self.module}.{name}"
+                # `fetch = requests.get` re-exports, `s = Session()` doesn't
+                if bound and not isinstance(node.value, ast.Call):  # type: ignore
+                    self.exports[name] = bound
+
+    def bind_class(self, node: ast.ClassDef, qualname: str) -> None:
+        bases = (self.resolve(x, {}) for x in node.bases)
+        self.classes[qualname] = [x for x in bases if x and x != "builtins.object"]
+
+        for item in node.body:
+            if isinstance(item, ast.ClassDef):
+                inner = self.members[f"{qualname}.{item.name}"] = (
+                    f"{qualname}.{item.name}"
+                )
+                self.bind_class(item, inner)
+            elif isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = f"{qualname}.{item.name}"
+                self.members[name] = name
+                self.bind_self(item, qualname)
+            elif isinstance(item, (ast.Assign, ast.AnnAssign)) and item.value:
+                value = self.resolve(item.value, {})
+                for target in assigned(item):
+                    for name in stored_names(target):
+                        self.members[f"{qualname}.{name}"] = value
+
+    def bind_self(self, node: ast.AST, qualname: str) -> None:
+        """Attributes a method assigns through its first parameter."""
+        scope = self.enter(node, None, qualname)
+        owner = next((k for k, v in scope.items() if v == qualname), None)
+        if owner is None:
+            return
+
+        for item in statements(getattr(node, "body")):
+            if not isinstance(item, (ast.Assign, ast.AnnAssign)) or not item.value:
+                continue
+            value = self.resolve(item.value, scope)
+            for target in assigned(item):
+                if (
+                    isinstance(target, ast.Attribute)
+                    and isinstance(target.value, ast.Name)
+                    and target.value.id == owner
+                ):
+                    name = f"{qualname}.{target.attr}"
+                    if self.members.get(name) is None:
+                        self.members[name] = value
+
+    def enter(
+        self, node: ast.AST, scope: Optional[Scope], owner: Optional[str]
+    ) -> Scope:
+        """The scope of a function's body, its parameters unknown except a
+        method's first, bound to its class."""
+        inner = dict(scope) if scope else {}
+        args = node.args  # type: ignore[attr-defined]
+        params = [*args.posonlyargs, *args.args]
+
+        for arg in [*params, *args.kwonlyargs, args.vararg, args.kwarg]:
+            if arg is not None:
+                inner[arg.arg] = None
+
+        static = any(
+            isinstance(x, ast.Name) and x.id == "staticmethod"
+            for x in getattr(node, "decorator_list", [])
+        )
+        if owner and params and not static:
+            inner[params[0].arg] = owner
+        return inner
+
+    def attribute(self, owner: str, attr: str) -> Optional[str]:
+        name = f"{owner}.{attr}"
+        if name in self.members:
+            return self.members[name]
+
+        # an inherited attribute is looked up along first bases only
+        bases = self.classes.get(owner)
+        if bases:
+            return self.attribute(bases[0], attr)
+        return name
+
+    def resolve(self, expr: ast.AST, scope: Optional[Scope]) -> Optional[str]:
+        """Qualified name of what `expr` refers to, None if unknown."""
+        if isinstance(expr, ast.Name):
+            if scope and expr.id in scope:
+                return scope[expr.id]
+            if expr.id in self.globals:
+                return self.globals[expr.id]
+            return f"builtins.{expr.id}" if expr.id in BUILTINS else None
+
+        if isinstance(expr, ast.Attribute):
+            owner = self.resolve(expr.value, scope)
+            return None if owner is None else self.attribute(owner, expr.attr)
+
+        if isinstance(expr, ast.Call):
+            return self.resolve(expr.func, scope)
+        return None
+
+    def collect_calls(self, tree: ast.AST) -> None:
+        # (node, scope, enclosing class, bind): scope is None at module
+        # level, whose names are all in globals, and `bind` marks an
+        # assignment whose value has been visited and targets can be bound
+        stack: List[Tuple[ast.AST, Optional[Scope], Optional[str], bool]] = [
+            (tree, None, None, False)
+        ]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node, scope, owner, bind = pop()
+            if bind:
+                value = self.resolve(node.value, scope)  # type: ignore[attr-defined]
+                for target in assigned(node):
+                    if isinstance(target, ast.Name):
+                        scope[target.id] = value  # type: ignore[index]
+                continue
+
+            cls = type(node)
+            if cls is ast.Call:
+                name = self.resolve(node.func, scope)  # type: ignore[attr-defined]
+                if name:
+                    self.calls.append((name, node))  # type: ignore[arg-type]
+            elif cls is ast.Name and scope is not None:
+                if isinstance(node.ctx, ast.Store):  # type: ignore[attr-defined]
+                    scope[node.id] = None  # type: ignore[attr-defined]
+            elif cls in (ast.Import, ast.ImportFrom) and scope is not None:
+                scope.update(imported(node, self.package))
+            elif cls in (ast.Assign, ast.AnnAssign) and scope is not None:
+                if node.value:  # type: ignore[attr-defined]
+                    push((node, scope, owner, True))
+
+            if cls in FUNCTIONS:
+                inner = self.enter(node, scope, owner)
+                body = getattr(node, "body")
+                body = body if isinstance(body, list) else [body]
+                for child in reversed(body):
+                    push((child, inner, None, False))
+                outer = [x for x in children(node) if x not in body]
+                for child in reversed(outer):
+                    push((child, scope, None, False))
+                continue
+
+            if cls is ast.ClassDef:
+                assert isinstance(node, ast.ClassDef)
+                qualname = f"{owner or self.module}.{node.name}"
+                for child in reversed(node.body):
+                    push((child, scope, qualname, False))
+                outer = [x for x in children(node) if x not in node.body]
+                for child in reversed(outer):
+                    push((child, scope, owner, False))
+                continue
+
+            for child in reversed(children(node)):
+                push((child, scope, None, False))
+
+
+def resolve_calls(tree: ast.AST, filepath: str) -> Dict[int, str]:
+    """Qualified callee of each call in a file's tree, keyed by node id."""
+    module, package = module_name(filepath)
+    symbols = ModuleSymbols(tree, module, package)
+    return {id(node): name for name, node in symbols.calls}
+
+
+class Resolver:
+    """Every file's module-level re-exports merged, so a qualified name can
+    be expanded to the other names that reach the same object, e.g.
+    `pkg.func` for `pkg.mod.func` when pkg/__init__.py imports it."""
+
+    def __init__(self, exports: Iterable[Exports]) -> None:
+        self.bound_to: Dict[str, Set[str]] = {}
+        for module, names in exports:
+            for name, target in names.items():
+                alias = f"{module}.{name}"
+                # `import email` inside email/ would alias email to
+                # email.email, and so on without end
+                if not alias.startswith(f"{target}."):
+                    self.bound_to.setdefault(target, set()).add(alias)
+
+    def aliases(self, name: str) -> List[str]:
+        found = {name}
+        todo = [name]
+
+        while todo and len(found) < MAX_ALIASES:
+            parts = todo.pop().split(".")
+            # `pkg.mod.func` is also reached through anything bound to
+            # `pkg.mod` or `pkg`
+            for i in range(len(parts), 0, -1):
+                rest = parts[i:]
+                for alias in self.bound_to.get(".".join(parts[:i]), ()):
+                    other = ".".join([alias, *rest])
+                    if other not in found:
+                        found.add(other)
+                        todo.append(other)
+
+        found.discard(name)
+        return sorted(found)
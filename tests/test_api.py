@@ -0,0 +1,103 @@
+import sys
+from pathlib import Path
+from typing import Any
+import pytest
+from src.api import compile_patterns, get_pool, search, shutdown
+from src.parse import SgrepParseError
+
+
+def write_tree(tmp_path: Path) -> None:
+    (tmp_path / "a.py").write_text("def connect(host):\n    return dial(host)\n")
+    (tmp_path / "b.py").write_text("class Pool:\n    def close(self):\n        pass\n")
+    (tmp_path / "broken.py").write_text("def (:\n")
+
+
+def test_search_yields_typed_matches(tmp_path: Path) -> None:
+    write_tree(tmp_path)
+    errors = []
+
+    found = search(
+        ["def", "call $dial"], str(tmp_path), jobs=1, on_error=errors.append
+    )
+    matches = sorted((Path(x.filename).name, x.lineno, x.pattern) for x in found)
+
+    assert matches == [
+        ("a.py", 1, "def"),
+        ("a.py", 2, "call $dial"),
+        ("b.py", 2, "def"),
+    ]
+    assert [Path(x.filename).name for x in errors] == ["broken.py"]
+
+
+def test_search_shares_pool(tmp_path: Path) -> None:
+    write_tree(tmp_path)
+
+    try:
+        # small enough to run serially unless an executor is named
+        first = list(search("def $close", str(tmp_path), jobs=2, executor="process"))
+        second = list(
+            search("class", [str(tmp_path / "b.py")], jobs=2, executor="thread")
+        )
+    finally:
+        shutdown()
+
+    assert [(x.kind, x.snippet) for x in first] == [
+        ("FunctionDef", "    def close(self):")
+    ]
+    assert [x.snippet for x in second] == ["class Pool:"]
+
+
+def test_compiled_patterns_are_cached() -> None:
+    assert compile_patterns(("def",)) is compile_patterns(("def",))
+
+
+def test_invalid_pattern_raises_eagerly(tmp_path: Path) -> None:
+    with pytest.raises(SgrepParseError):
+        search("def $", str(tmp_path))
+
+
+def test_threads_match_like_serial(tmp_path: Path) -> None:
+    # several batches' worth, so the workers have one each
+    for i in range(100):
+        calls = "requests.get(url)\n" * 300
+        (tmp_path / f"mod{i}.py").write_text(f"import requests\n{calls}")
+
+    def count(**kwargs: Any) -> int:
+        return len(list(search("call $requests.get", str(tmp_path), **kwargs)))
+
+    interval = sys.getswitchinterval()
+    # switch threads often, so two workers are inside a file at once
+    sys.setswitchinterval(1e-4)
+    try:
+        threaded = count(executor="thread", jobs=4)
+    finally:
+        sys.setswitchinterval(interval)
+        shutdown()
+
+    assert threaded == count(executor="serial") == 30000
+
+
+def test_qualified_call_through_reexport(tmp_path: Path) -> None:
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("from pkg.mod import func\n")
+    (tmp_path / "pkg" / "mod.py").write_text("def func():\n    pass\n")
+    (tmp_path / "app.py").write_text(
+        "import pkg\nimport pkg.mod\nfrom pkg import func\n"
+        "pkg.func()\nfunc()\npkg.mod.func()\n"
+    )
+
+    found = search("call $pkg.mod.func", str(tmp_path), executor="serial")
+
+    # the first two only reach pkg.mod.func through pkg/__init__.py
+    assert [x.lineno for x in found] == [4, 5, 6]
+
+
+def test_other_jobs_keep_pool() -> None:
+    try:
+        first = get_pool("thread", 2)
+        # a search asking for more workers starts a pool beside the first,
+        # which an earlier search's iterator may still be draining
+        assert get_pool("thread", 3) is not first
+        assert get_pool("thread", 2) is first
+    finally:
+        shutdown()
@@ -0,0 +1,71 @@
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Optional
+from src.archive import expand_archives, is_member
+from src.cache import ParseCache
+from src.discover import Discovery, walk_files
+from src.search import FileError, SearchConfig, search_files
+from src.stats import SearchStats
+from tests.utils import parse
+
+SRC = "import json\n\ndef load(b):\n    return json.loads(b)\n"
+
+
+def write_archives(tmp_path: Path) -> None:
+    with zipfile.ZipFile(tmp_path / "pkg-1.0-py3-none-any.whl", "w") as zf:
+        zf.writestr("pkg/__init__.py", "")
+        zf.writestr("pkg/io.py", SRC)
+        zf.writestr("pkg-1.0.dist-info/METADATA", "loads(x)\n")
+
+    module = tmp_path / "io.py"
+    module.write_text(SRC)
+    with tarfile.open(tmp_path / "pkg-1.0.tar.gz", "w:gz") as tf:
+        tf.add(module, "pkg-1.0/pkg/io.py")
+    module.unlink()
+
+    (tmp_path / "broken.zip").write_bytes(b"not a zip")
+
+
+def search(
+    tmp_path: Path, config: SearchConfig, stats: Optional[SearchStats] = None
+) -> list:
+    discovery = Discovery(search_zip=True)
+    walked = sorted(walk_files(str(tmp_path), discovery))
+    entries = expand_archives(walked, discovery, 1024)
+    return list(search_files(entries, config, ordered=True, stats=stats))
+
+
+def test_is_member() -> None:
+    assert is_member("dist/pkg.whl!pkg/io.py")
+    assert is_member("a!b/pkg.tar.gz!pkg/io.py")
+    assert not is_member("notes!.py")
+
+
+def test_search_members(tmp_path: Path) -> None:
+    write_archives(tmp_path)
+
+    results = search(tmp_path, SearchConfig(parse("call $loads")))
+
+    assert [x.filename for x in results] == [  # type: ignore[union-attr]
+        str(tmp_path / "broken.zip"),
+        str(tmp_path / "pkg-1.0-py3-none-any.whl!pkg/__init__.py"),
+        str(tmp_path / "pkg-1.0-py3-none-any.whl!pkg/io.py"),
+        str(tmp_path / "pkg-1.0.tar.gz!pkg-1.0/pkg/io.py"),
+    ]
+    assert isinstance(results[0], FileError)
+    assert [x.lineno for x in results[2].matches] == [4]  # type: ignore
+
+
+def test_members_cached_by_content(tmp_path: Path) -> None:
+    write_archives(tmp_path)
+    cache = ParseCache(str(tmp_path / "cache"))
+    config = SearchConfig(parse("def"), cache, executor="serial")
+
+    first, second = SearchStats(), SearchStats()
+    search(tmp_path, config, first)
+    search(tmp_path, config, second)
+
+    # the same module in the wheel and the tarball is only parsed once
+    assert (first.cache_hits, first.cache_misses) == (1, 1)
+    assert (second.cache_hits, second.cache_misses) == (2, 0)
@@ -0,0 +1,27 @@
+import ast
+from pathlib import Path
+from benchmarks.corpus import CorpusSpec, generate
+from benchmarks.run import compare
+
+
+def test_corpus_is_deterministic(tmp_path: Path) -> None:
+    spec = CorpusSpec("test", 120, 40, depth=6)
+    first = generate(spec, str(tmp_path / "first"))
+    second = generate(spec, str(tmp_path / "second"))
+
+    assert len(first) == 120
+    for x, y in zip(first, second):
+        source = Path(x).read_bytes()
+        assert source == Path(y).read_bytes()
+        ast.parse(source)
+
+
+def test_compare_flags_regressions() -> None:
+    baseline = {"parse": {"min": 1.0}, "match": {"min": 1.0}}
+    timings = {
+        "parse": {"min": 1.05},
+        "match": {"min": 1.5},
+        "render": {"min": 9.0},
+    }
+
+    assert compare(timings, baseline, 0.1) == [("match", 1.0, 1.5)]
@@ -0,0 +1,81 @@
+import ast
+import os
+import pickle
+from pathlib import Path
+import pytest
+from src.cache import ParseCache
+
+
+def write_src(tmp_path: Path, src: str) -> str:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text(src)
+    return str(filepath)
+
+
+def test_cache_hit_skips_parse(tmp_path: Path) -> None:
+    cache = ParseCache(str(tmp_path / "cache"))
+    filepath = write_src(tmp_path, "def some():\n    pass\n")
+
+    first = cache.parse(filepath)
+    assert os.path.exists(cache.entry_path(filepath))
+
+    second = cache.parse(filepath)
+    assert ast.dump(first) == ast.dump(second)
+
+
+def test_cache_invalidated_on_change(tmp_path: Path) -> None:
+    cache = ParseCache(str(tmp_path / "cache"))
+    filepath = write_src(tmp_path, "def some():\n    pass\n")
+    cache.parse(filepath)
+
+    write_src(tmp_path, "class Other:\n    pass\n")
+    tree = cache.parse(filepath)
+
+    assert isinstance(tree.body[0], ast.ClassDef)
+
+
+def test_cache_evicts_least_recent(tmp_path: Path) -> None:
+    cache = ParseCache(str(tmp_path / "cache"))
+    files = []
+    for i, name in enumerate(["a", "b", "c"]):
+        filepath = tmp_path / f"{name}.py"
+        filepath.write_text(f"{name} = {i}\n")
+        cache.parse(str(filepath))
+        # accessed in the order a, b, c
+        os.utime(cache.entry_path(str(filepath)), (100 + i, 100 + i))
+        files.append(str(filepath))
+
+    # a hit makes a the most recently used, leaving b the least
+    cache.parse(files[0])
+    assert cache.hits == 1
+
+    cache.max_bytes = sum(size for _, size, _ in cache.entries()) - 1
+    assert cache.evict() == 1
+
+    left = {entry for _, _, entry in cache.entries()}
+    assert left == {cache.entry_path(files[0]), cache.entry_path(files[2])}
+
+
+def test_cache_clear(tmp_path: Path) -> None:
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.parse(write_src(tmp_path, "x = 1\n"))
+    cache.clear()
+
+    assert cache.entries() == []
+
+
+def test_cache_store_interrupted(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = ParseCache(str(tmp_path / "cache"))
+    filepath = write_src(tmp_path, "x = 1\n")
+
+    def interrupt(*args: object) -> None:
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pickle, "dump", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        cache.parse(filepath)
+
+    entry_dir = os.path.dirname(cache.entry_path(filepath))
+    assert os.listdir(entry_dir) == []
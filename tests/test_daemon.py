@@ -0,0 +1,97 @@
+import threading
+import time
+from pathlib import Path
+import pytest
+from src.cache import CACHE_DIR
+from src.daemon import DaemonServer, TreeStore, query
+from src.main import SOCKET_FILE, find_socket
+
+
+def write_tree(tmp_path: Path) -> None:
+    (tmp_path / "a.py").write_text("def connect(host):\n    pass\n")
+    (tmp_path / "b.py").write_text("def close():\n    connect(1)\n")
+
+
+def request(tmp_path: Path, pattern: str, count: bool) -> dict:
+    return {
+        "patterns": [pattern],
+        "filepath": ".",
+        "cwd": str(tmp_path),
+        "count": count,
+        "limit": None,
+        "files_with_matches": False,
+        "sort": True,
+        "before": 0,
+        "after": 0,
+        "full": False,
+    }
+
+
+def test_store_reparses_changed_files(tmp_path: Path) -> None:
+    write_tree(tmp_path)
+    store = TreeStore(None)
+
+    assert list(store.search(request(tmp_path, "def", True))) == ["2"]
+
+    (tmp_path / "b.py").write_text("x = 1\n")
+    assert list(store.search(request(tmp_path, "def", True))) == ["1"]
+
+    (tmp_path / "a.py").unlink()
+    assert list(store.search(request(tmp_path, "def", True))) == ["0"]
+    assert len(store.trees) == 1
+
+
+def test_query_over_socket(tmp_path: Path) -> None:
+    write_tree(tmp_path)
+    sockpath = str(tmp_path / "daemon.sock")
+
+    with DaemonServer(sockpath, TreeStore(None)) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        replies = query(sockpath, request(tmp_path, "call $connect", True))
+        assert replies is not None
+        assert list(replies) == ["1"]
+
+        server.shutdown()
+
+
+def test_query_without_daemon(tmp_path: Path) -> None:
+    assert query(str(tmp_path / "daemon.sock"), {}) is None
+
+
+def test_store_expires_queried_roots(tmp_path: Path) -> None:
+    served, other = tmp_path / "served", tmp_path / "other"
+    for root in (served, other):
+        root.mkdir()
+        write_tree(root)
+    store = TreeStore(None, ttl=0.0)
+    store.track(str(served), served=True)
+    store.refresh(str(served))
+
+    list(store.search(request(served / "a.py", "def", True)))
+    list(store.search(request(other, "def", True)))
+    # a.py is under the served root, so only `other` was added
+    assert list(store.roots) == [str(served), str(other)]
+
+    time.sleep(0.01)
+    store.expire()
+
+    assert list(store.roots) == [str(served)]
+    assert sorted(store.trees) == [str(served / "a.py"), str(served / "b.py")]
+
+
+def test_find_socket_from_subdirectory(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    sub = tmp_path / "pkg" / "sub"
+    sub.mkdir(parents=True)
+    sockpath = tmp_path / CACHE_DIR / SOCKET_FILE
+    sockpath.parent.mkdir()
+    sockpath.touch()
+
+    monkeypatch.setattr("src.main.CURR_DIR", str(sub))
+    assert find_socket() == str(sockpath)
+
+    sockpath.unlink()
+    assert find_socket() is None
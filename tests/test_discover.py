@@ -0,0 +1,70 @@
+from pathlib import Path
+from src.discover import Discovery, parse_rule, path_filter, walk_files
+
+
+def make_tree(tmp_path: Path, files: list[str]) -> None:
+    for name in files:
+        filepath = tmp_path / name
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_text("x = 1\n")
+
+
+def found(tmp_path: Path, discovery: Discovery = Discovery()) -> list[str]:
+    root = str(tmp_path)
+    return sorted(x[len(root) + 1 :] for x, _ in walk_files(root, discovery))
+
+
+def test_rule_unanchored() -> None:
+    rule = parse_rule("*.pyc")
+    assert rule and rule.matches("a/b/c.pyc", False)
+
+
+def test_rule_anchored() -> None:
+    rule = parse_rule("/build")
+    assert rule and rule.matches("build", True)
+    assert not rule.matches("src/build", True)
+
+
+def test_rule_double_star() -> None:
+    rule = parse_rule("docs/**/gen_*.py")
+    assert rule and rule.matches("docs/a/b/gen_x.py", False)
+    assert rule.matches("docs/gen_x.py", False)
+
+
+def test_walk_prunes_default_dirs(tmp_path: Path) -> None:
+    make_tree(tmp_path, ["a.py", "node_modules/b.py", "__pycache__/c.py", "d.txt"])
+
+    assert found(tmp_path) == ["a.py"]
+
+
+def test_walk_honors_gitignore(tmp_path: Path) -> None:
+    make_tree(tmp_path, ["a.py", "build/b.py", "gen_c.py", "keep/gen_d.py"])
+    (tmp_path / ".gitignore").write_text("build/\ngen_*.py\n")
+    (tmp_path / "keep" / ".ignore").write_text("!gen_d.py\n")
+
+    assert found(tmp_path) == ["a.py", "keep/gen_d.py"]
+    assert len(found(tmp_path, Discovery(use_ignore_files=False))) == 4
+
+
+def test_walk_glob_and_exclude(tmp_path: Path) -> None:
+    make_tree(tmp_path, ["a.py", "b.pyi", "tests/c.py"])
+
+    assert found(tmp_path, Discovery(globs=["*.py"])) == ["a.py", "tests/c.py"]
+    assert found(tmp_path, Discovery(excludes=["tests"])) == ["a.py", "b.pyi"]
+
+
+def test_walk_max_filesize(tmp_path: Path) -> None:
+    make_tree(tmp_path, ["a.py", "gen.py"])
+    (tmp_path / "gen.py").write_text("x = 1\n" * 100)
+
+    assert found(tmp_path, Discovery(max_filesize=100)) == ["a.py"]
+
+
+def test_path_filter_matches_walk_suffixes(tmp_path: Path) -> None:
+    (tmp_path / "FOO.PY").write_text("x = 1\n")
+    (tmp_path / "notes.txt").write_text("x\n")
+    keep = path_filter()
+
+    assert [Path(x).name for x, _ in walk_files(str(tmp_path))] == ["FOO.PY"]
+    assert keep("FOO.PY") and keep("pkg/mod.Py")
+    assert not keep("notes.txt")
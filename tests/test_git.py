@@ -0,0 +1,117 @@
+import subprocess
+from pathlib import Path
+import pytest
+from src.git import CatFile, SgrepGitError, TreeWalker, resolve_revs
+from src.search import SearchConfig, search_revs
+from src.stats import SearchStats
+from tests.utils import parse
+
+
+def commit(repo: Path, files: dict[str, str], tag: str) -> None:
+    for name, text in files.items():
+        (repo / name).parent.mkdir(parents=True, exist_ok=True)
+        (repo / name).write_text(text)
+
+    def git(*args: str) -> None:
+        subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+    git("add", ".")
+    git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-m", tag)
+    git("tag", tag)
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    commit(tmp_path, {"pkg/io.py": "def load(b):\n    return loads(b)\n"}, "v1")
+    commit(tmp_path, {"pkg/other.py": "x = loads(1)\n", "README": "hi\n"}, "v2")
+    commit(tmp_path, {"pkg/other.py": "x = 2\n"}, "v3")
+    return tmp_path
+
+
+def test_resolve_revs(repo: Path) -> None:
+    assert [x for x, _ in resolve_revs(str(repo), ["v3"])] == ["v3"]
+    assert len(resolve_revs(str(repo), ["v1..v3"])) == 2
+
+    with pytest.raises(SgrepGitError):
+        resolve_revs(str(repo), ["v9"])
+
+
+def test_tree_walker(repo: Path) -> None:
+    with CatFile(str(repo)) as catfile:
+        walker = TreeWalker(catfile)
+
+        assert [x for x, _ in walker.blobs("v2")] == [
+            "README",
+            "pkg/io.py",
+            "pkg/other.py",
+        ]
+        assert [x for x, _ in walker.blobs("v3", "pkg/io.py")] == ["pkg/io.py"]
+
+
+def test_search_revs_matches_blobs_once(repo: Path) -> None:
+    revs = resolve_revs(str(repo), ["v1", "v2", "v3"])
+    config = SearchConfig(parse("call $loads"), executor="serial")
+    stats = SearchStats()
+
+    results = list(search_revs(str(repo), revs, config, stats=stats))
+
+    assert [(x.filename, len(x.matches)) for x in results] == [  # type: ignore
+        ("v1:pkg/io.py", 1),
+        ("v2:pkg/io.py", 1),
+        ("v2:pkg/other.py", 1),
+        ("v3:pkg/io.py", 1),
+        ("v3:pkg/other.py", 0),
+    ]
+    # pkg/io.py is unchanged across the three tags
+    assert stats.files == 3
+
+
+def test_search_revs_count_by_file(repo: Path) -> None:
+    revs = resolve_revs(str(repo), ["v2", "v3"])
+    config = SearchConfig(parse("call $loads"), executor="serial", count_by="file")
+
+    counts = [x for x in search_revs(str(repo), revs, config) if x]
+
+    # one table per revision
+    assert counts == [{"v2:pkg/io.py": 1, "v2:pkg/other.py": 1}, {"v3:pkg/io.py": 1}]
+
+
+def test_search_revs_count_by_dir(repo: Path) -> None:
+    commit(repo, {"top.py": "def f():\n    pass\n"}, "v4")
+    commit(repo, {"top.py": "def f():\n    pass\ndef g():\n    pass\n"}, "v5")
+    revs = resolve_revs(str(repo), ["v4", "v5"])
+    config = SearchConfig(parse("def"), executor="serial", count_by="dir")
+
+    counts = [x for x in search_revs(str(repo), revs, config) if x]
+
+    # the top level is a row per revision, like any other directory
+    assert counts == [{"v4:.": 1, "v4:pkg": 1}, {"v5:.": 2, "v5:pkg": 1}]
+
+
+def test_search_revs_missing_blob(repo: Path) -> None:
+    sha = subprocess.run(
+        ["git", "rev-parse", "v3:pkg/other.py"], cwd=repo, capture_output=True
+    ).stdout.decode().strip()
+    (repo / ".git" / "objects" / sha[:2] / sha[2:]).unlink()
+    revs = resolve_revs(str(repo), ["v3"])
+    config = SearchConfig(parse("call $loads"), executor="serial")
+
+    results = list(search_revs(str(repo), revs, config))
+
+    assert [type(x).__name__ for x in results] == ["Result", "FileError"]
+    assert results[1].filename == "v3:pkg/other.py"
+
+
+def test_search_revs_small_in_process(
+    repo: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def no_pool() -> str:
+        raise AssertionError("started a pool")
+
+    monkeypatch.setattr("src.search.default_executor", no_pool)
+    revs = resolve_revs(str(repo), ["v2"])
+
+    results = list(search_revs(str(repo), revs, SearchConfig(parse("call $loads"))))
+
+    assert len(results) == 2
@@ -0,0 +1,198 @@
+import ast
+import os
+import subprocess
+import sys
+from pathlib import Path
+from src.cache import CACHE_DIR
+from src.index import INDEX_FILE, StructuralIndex, SymbolCollector, index_file
+from src.match import MatchPatterns
+from src.search import parse_patterns
+from tests.utils import parse
+
+SRC = '''
+class Pool:
+    def close(self, timeout):
+        self.flush(timeout)
+
+def connect(host, port):
+    return open_socket(host, port)
+
+def reconnect():
+    connect(HOST, PORT)
+'''
+
+
+def sgrep(cwd: Path, *args: str) -> str:
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])}
+    cmd = [sys.executable, "-m", "src.main", *args]
+    return subprocess.run(cmd, cwd=cwd, env=env, capture_output=True).stdout.decode()
+
+
+def build_index(src: str) -> StructuralIndex:
+    collector = SymbolCollector("mod.py")
+    collector.visit(ast.parse(src))
+
+    index = StructuralIndex(".")
+    index.add_file("mod.py", (0, 0), collector.entries)
+    return index
+
+
+def assert_index_match(cmd: str, src: str) -> None:
+    node = parse(cmd)
+    visitor = MatchPatterns.create(node)
+    visitor.visit(ast.parse(src))
+
+    hits = build_index(src).query(node)
+    found = sorted((x.lineno, x.col_offset) for x in hits.get("mod.py", []))
+
+    assert found == sorted((x.lineno, x.col_offset) for x in visitor.matches)
+
+
+def test_index_def() -> None:
+    assert_index_match("def", SRC)
+
+
+def test_index_def_name() -> None:
+    assert_index_match("def $*connect", SRC)
+
+
+def test_index_def_first_arg() -> None:
+    assert_index_match("def (^$self)", SRC)
+
+
+def test_index_call_args() -> None:
+    assert_index_match("call (args=2)", SRC)
+
+
+def test_index_class() -> None:
+    assert_index_match("class $Pool", SRC)
+
+
+def test_index_pattern_set() -> None:
+    node = parse_patterns(["def $*connect", "call $flush"])
+    hits = build_index(SRC).query(node)
+
+    assert sorted(x.lineno for x in hits["mod.py"]) == [4, 6, 9]
+
+
+def test_index_ident_short() -> None:
+    assert_index_match("$po", SRC)
+
+
+def test_index_freshness(tmp_path: Path) -> None:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text(SRC)
+    st = os.stat(filepath)
+
+    index = StructuralIndex(str(tmp_path))
+    index.add_file(str(filepath), (st.st_size, st.st_mtime_ns), [])
+    assert index.is_fresh([str(filepath)])
+
+    filepath.write_text(SRC + "\nx = 1\n")
+    assert not index.is_fresh([str(filepath)])
+
+
+def test_index_remove_file() -> None:
+    index = build_index(SRC)
+    index.remove_file("mod.py")
+
+    assert index.query(parse("def")) == {}
+    assert index.tables["def"].grams == {}
+
+
+def test_index_journal_replay(tmp_path: Path) -> None:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text(SRC)
+    index_file = str(tmp_path / "index.pickle")
+
+    index = StructuralIndex(str(tmp_path))
+    collector = SymbolCollector(str(filepath))
+    collector.visit(ast.parse(SRC))
+    index.add_file(str(filepath), (0, 0), collector.entries)
+    index.save(index_file)
+
+    index.remove_file(str(filepath))
+    index.save(index_file)
+    assert os.path.exists(index_file + ".log")
+
+    loaded = StructuralIndex.load(index_file)
+    assert loaded is not None
+    assert loaded.query(parse("def")) == {}
+
+
+def test_index_changes(tmp_path: Path) -> None:
+    kept = tmp_path / "kept.py"
+    kept.write_text(SRC)
+    st = os.stat(kept)
+
+    index = StructuralIndex(str(tmp_path))
+    index.add_file(str(kept), (st.st_size, st.st_mtime_ns), [])
+    index.add_file(str(tmp_path / "gone.py"), (0, 0), [])
+
+    added = tmp_path / "added.py"
+    added.write_text(SRC)
+
+    stale, deleted = index.changes([str(kept), str(added)], str(tmp_path))
+    assert stale == [str(added)]
+    assert deleted == [str(tmp_path / "gone.py")]
+
+
+def test_index_qualified_call(tmp_path: Path) -> None:
+    pkg = tmp_path / "pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("from .util import helper\n")
+    (pkg / "util.py").write_text("def helper():\n    pass\n")
+    (tmp_path / "app.py").write_text(
+        "import pkg\nfrom pkg import util\npkg.helper()\nutil.helper()\nhelper()\n"
+    )
+
+    index = StructuralIndex(str(tmp_path))
+    for filepath in pkg / "__init__.py", pkg / "util.py", tmp_path / "app.py":
+        filename, stamp, entries, exports, _ = index_file((str(filepath), None))
+        index.add_file(filename, stamp, entries, exports)
+
+    pattern = index.qualify(parse("call $pkg.util.helper"))
+    hits = index.query(pattern)
+
+    # pkg.helper only reaches pkg.util.helper through pkg/__init__.py
+    assert pattern.fname.aliases == ("app.util.helper", "pkg.helper")  # type: ignore
+    assert sorted(x.lineno for x in hits[str(tmp_path / "app.py")]) == [3, 4]
+
+
+def test_qualified_call_without_index(tmp_path: Path) -> None:
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("from pkg.mod import func\n")
+    (tmp_path / "pkg" / "mod.py").write_text("def func():\n    pass\n")
+    (tmp_path / "app.py").write_text(
+        "import pkg\nimport pkg.mod\nfrom pkg import func\n"
+        "pkg.func()\nfunc()\npkg.mod.func()\n"
+    )
+    args = ("--no-daemon", "-c", "call $pkg.mod.func", ".")
+
+    assert sgrep(tmp_path, "--no-index", *args) == "3\n"
+    sgrep(tmp_path, "index", ".")
+    assert sgrep(tmp_path, *args) == "3\n"
+
+
+def test_index_covers_root_only(tmp_path: Path) -> None:
+    index = StructuralIndex(str(tmp_path / "a"))
+
+    assert index.covers(str(tmp_path / "a" / "x.py"))
+    assert not index.covers(str(tmp_path / "b"))
+    assert not index.covers(str(tmp_path / "ab"))
+
+
+def test_search_outside_index_walks(tmp_path: Path) -> None:
+    for name in ("a/x.py", "b/y.py"):
+        (tmp_path / name).parent.mkdir()
+        (tmp_path / name).write_text("def close():\n    pass\n")
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+
+    sgrep(tmp_path, "index", "a")
+    index = StructuralIndex.load(str(tmp_path / CACHE_DIR / INDEX_FILE))
+    assert index and index.files_under(str(tmp_path)) == [str(tmp_path / "a/x.py")]
+
+    assert "y.py" in sgrep(tmp_path, "--no-daemon", "--git", "-l", "def $close", "b")
+    # and the search of b left the index alone
+    index = StructuralIndex.load(str(tmp_path / CACHE_DIR / INDEX_FILE))
+    assert index and index.files_under(str(tmp_path)) == [str(tmp_path / "a/x.py")]
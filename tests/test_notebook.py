@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+from src.cache import ParseCache
+from src.match import MatchPatterns
+from src.notebook import cell_location, extract_cells, parse_source, strip_magics
+from src.search import FileError, SearchConfig, match_file
+from tests.utils import parse
+
+CELLS = [
+    {"cell_type": "markdown", "metadata": {}, "source": ["def fake():\n"]},
+    {
+        "cell_type": "code",
+        "metadata": {},
+        "outputs": [
+            {
+                "output_type": "display_data",
+                "data": {
+                    "image/png": "iVBORw0KGgo" * 500,
+                    "text/plain": ['def not_code(): "\\"]"'],
+                },
+            }
+        ],
+        "source": ["%matplotlib inline\n", "def load(path):\n", "    return path\n"],
+    },
+    {
+        "cell_type": "code",
+        "metadata": {},
+        "outputs": [],
+        "source": ["%%bash\n", "def broken(:\n"],
+    },
+    {
+        "cell_type": "code",
+        "metadata": {},
+        "outputs": [],
+        "source": ["files = !ls\n", "load?\n", "data = load(files)"],
+    },
+]
+
+
+def write_notebook(tmp_path: Path) -> str:
+    filepath = tmp_path / "analysis.ipynb"
+    filepath.write_text(json.dumps({"cells": CELLS, "nbformat": 4}, indent=1))
+    return str(filepath)
+
+
+def test_extract_code_cells() -> None:
+    raw = json.dumps({"metadata": {}, "cells": CELLS}).encode()
+
+    assert [number for number, _ in extract_cells(raw)] == [2, 3, 4]
+    assert extract_cells(raw)[0][1].startswith("%matplotlib")
+
+
+def test_strip_magics() -> None:
+    code = "%time x = 1\nfiles = !ls\nf?\n  !echo\nprint('?')\n"
+
+    assert strip_magics(code) == "pass\nfiles = None\npass\n  pass\nprint('?')\n"
+
+    # only at the start of a logical line
+    code = 'msg = ("hello %s"\n       % name)\ns = """\n!x\n"""\ny = 1 + \\\n  !x\n'
+    assert strip_magics(code) == code
+
+
+def test_locations(tmp_path: Path) -> None:
+    filepath = write_notebook(tmp_path)
+    config = SearchConfig(parse("def"))
+
+    result = match_file(filepath, config, MatchPatterns.create(config.pattern), [])
+
+    # the %%bash cell is skipped, the cells around it still searched
+    assert [x.snippet for x in result.matches] == ["def load(path):"]  # type: ignore
+    assert "cell 2:line 2:" in result.format()  # type: ignore
+    assert cell_location(result.cells, 8) == (4, 3)  # type: ignore
+
+
+def test_cells_cached(tmp_path: Path) -> None:
+    filepath = write_notebook(tmp_path)
+    cache = ParseCache(str(tmp_path / "cache"))
+
+    _, first, _ = parse_source(filepath, cache)
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    CELLS.append({"cell_type": "code", "outputs": [], "source": "x = 1\n"})
+    try:
+        _, second, _ = parse_source(write_notebook(tmp_path), cache)
+    finally:
+        CELLS.pop()
+
+    # only the new cell is parsed, and the broken one retried
+    assert (cache.hits, cache.misses) == (2, 5)
+    assert len(second.body) == len(first.body) + 1  # type: ignore[attr-defined]
+
+
+def test_broken_cell_fails_notebook(tmp_path: Path) -> None:
+    CELLS.append({"cell_type": "code", "outputs": [], "source": "def broken(:\n"})
+    try:
+        filepath = write_notebook(tmp_path)
+    finally:
+        CELLS.pop()
+    config = SearchConfig(parse("def"))
+
+    result = match_file(filepath, config, MatchPatterns.create(config.pattern), [])
+
+    assert isinstance(result, FileError)
+    assert result.message.startswith("cell 5:")
@@ -1,8 +1,12 @@
+import ast
 from src.parse import Func
+from src.match import MatchPatterns
+from src.search import parse_patterns
 from tests.utils import (
     assert_match,
     assert_first_match,
-    check_file
+    check_file,
+    parse
 )
 
 def test_empty() -> None:
@@ -125,4 +129,99 @@ add(1, add(2, 3))
 add(1, 3)
 z = add(x, y)
 format(x, y, z)''',
-                    4, "add")
\ No newline at end of file
+                    4, "add")
+
+def test_match_limit() -> None:
+    visitor = MatchPatterns.create(parse("def"))
+    matches = visitor.search(ast.parse('''
+def one():
+    pass
+
+def two():
+    pass
+
+def three():
+    pass'''), limit=2)
+
+    assert [x.name for x in matches] == ["one", "two"]
+
+def test_name_predicates() -> None:
+    src = '''
+some = 1
+something = 2
+wholesome = 3
+awesomely = 4'''
+
+    assert_match("$some", src, 1)
+    assert_match("$some*", src, 2)
+    assert_match("$*some", src, 2)
+    assert_match("$*some*", src, 4)
+
+def test_nested_class_match() -> None:
+    assert_first_match("class $Two",
+                       '''
+class Other:
+    class Two:
+        pass''',
+                    1, "Two")
+
+def test_pattern_set_single_pass() -> None:
+    visitor = MatchPatterns.create(parse_patterns(["call $eval", "def (^$self)"]))
+    matches = visitor.search_tagged(ast.parse('''
+class Loader:
+    def load(self, src):
+        return eval(src)'''))
+
+    assert [(tag, type(x).__name__) for tag, x in matches] == [
+        ("def (^$self)", "FunctionDef"),
+        ("call $eval", "Call"),
+    ]
+
+NESTED_SRC = '''
+class Pool:
+    def close(self):
+        self.sock.close()
+
+    def close_all(self):
+        def closer():
+            close(self)
+
+def close():
+    run(close(1))'''
+
+def test_nested_child() -> None:
+    assert_match("class $Pool > def $close*", NESTED_SRC, 2)
+    assert_match("class $Pool > def > def", NESTED_SRC, 1)
+
+def test_nested_descendant() -> None:
+    assert_match("class $Pool >> def $close*", NESTED_SRC, 3)
+    assert_match("def >> call $close", NESTED_SRC, 3)
+    assert_match("call $run > call $close", NESTED_SRC, 1)
+
+def test_nested_excludes_header() -> None:
+    src = '''
+@app.route("/x")
+def handler(x=default(), y: hint() = 1):
+    route(x)
+
+class Foo(make_base(), metaclass=meta()):
+    pass
+
+outer(inner()).callee()'''
+    assert_match("def $handler > call $route", src, 1)
+    assert_match("def > call $default", src, 0)
+    assert_match("def > call $hint", src, 0)
+    assert_match("class $Foo > call $make_base", src, 0)
+    assert_match("class $Foo > call $meta", src, 0)
+    assert_match("call $outer > call $inner", src, 1)
+    assert_match("call $callee > call $outer", src, 0)
+
+def test_pattern_set_with_nested() -> None:
+    visitor = MatchPatterns.create(parse_patterns(["class > def", "call $run"]))
+    matches = visitor.search_tagged(ast.parse(NESTED_SRC))
+
+    assert [(tag, x.lineno) for tag, x in matches] == [
+        ("class > def", 3),
+        ("class > def", 6),
+        ("call $run", 11),
+    ]
@@ -1,5 +1,7 @@
-from src.parse import SIdent, Func, Args, KW, Parser, Tokenize
-from tests.utils import assert_parse
+import pytest
+from src.parse import SIdent, Func, Class, Args, KW, Nested, Parser, Tokenize
+from src.parse import SgrepParseError
+from tests.utils import assert_parse, parse
 
 def test_ident_w_wildcard() -> None:
     assert_parse("$*", SIdent("*", True, False, False))
@@ -24,4 +26,30 @@ def test_non_func_kw() -> None:
     assert_parse("if", KW("if", None))
 
 def test_func_w_args() -> None:
-    assert_parse("def (args=5, ^$self)", Func(None, Args(5, SIdent("self", False, False, False), []), False))
\ No newline at end of file
+    assert_parse("def (args=5, ^$self)", Func(None, Args(5, SIdent("self", False, False, False), []), False))
+
+def test_literals() -> None:
+    assert parse("def $connect*").literals() == ["def", "connect"]
+    assert parse("call $execute").literals() == ["(", "execute"]
+    assert parse("def $connect (^$self)").literals() == ["def"]
+    assert parse("$*").literals() == []
+
+def test_nested() -> None:
+    got = parse("class $*Pool > def $close* >> call")
+
+    assert isinstance(got, Nested)
+    assert [type(x) for x in got.steps] == [Class, Func, Func]
+    assert got.direct == [True, False]
+    assert got.literals() == ["(", "Pool", "class", "close", "def"]
+
+def test_nested_needs_container() -> None:
+    with pytest.raises(SgrepParseError):
+        parse("$x > call")
+
+def test_qualified_call() -> None:
+    assert_parse("call $requests.get", Func(SIdent("requests.get", False, False, False), None, True))
+    assert parse("call $pkg.mod.*").fname == SIdent("pkg.mod.", False, True, False)  # type: ignore
+    assert parse("call $requests.get").literals() == ["("]
+
+    with pytest.raises(SgrepParseError):
+        parse("def $pkg.func")
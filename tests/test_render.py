@@ -0,0 +1,68 @@
+import ast
+from src.match import MatchPatterns
+from src.render import Rendering, SourceLines, render_file
+from src.search import Result
+from tests.utils import parse
+
+SRC = b'''import os
+
+
+@cached
+def connect(
+    host,  # where to
+    port,
+):
+    # dial out
+    return open_socket(host, port)
+
+
+class Pool:  # keeps connections
+    size = 4
+'''
+
+
+def render(cmd: str, rendering: Rendering) -> Result:
+    tagged = MatchPatterns.create(parse(cmd)).search_tagged(ast.parse(SRC))
+    return Result("mod.py", *render_file(tagged, SRC, rendering))
+
+
+def test_header_only() -> None:
+    result = render("def", Rendering())
+
+    assert [(x.lineno, x.snippet) for x in result.matches] == [
+        (5, "def connect(\n    host,  # where to\n    port,\n):")
+    ]
+    assert render("class", Rendering()).matches[0].snippet == (
+        "class Pool:  # keeps connections"
+    )
+
+
+def test_header_before_decorated_body() -> None:
+    src = b"class Foo(Base):\n\n    @property\n    def size(self):\n        return 4\n"
+    tagged = MatchPatterns.create(parse("class")).search_tagged(ast.parse(src))
+
+    (match,), _ = render_file(tagged, src, Rendering())
+
+    assert match.snippet == "class Foo(Base):"
+
+
+def test_full_body() -> None:
+    snippet = render("class", Rendering(full=True)).matches[0].snippet
+
+    assert snippet == "class Pool:  # keeps connections\n    size = 4"
+
+
+def test_context_lines() -> None:
+    result = render("call $open_socket", Rendering(before=1, after=1))
+
+    assert result.context == {9: "    # dial out", 11: ""}
+    assert "10:" in result.format()
+    assert "9-" in result.format()
+
+
+def test_source_lines_encoding() -> None:
+    lines = SourceLines(b"# -*- coding: latin-1 -*-\r\nname = 'caf\xe9'\rx = 1\n")
+
+    assert len(lines) == 3
+    assert lines.line(2) == "name = 'café'"
+    assert lines.line(3) == "x = 1"
@@ -0,0 +1,237 @@
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Iterator
+import pytest
+from click.testing import CliRunner
+from src.discover import walk_files
+from src.main import cli
+from src.search import (
+    COUNT_DIR,
+    COUNT_NAME,
+    COUNT_PATTERN,
+    EXECUTORS,
+    IN_PROCESS_BYTES,
+    LOOKAHEAD_FILES,
+    MAX_CHUNK_BYTES,
+    MIN_CHUNK_BYTES,
+    MMAP_THRESHOLD,
+    STREAM_CHUNK_BYTES,
+    FileError,
+    SearchConfig,
+    batch_files,
+    batch_target,
+    file_sizes,
+    init_worker,
+    is_small,
+    largest_first,
+    parse_patterns,
+    proc_batch,
+    read_candidate,
+    search_files,
+    _worker,
+)
+from tests.utils import parse
+
+
+@pytest.fixture(autouse=True)
+def worker_state() -> Iterator[None]:
+    # tests calling init_worker set up this thread as a worker, with their
+    # own budgets and counting; the tests after them shouldn't inherit it
+    yield
+    _worker.__dict__.clear()
+
+
+def write_files(tmp_path: Path, sizes: list[int]) -> list[str]:
+    files = []
+    for i, size in enumerate(sizes):
+        filepath = tmp_path / f"mod{i}.py"
+        filepath.write_text("#" * size)
+        files.append(str(filepath))
+    return files
+
+
+def test_batch_small_files_together(tmp_path: Path) -> None:
+    entries = file_sizes(write_files(tmp_path, [10] * 20))
+    target = batch_target(entries, 4)
+
+    assert list(batch_files(entries, target)) == [[x for x, _ in entries]]
+
+
+def test_batch_large_files_apart(tmp_path: Path) -> None:
+    entries = file_sizes(write_files(tmp_path, [MIN_CHUNK_BYTES] * 3))
+    target = batch_target(entries, 4)
+
+    assert list(batch_files(entries, target)) == [[x] for x, _ in entries]
+
+
+def test_batch_target_bounds() -> None:
+    assert batch_target([("a.py", 1)], 4) == MIN_CHUNK_BYTES
+    assert batch_target([("a.py", MAX_CHUNK_BYTES * 100)], 1) == MAX_CHUNK_BYTES
+
+
+def test_batch_isolates_results(tmp_path: Path) -> None:
+    first = tmp_path / "first.py"
+    first.write_text("def one():\n    pass\n")
+    second = tmp_path / "second.py"
+    second.write_text("x = 1\n")
+
+    init_worker(SearchConfig(parse("def")))
+    results = proc_batch([str(first), str(second)])
+
+    assert [len(x.matches) for x in results] == [1, 0]
+
+
+def test_is_small() -> None:
+    small = [("a.py", 10), ("b.py", 20)]
+    assert is_small(small) == (small, True)
+    assert is_small(iter(small)) == (small, True)
+
+    # a large stream is read no further than the threshold
+    big = iter([("a.py", IN_PROCESS_BYTES), ("b.py", 1), ("c.py", 1)])
+    entries, found = is_small(big)
+    assert not found
+    assert next(big) == ("b.py", 1)
+    assert list(entries) == [("a.py", IN_PROCESS_BYTES), ("c.py", 1)]
+
+
+def test_executors_agree(tmp_path: Path) -> None:
+    for i in range(6):
+        (tmp_path / f"mod{i}.py").write_text(f"def f{i}(x):\n    return g(x)\n" * i)
+
+    found = {}
+    for executor in EXECUTORS:
+        config = SearchConfig(parse("def"), jobs=2, executor=executor)
+        results = search_files(walk_files(str(tmp_path)), config)
+        found[executor] = sorted((x.filename, len(x.matches)) for x in results)
+
+    assert len(found["serial"]) == 6
+    assert found["process"] == found["thread"] == found["serial"]
+
+
+def test_read_candidate(tmp_path: Path) -> None:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text("def connect(host):\n    pass\n")
+
+    assert read_candidate(str(filepath), [b"def", b"connect"])
+    assert read_candidate(str(filepath), [b"def", b"execute"]) is None
+    assert read_candidate(str(filepath), []) == filepath.read_bytes()
+
+
+def test_read_candidate_mmap(tmp_path: Path) -> None:
+    filepath = tmp_path / "big.py"
+    filepath.write_text("#" * MMAP_THRESHOLD + "\ndef connect():\n    pass\n")
+
+    assert read_candidate(str(filepath), [b"connect"]) == filepath.read_bytes()
+    assert read_candidate(str(filepath), [b"execute"]) is None
+
+
+def test_proc_file_encodings(tmp_path: Path) -> None:
+    latin = tmp_path / "latin.py"
+    latin.write_bytes(b"# -*- coding: latin-1 -*-\ndef caf\xe9():\n    pass\n")
+    bom = tmp_path / "bom.py"
+    bom.write_bytes(b"\xef\xbb\xbfdef run():\n    pass\n")
+
+    init_worker(SearchConfig(parse("def")))
+    results = proc_batch([str(latin), str(bom)])
+
+    assert [len(x.matches) for x in results] == [1, 1]
+
+
+def test_proc_file_errors(tmp_path: Path) -> None:
+    broken = tmp_path / "broken.py"
+    broken.write_text("def (:\n")
+    undecodable = tmp_path / "undecodable.py"
+    undecodable.write_bytes(b"def f():\n    return '\xff'\n")
+    valid = tmp_path / "valid.py"
+    valid.write_text("def one():\n    pass\n")
+
+    init_worker(SearchConfig(parse("def")))
+    results = proc_batch([str(broken), str(undecodable), str(valid)])
+
+    assert isinstance(results[0], FileError)
+    assert isinstance(results[1], FileError)
+    assert len(results[2].matches) == 1
+
+
+def test_largest_first() -> None:
+    entries = [("a.py", 10), ("b.py", MAX_CHUNK_BYTES), ("c.py", 20)]
+
+    assert list(largest_first(iter(entries))) == [["b.py"], ["c.py", "a.py"]]
+
+
+def test_largest_first_streams() -> None:
+    stream = iter([(f"{i}.py", STREAM_CHUNK_BYTES) for i in range(LOOKAHEAD_FILES * 2)])
+
+    first = next(largest_first(stream))
+
+    # the first batch goes out once a window is read, not the whole walk
+    assert first == ["0.py"]
+    assert next(stream) == (f"{LOOKAHEAD_FILES}.py", STREAM_CHUNK_BYTES)
+
+
+def test_time_budget(tmp_path: Path) -> None:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text("def one():\n    pass\n")
+
+    init_worker(SearchConfig(parse("def"), timeout=1e-6))
+    (result,) = proc_batch([str(filepath)])
+
+    assert isinstance(result, FileError)
+    assert "took over" in result.message
+
+
+def test_memory_budget_spares_parent(tmp_path: Path) -> None:
+    filepath = tmp_path / "mod.py"
+    filepath.write_text("x = 1\n")
+
+    # a byte would fail any file, were this process capped
+    init_worker(SearchConfig(parse("$x"), max_memory=1))
+    (result,) = proc_batch([str(filepath)])
+
+    assert len(result.matches) == 1  # type: ignore
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="RLIMIT_AS is enforced on Linux")
+def test_memory_budget(tmp_path: Path) -> None:
+    big = tmp_path / "big.py"
+    big.write_text("x = [" + "1, " * 200_000 + "]\n")
+    small = tmp_path / "small.py"
+    small.write_text("x = 1\n")
+
+    config = SearchConfig(
+        parse("$x"), jobs=2, executor="process", max_memory=16 * 1024 * 1024
+    )
+    results = search_files(file_sizes([str(small), str(big)]), config)
+
+    found = {x.filename: x for x in results}
+    assert isinstance(found[str(big)], FileError)
+    assert len(found[str(small)].matches) == 1
+
+
+def test_count_by_reduces_batches(tmp_path: Path) -> None:
+    (tmp_path / "pkg").mkdir()
+    first = tmp_path / "pkg" / "a.py"
+    first.write_text("run(x)\nrun(y)\ndb.execute(q)\n")
+    second = tmp_path / "pkg" / "b.py"
+    second.write_text("def run():\n    execute()\n")
+    batch = [str(first), str(second)]
+
+    init_worker(SearchConfig(parse("call $*"), count_by=COUNT_NAME))
+    assert proc_batch(batch) == [Counter({"run": 2, "execute": 2})]
+
+    init_worker(SearchConfig(parse("call $*"), count_by=COUNT_DIR))
+    assert proc_batch(batch) == [Counter({str(tmp_path / "pkg"): 4})]
+
+    patterns = parse_patterns(["def", "call $run"])
+    init_worker(SearchConfig(patterns, count_by=COUNT_PATTERN))
+    assert proc_batch(batch) == [Counter({"call $run": 2, "def": 1})]
+
+
+def test_top_needs_count_by(tmp_path: Path) -> None:
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["search", "--top", "3", "def", str(tmp_path)])
+
+    assert result.exit_code == 2
+    assert "--top need --count-by" in result.output
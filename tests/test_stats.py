@@ -0,0 +1,48 @@
+from pathlib import Path
+from src.discover import walk_files
+from src.search import SearchConfig, search_files
+from src.stats import SLOWEST_FILES, SearchStats
+from tests.utils import parse
+
+
+def test_merge_keeps_slowest() -> None:
+    first = SearchStats(files=1)
+    second = SearchStats(files=2)
+    for i in range(SLOWEST_FILES):
+        first.add_parse(f"a{i}.py", i)
+        second.add_parse(f"b{i}.py", i + 0.5)
+
+    first.merge(second)
+
+    assert first.files == 3
+    assert len(first.slowest) == SLOWEST_FILES
+    assert max(first.slowest) == (SLOWEST_FILES - 0.5, f"b{SLOWEST_FILES - 1}.py")
+    assert min(first.slowest)[0] >= SLOWEST_FILES / 2
+
+
+def test_search_collects_worker_stats(tmp_path: Path) -> None:
+    for i in range(6):
+        (tmp_path / f"mod{i}.py").write_text(f"def f{i}():\n    pass\n")
+    (tmp_path / "other.py").write_text("x = 1\n")
+
+    stats = SearchStats()
+    config = SearchConfig(parse("def"), jobs=2)
+    results = list(search_files(walk_files(str(tmp_path)), config, stats=stats))
+
+    assert len(results) == 7
+    assert stats.files == 7
+    assert stats.skipped == 1
+    assert stats.matches == 6
+    assert {"wait", "read", "parse", "match"} <= set(stats.phases)
+    assert len(stats.slowest) == 6
+
+
+def test_stats_count_chosen_workers(tmp_path: Path) -> None:
+    (tmp_path / "mod.py").write_text("def f():\n    pass\n")
+
+    stats = SearchStats()
+    config = SearchConfig(parse("def"), jobs=4)
+    list(search_files(walk_files(str(tmp_path)), config, stats=stats))
+
+    # too small for a pool, so it ran in-process
+    assert stats.report(1.0)["workers"] == 1
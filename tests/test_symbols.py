@@ -0,0 +1,84 @@
+import ast
+from pathlib import Path
+from src.symbols import ModuleSymbols, Resolver, module_name
+
+SRC = '''
+import requests
+from requests import get as fetch
+from .util import helper
+
+session = requests.Session()
+
+class Client(requests.Session):
+    def __init__(self, http):
+        self.http = http
+        self.pool = requests.adapters.HTTPAdapter()
+
+    def run(self, url):
+        self.pool.send(url)
+        self.get(url)
+        self.run(url)
+
+def main(requests):
+    requests.get()
+    s = session
+    s.post()
+    fetch()
+    helper()
+'''
+
+
+def resolved(src: str) -> list[tuple[int, str]]:
+    symbols = ModuleSymbols(ast.parse(src), "pkg.mod", "pkg")
+    return sorted((node.lineno, name) for name, node in symbols.calls)
+
+
+def test_resolve_calls() -> None:
+    assert resolved(SRC) == [
+        (6, "requests.Session"),
+        (11, "requests.adapters.HTTPAdapter"),
+        (14, "requests.adapters.HTTPAdapter.send"),
+        (15, "requests.Session.get"),
+        (16, "pkg.mod.Client.run"),
+        # a parameter shadows the import, so line 19 doesn't resolve
+        (21, "requests.Session.post"),
+        (22, "requests.get"),
+        (23, "pkg.util.helper"),
+    ]
+
+
+def test_exports() -> None:
+    symbols = ModuleSymbols(ast.parse(SRC), "pkg.mod", "pkg")
+
+    assert symbols.exports == {
+        "fetch": "requests.get",
+        "helper": "pkg.util.helper",
+    }
+
+
+def test_resolver_aliases() -> None:
+    resolver = Resolver(
+        [
+            ("pkg", {"helper": "pkg.util.helper", "tools": "pkg.util"}),
+            ("app", {"run": "pkg.helper"}),
+        ]
+    )
+
+    assert resolver.aliases("pkg.util.helper") == [
+        "app.run",
+        "pkg.helper",
+        "pkg.tools.helper",
+    ]
+
+
+def test_module_name(tmp_path: Path) -> None:
+    (tmp_path / "pkg" / "sub").mkdir(parents=True)
+    (tmp_path / "pkg" / "__init__.py").touch()
+    (tmp_path / "pkg" / "sub" / "__init__.py").touch()
+
+    assert module_name(str(tmp_path / "pkg" / "sub" / "mod.py")) == (
+        "pkg.sub.mod",
+        "pkg.sub",
+    )
+    assert module_name(str(tmp_path / "pkg" / "__init__.py")) == ("pkg", "pkg")
+    assert module_name(str(tmp_path / "script.py")) == ("script", "")